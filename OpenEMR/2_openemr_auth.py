@@ -20,6 +20,10 @@ from cryptography.hazmat.primitives import serialization
 import base64
 import hashlib
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fhirkit.tokens import TokenStore, read_env, update_env  # noqa: E402
 
 # Disable SSL warnings for self-signed certificates
 import urllib3
@@ -101,22 +105,17 @@ class OpenEMRAuth:
     def __init__(self):
         self.config = Config()
         self.jwks = generate_jwks()
+        self.expires_in = None
         self.load_env()
         if not self.config.CODE_VERIFIER:
             self.config.CODE_VERIFIER = base64.urlsafe_b64encode(os.urandom(32)).decode('utf-8').rstrip('=')
 
     def load_env(self):
         try:
-            if os.path.exists('.env'):
-                with open('.env', 'r') as f:
-                    for line in f:
-                        if '=' in line:
-                            k, v = line.strip().split('=', 1)
-                            if self.config.APP_TYPE == 'private':
-                                if k == 'CLIENT_ID':
-                                    self.config.CLIENT_ID = v
-                                elif k == 'CLIENT_SECRET':
-                                    self.config.CLIENT_SECRET = v
+            env = read_env('.env')
+            if self.config.APP_TYPE == 'private':
+                self.config.CLIENT_ID = env.get('CLIENT_ID') or self.config.CLIENT_ID
+                self.config.CLIENT_SECRET = env.get('CLIENT_SECRET') or self.config.CLIENT_SECRET
         except Exception:
             pass
 
@@ -141,7 +140,7 @@ class OpenEMRAuth:
 
         print(f"POST {url}")
         try:
-            response = requests.post(url, json=payload, verify=False)
+            response = requests.post(url, json=payload, verify=False, timeout=30)
             print(f"Status: {response.status_code}")
 
             if response.status_code == 201 or response.status_code == 200:
@@ -152,8 +151,11 @@ class OpenEMRAuth:
                 print("✅ Registration Successful")
                 # Persist client to .env for enabling in UI
                 try:
-                    with open('.env', 'w') as f:
-                        f.write(f"OPENEMR_BASE_URL={self.config.BASE_URL}\nCLIENT_ID={self.config.CLIENT_ID}\nCLIENT_SECRET={self.config.CLIENT_SECRET or ''}\n")
+                    update_env('.env', {
+                        'OPENEMR_BASE_URL': self.config.BASE_URL,
+                        'CLIENT_ID': self.config.CLIENT_ID,
+                        'CLIENT_SECRET': self.config.CLIENT_SECRET or '',
+                    })
                     print("📝 Client credentials saved to .env. Ensure the client is enabled in Admin → System → API Clients.")
                 except Exception:
                     pass
@@ -231,35 +233,35 @@ class OpenEMRAuth:
             payload["client_id"] = self.config.CLIENT_ID
             if self.config.CLIENT_SECRET:
                 payload["client_secret"] = self.config.CLIENT_SECRET
-            response = requests.post(url, data=payload, headers=headers, verify=False)
+            response = requests.post(url, data=payload, headers=headers, verify=False, timeout=30)
             print(f"Status: {response.status_code}")
 
             if response.status_code == 200:
                 data = response.json()
                 print("Body: " + json.dumps(data, indent=2))
                 access_token = data.get("access_token")
+                refresh_token = data.get("refresh_token", "")
+                self.expires_in = data.get("expires_in")
                 print("✅ Access Token Received")
-                return access_token
+                return access_token, refresh_token
             else:
                 print("Body: " + json.dumps(response.json(), indent=2))
                 print("❌ Error: Token exchange failed")
-                return None
+                return None, None
         except Exception as e:
             print(f"❌ Exception: {e}")
-            return None
+            return None, None
 
-    def save_to_env(self, access_token):
+    def save_to_env(self, access_token, refresh_token=""):
         print(f"\n{'='*80}\nSTEP 4: Save Credentials to .env\n{'='*80}")
 
-        env_content = f"""OPENEMR_BASE_URL={self.config.BASE_URL}
-CLIENT_ID={self.config.CLIENT_ID}
-CLIENT_SECRET={self.config.CLIENT_SECRET}
-ACCESS_TOKEN={access_token}
-"""
-        with open(".env", "w") as f:
-            f.write(env_content)
+        # Atomic, locked update; running load workers pick the new token up from the shared record
+        TokenStore.open('.env').publish(access_token, self.expires_in, refresh_token, extra={
+            'OPENEMR_BASE_URL': self.config.BASE_URL,
+            'CLIENT_ID': self.config.CLIENT_ID,
+            'CLIENT_SECRET': self.config.CLIENT_SECRET,
+        })
 
-        import os
         print(f"✅ Credentials saved to {os.path.abspath('.env')}")
 
 def main():
@@ -269,9 +271,9 @@ def main():
     if auth.register_application():
         code = auth.get_authorization_code()
         if code:
-            token = auth.exchange_code_for_token(code)
+            token, refresh_token = auth.exchange_code_for_token(code)
             if token:
-                auth.save_to_env(token)
+                auth.save_to_env(token, refresh_token)
 
 if __name__ == "__main__":
     main()
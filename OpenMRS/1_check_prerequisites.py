@@ -3,7 +3,11 @@
 Quick validation script to check if OpenMRS is ready for API testing
 """
 
+import argparse
+import importlib
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -25,90 +29,161 @@ def check_dependencies():
     try:
         import requests
         print(f"   ✅ requests {requests.__version__}")
-        return True
     except ImportError:
         print("   ❌ requests not installed")
         print("      Run: pip3 install -r requirements.txt")
         return False
-
-def check_openmrs_connection():
+    for package, command in (('numpy', 'ingest'), ('pyarrow', 'export')):
+        try:
+            module = importlib.import_module(package)
+            print(f"   ✅ {package} {module.__version__} (optional)")
+        except ImportError:
+            print(f"   ⚠️  {package} not installed (optional: needed by `4_openmrs_tools.py {command}` only)")
+    return True
+
+def check_openmrs_connection(log=print, strict=False):
     """Check if OpenMRS is accessible"""
-    print("\n🔍 Checking OpenMRS connection...")
+    log("\n🔍 Checking OpenMRS connection...")
     url = "https://localhost:8443"
 
     try:
         response = requests.get(url, verify=False, timeout=10)
         if response.status_code in [200, 302, 301, 401]:
-            print(f"   ✅ OpenMRS is accessible at {url}")
+            log(f"   ✅ OpenMRS is accessible at {url}")
             return True
         else:
             # Check if API subpath works even if root doesn't (common in container startup)
             api_check = requests.get(f"{url}/ws/fhir2/R4/metadata", verify=False, timeout=10)
             if api_check.status_code in [200, 401]:
-                print(f"   ✅ OpenMRS (API only) is accessible at {url}")
+                log(f"   ✅ OpenMRS (API only) is accessible at {url}")
                 return True
 
-            print(f"   ⚠️  OpenMRS responded with status {response.status_code}")
+            log(f"   ⚠️  OpenMRS responded with status {response.status_code}")
             return False
     except requests.exceptions.ConnectionError:
-        print(f"   ❌ Cannot connect to {url}")
-        print("      Make sure OpenMRS is running")
+        log(f"   ❌ Cannot connect to {url}")
+        log("      Make sure OpenMRS is running")
         return False
     except requests.exceptions.Timeout:
-        print(f"   ❌ Connection timeout to {url}")
+        log(f"   ❌ Connection timeout to {url}")
         return False
     except Exception as e:
-        print(f"   ❌ Error: {str(e)}")
+        log(f"   ❌ Error: {str(e)}")
         return False
 
-def check_fhir_endpoint():
-    """Check if FHIR endpoint is accessible"""
-    print("\n🔍 Checking FHIR endpoint...")
+def check_fhir_endpoint(log=print, strict=False):
+    """Check if FHIR endpoint is accessible (strict: only known-good statuses pass)"""
+    log("\n🔍 Checking FHIR endpoint...")
     url = "https://localhost:8443/ws/fhir2/R4/metadata"
 
     try:
         response = requests.get(url, verify=False, timeout=10)
         # 401 is expected without auth, but means endpoint exists
         if response.status_code in [200, 401]:
-            print(f"   ✅ FHIR endpoint is accessible")
+            log(f"   ✅ FHIR endpoint is accessible")
             return True
         elif response.status_code == 404:
-            print(f"   ❌ FHIR endpoint not found (404)")
-            print("      Make sure FHIR2 module is installed and enabled in OpenMRS")
+            log(f"   ❌ FHIR endpoint not found (404)")
+            log("      Make sure FHIR2 module is installed and enabled in OpenMRS")
+            return False
+        elif response.status_code >= 500:
+            log(f"   ❌ FHIR endpoint not ready (status {response.status_code})")
             return False
         else:
-            print(f"   ⚠️  FHIR endpoint responded with status {response.status_code}")
-            return True  # Might still work
+            log(f"   ⚠️  FHIR endpoint responded with status {response.status_code}")
+            return not strict  # Might still work, but --wait holds out for a known status
     except requests.exceptions.ConnectionError:
-        print(f"   ❌ Cannot connect to FHIR endpoint")
+        log(f"   ❌ Cannot connect to FHIR endpoint")
         return False
     except Exception as e:
-        print(f"   ⚠️  Error checking FHIR: {str(e)}")
+        log(f"   ⚠️  Error checking FHIR: {str(e)}")
         return False
 
-def check_oauth_endpoint():
-    """Check if OAuth2 endpoint is accessible"""
-    print("\n🔍 Checking OAuth2 endpoint...")
+def check_oauth_endpoint(log=print, strict=False):
+    """Check if OAuth2 endpoint is accessible (strict: only known-good statuses pass)"""
+    log("\n🔍 Checking OAuth2 endpoint...")
     url = "https://localhost:8443/oauth2/authorize"
 
     try:
         # Check if the endpoint exists by making a request that should redirect due to missing params
         response = requests.get(url, verify=False, timeout=10)
         if response.status_code in [200, 302, 400, 401]:
-            print(f"   ✅ OAuth2 authorization endpoint is accessible")
+            log(f"   ✅ OAuth2 authorization endpoint is accessible")
             return True
         elif response.status_code == 404:
-            print(f"   ❌ OAuth2 endpoint not found (404)")
-            print("      Check if OAuth2 module is installed in OpenMRS")
+            log(f"   ❌ OAuth2 endpoint not found (404)")
+            log("      Check if OAuth2 module is installed in OpenMRS")
+            return False
+        elif response.status_code >= 500:
+            log(f"   ❌ OAuth2 endpoint not ready (status {response.status_code})")
             return False
         else:
-            print(f"   ⚠️  OAuth2 endpoint responded with status {response.status_code}")
-            return True
+            log(f"   ⚠️  OAuth2 endpoint responded with status {response.status_code}")
+            return not strict
     except Exception as e:
-        print(f"   ⚠️  Error checking OAuth2: {str(e)}")
+        log(f"   ⚠️  Error checking OAuth2: {str(e)}")
         return False
 
-def main():
+PROBES = {
+    'connection': check_openmrs_connection,
+    'fhir': check_fhir_endpoint,
+    'oauth': check_oauth_endpoint,
+}
+
+def run_probe(check, strict=False):
+    """Run one endpoint probe, buffering its output and timing it"""
+    lines = []
+    start = time.perf_counter()
+    passed = check(lines.append, strict)
+    return passed, lines, time.perf_counter() - start
+
+def run_probes(names, strict=False):
+    """Run the named probes concurrently; returns {name: (passed, lines, seconds)}"""
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        futures = {name: pool.submit(run_probe, PROBES[name], strict) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+def print_probe(result):
+    passed, lines, elapsed = result
+    for line in lines:
+        print(line)
+    print(f"   ⏱️  {elapsed * 1000:.0f} ms")
+
+def wait_for_ready(names, timeout, initial_delay=1.0, max_delay=15.0):
+    """Re-probe failing endpoints with exponential backoff until all pass or timeout"""
+    print(f"\n⏳ Waiting up to {timeout:.0f}s for: {', '.join(names)}")
+    started = time.monotonic()
+    delay = initial_delay
+    pending = list(names)
+    results = {}
+    attempt = 0
+    while True:
+        attempt += 1
+        # 502/503/504 while a container starts are not "ready", nor is any other odd status
+        results.update(run_probes(pending, strict=True))
+        pending = [n for n in pending if not results[n][0]]
+        status = "  ".join(f"{n} {'✅' if results[n][0] else '❌'} {results[n][2] * 1000:.0f}ms" for n in names)
+        print(f"   [{attempt:>2}] {time.monotonic() - started:>5.1f}s  {status}", flush=True)
+        remaining = timeout - (time.monotonic() - started)
+        if not pending or remaining <= 0:
+            return results
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that OpenMRS is ready for API testing")
+    parser.add_argument('--wait', action='store_true',
+                        help="Poll endpoints with exponential backoff until they are ready")
+    parser.add_argument('--timeout', type=float, default=600,
+                        help="Maximum seconds to wait in --wait mode (default 600)")
+    parser.add_argument('--checks', default=','.join(PROBES),
+                        help=f"Comma-separated endpoint probes to run (default {','.join(PROBES)})")
+    args = parser.parse_args(argv)
+    names = [n.strip() for n in args.checks.split(',') if n.strip()]
+    unknown = [n for n in names if n not in PROBES]
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(unknown)} (choose from {', '.join(PROBES)})")
+
     print("""
 ╔════════════════════════════════════════════════════════════════╗
 ║           OpenMRS API Testing - Prerequisites Check            ║
@@ -118,11 +193,17 @@ def main():
     checks = [
         check_python_version(),
         check_dependencies(),
-        check_openmrs_connection(),
-        check_fhir_endpoint(),
-        check_oauth_endpoint()
     ]
 
+    started = time.monotonic()
+    if args.wait:
+        results = wait_for_ready(names, args.timeout)
+    else:
+        results = run_probes(names)
+    for name in names:
+        print_probe(results[name])
+        checks.append(results[name][0])
+
     print("\n" + "="*70)
     print("SUMMARY")
     print("="*70)
@@ -131,7 +212,7 @@ def main():
     total = len(checks)
 
     if passed == total:
-        print(f"✅ All checks passed ({passed}/{total})")
+        print(f"✅ All checks passed ({passed}/{total}) in {time.monotonic() - started:.1f}s")
         print("\n🚀 You're ready to run: python3 2_openmrs_auth.py")
         return 0
     else:
@@ -140,4 +221,4 @@ def main():
         return 1
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
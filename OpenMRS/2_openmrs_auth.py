@@ -20,6 +20,10 @@ from cryptography.hazmat.primitives import serialization
 import base64
 import hashlib
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fhirkit.tokens import TokenStore, read_env  # noqa: E402
 
 # Disable SSL warnings for self-signed certificates
 import urllib3
@@ -80,23 +84,17 @@ class CallbackHandler(BaseHTTPRequestHandler):
 class OpenMRSAuth:
     def __init__(self):
         self.config = Config()
+        self.expires_in = None
         self.load_env()
         self.config.CODE_VERIFIER, code_challenge = generate_pkce_pair()
         self.code_challenge = code_challenge
 
     def load_env(self):
         try:
-            if os.path.exists('.env'):
-                with open('.env', 'r') as f:
-                    for line in f:
-                        if '=' in line:
-                            k, v = line.strip().split('=', 1)
-                            if k == 'CLIENT_ID':
-                                self.config.CLIENT_ID = v
-                            elif k == 'CLIENT_SECRET':
-                                self.config.CLIENT_SECRET = v
-                            elif k == 'OPENMRS_BASE_URL':
-                                self.config.BASE_URL = v
+            env = read_env('.env')
+            self.config.CLIENT_ID = env.get('CLIENT_ID') or self.config.CLIENT_ID
+            self.config.CLIENT_SECRET = env.get('CLIENT_SECRET') or self.config.CLIENT_SECRET
+            self.config.BASE_URL = env.get('OPENMRS_BASE_URL') or self.config.BASE_URL
         except Exception:
             pass
 
@@ -158,7 +156,7 @@ class OpenMRSAuth:
 
         try:
             headers = {"Content-Type": "application/x-www-form-urlencoded"}
-            response = requests.post(url, data=payload, headers=headers, verify=False)
+            response = requests.post(url, data=payload, headers=headers, verify=False, timeout=30)
             print(f"Status: {response.status_code}")
 
             if response.status_code == 200:
@@ -166,6 +164,7 @@ class OpenMRSAuth:
                 print("Body: " + json.dumps(data, indent=2))
                 access_token = data.get("access_token")
                 refresh_token = data.get("refresh_token", "")
+                self.expires_in = data.get("expires_in")
                 print("✅ Access Token Received")
                 return access_token, refresh_token
             else:
@@ -179,15 +178,12 @@ class OpenMRSAuth:
     def save_to_env(self, access_token, refresh_token=""):
         print(f"\n{'='*80}\nSTEP 3: Save Credentials to .env\n{'='*80}")
 
-        env_content = f"""OPENMRS_BASE_URL={self.config.BASE_URL}
-CLIENT_ID=fhir-client-app
-ACCESS_TOKEN={access_token}
-REFRESH_TOKEN={refresh_token}
-"""
-        with open(".env", "w") as f:
-            f.write(env_content)
+        # Atomic, locked update; running load workers pick the new token up from the shared record
+        TokenStore.open('.env').publish(access_token, self.expires_in, refresh_token, extra={
+            'OPENMRS_BASE_URL': self.config.BASE_URL,
+            'CLIENT_ID': 'fhir-client-app',
+        })
 
-        import os
         print(f"✅ Credentials saved to {os.path.abspath('.env')}")
 
 def main():
@@ -11,85 +11,305 @@ import json
 import base64
 from datetime import datetime, timedelta
 import os
+import random
+import sys
+import time
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fhirkit import cassette, idempotency  # noqa: E402
+from fhirkit.batchread import BatchReader  # noqa: E402
+from fhirkit.capabilities import Capabilities  # noqa: E402
+from fhirkit.deadline import Deadline, DeadlineExceeded, TimeoutSession, parse_timeouts  # noqa: E402
+from fhirkit.graph import JoinedFetch  # noqa: E402
+from fhirkit.loadgen import StatsTable  # noqa: E402
+from fhirkit.manifest import RUNS_DIR, RunManifest  # noqa: E402
+from fhirkit.runlog import RunLog  # noqa: E402
+from fhirkit.scenario import Scenario, format_checks, unknown_operations  # noqa: E402
+from fhirkit.search import Search, display_name  # noqa: E402
+from fhirkit.store import ResourceStore  # noqa: E402
+from fhirkit.singleflight import SingleFlight  # noqa: E402
+from fhirkit.tokens import TokenStore, read_env, refresh_grant  # noqa: E402
+from fhirkit.validation import default_validator, rejection_response  # noqa: E402
+
 class TestRunner:
+    # Creates are idempotent, so timeouts and dropped connections are retried
+    CREATE_RETRIES = 2
+    # Seconds one run() may take end to end (FHIR_DEADLINE overrides)
+    WORKFLOW_DEADLINE = 120
+    # Resource types this runner reads or writes
+    RESOURCE_TYPES = ['Patient', 'Encounter', 'Observation', 'Appointment']
+    # self.ids key -> resource type
+    ID_TYPES = {'patient': 'Patient', 'encounter': 'Encounter', 'observation': 'Observation',
+                'appointment': 'Appointment'}
+    # What run() does after the search check; FHIR_SCENARIO=<file> swaps in other workflows
+    SCENARIO = {'workflows': {'chart': [
+        {'op': 'create_patient', 'label': 'Patient'},
+        {'op': 'create_encounter', 'label': 'Encounter'},  # This works in OpenMRS!
+        {'op': 'create_observation', 'label': 'Observation'},
+        {'op': 'create_appointment', 'label': 'Appointment'},  # This works in OpenMRS!
+    ]}}
+
     def __init__(self):
-        self.session = requests.Session()
+        # Per-interaction timeouts, overridable with e.g. FHIR_TIMEOUTS=search=5,create=3:20
+        self.session = TimeoutSession(parse_timeouts(os.environ.get('FHIR_TIMEOUTS')))
         self.session.verify = False
+        # Record to / replay from a cassette when FHIR_RECORD / FHIR_REPLAY (or the tools) ask for it
+        # Otherwise identical GETs in flight at the same time (from any runner) share one call
+        if cassette.attach(self.session) is None and os.environ.get('FHIR_SINGLE_FLIGHT', '1') != '0':
+            self.session.single_flight = SingleFlight.shared()
         self.env = self.load_env()
         self.base_url = self.env.get('OPENMRS_BASE_URL', 'https://localhost:8443')
         self.fhir_url = f"{self.base_url}/ws/fhir2/R4"
-        self.token = self.env.get('ACCESS_TOKEN')
+        self.session.base_url = self.fhir_url
+        # Shared across processes: one refresher at a time, others pick up its token
+        # (a replay never refreshes over the network or rewrites .env)
+        if cassette.replaying():
+            self.tokens = cassette.ReplayTokens(self.env.get('ACCESS_TOKEN'))
+        else:
+            self.tokens = TokenStore.open('.env', refresher=refresh_grant(
+                f"{self.base_url}/oauth2/token", self.env.get('CLIENT_ID', 'fhir-client-app'),
+                self.env.get('CLIENT_SECRET')))
+        self.token = self.tokens.token()
+        self.session.hooks['response'].append(self.handle_unauthorized)
         self.ids = {}
+        # FixturePool set by the load generator; each iteration then starts from its ids
+        self.fixtures = None
 
         # Validate that we have required credentials
         if not self.token:
             raise Exception("Access token not found in .env file. Run 2_openmrs_auth.py first.")
 
+        # Cached per server version; lets us skip interactions the server does not declare
+        # (a replay trusts the cache: the cassette has no version check to answer)
+        self.capabilities = Capabilities.load(self.session, self.fhir_url, headers=self.get_headers(),
+                                              check_version=not cassette.replaying())
+        # Compiled once per process; checks every payload before it is sent
+        self.validator = default_validator()
+        # Leveled, lazily formatted, written by a background thread (FHIR_LOG_LEVEL, FHIR_LOG)
+        self.log = RunLog.shared()
+        # Every created id lands in .fhir_runs/ for `4_*_tools.py teardown` (not for replayed ids)
+        self.manifest = RunManifest.open(self.fhir_url, runs_dir=None if cassette.replaying() else RUNS_DIR)
+        # Mixed into client identifiers: same payload + same scope = same resource
+        self.scope = os.environ.get('FHIR_IDEMPOTENCY_SCOPE', '')
+        # Everything created or fully read, indexed for local lookups; one per process, so
+        # a load run's VUs share a single FHIR_STORE_MB budget
+        self.store = ResourceStore.shared()
+
+    @property
+    def deadline(self):
+        """Workflow Deadline applied to every request of this runner (None: timeouts only)"""
+        return self.session.deadline
+
+    @deadline.setter
+    def deadline(self, value):
+        self.session.deadline = value
+
     def load_env(self):
-        env = {}
         if not os.path.exists('.env'):
             raise Exception(".env file not found. Run 2_openmrs_auth.py first.")
-        with open('.env', 'r') as f:
-            for line in f:
-                if '=' in line:
-                    key, val = line.strip().split('=', 1)
-                    env[key] = val
-        return env
+        return read_env('.env')
 
     def get_headers(self):
+        self.token = self.tokens.token()
         return {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json'
         }
 
-    def print_step(self, name):
-        print(f"\nTEST: {name}")
-        print("-" * 40)
+    def handle_unauthorized(self, res, **kwargs):
+        """Response hook: on 401, refresh the shared token once and replay the request"""
+        if res.status_code != 401 or getattr(res.request, 'token_retried', False):
+            return res
+        sent = res.request.headers.get('Authorization', '')[len('Bearer '):]
+        token = self.tokens.refresh(stale_token=sent)
+        if not token:
+            return res
+        self.token = token
+        retry = res.request.copy()
+        retry.headers['Authorization'] = f'Bearer {token}'
+        retry.token_retried = True
+        return self.session.send(retry, **kwargs)
+
+    def unsupported(self, resource_type, interaction, label):
+        """True (after saying so) when the CapabilityStatement rules the interaction out"""
+        if self.capabilities.plan(resource_type, interaction) == 'skip':
+            self.log.info("⏭️  Skipping %s: server does not declare '%s' for %s", label, interaction, resource_type)
+            return True
+        return False
+
+    def post_resource(self, url, data, source=None):
+        """Create a resource idempotently, rerouted to update-as-create (PUT) where the server only allows that
 
-    def print_response(self, res):
-        print(f"Status: {res.status_code}")
+        The payload is validated first; fixable problems are repaired in place and
+        anything else is answered with a local 422 instead of a server round-trip.
+        With an AttachmentSource, its content is streamed into content[0].attachment.data.
+        """
+        report = self.validator.check(data)
+        for path, message in report.fixes:
+            self.log.info("🔧 Fixed locally: %s: %s", path, message)
+        for path, message in report.warnings:
+            self.log.warning("⚠️  %s: %s", path, message)
+        if report.errors:
+            for path, message in report.errors:
+                self.log.error("❌ Invalid payload: %s: %s", path, message)
+            return rejection_response(url, report)
+        key = idempotency.stamp(data, self.scope)
+        # A plain POST that timed out may still have created the resource: never resend it
+        retries = self.CREATE_RETRIES if self.idempotent_create(data['resourceType']) else 0
+        for attempt in range(retries + 1):
+            try:
+                res = self.send_create(url, data, key, source)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == retries or isinstance(e, DeadlineExceeded):
+                    raise
+                self.log.warning("⚠️  %s creating %s, retrying (%s)...", e.__class__.__name__, data['resourceType'], attempt + 1)
+        resource_id = self.manifest.record_response(data['resourceType'], res)
+        if resource_id:
+            self.store.put(dict(data, id=resource_id))
+        return res
+
+    def idempotent_create(self, resource_type):
+        """True when send_create takes the PUT, If-None-Exist or lookup-then-POST path, so a resend cannot duplicate"""
+        return (self.capabilities.plan(resource_type, 'create') == 'update'
+                or self.capabilities.supports_conditional_create(resource_type)
+                or self.capabilities.supports_search_param(resource_type, 'identifier'))
+
+    def send_create(self, url, data, key, source=None):
+        """One idempotent create attempt: PUT, conditional POST, or lookup then POST"""
+        resource_type = data['resourceType']
+        if self.capabilities.plan(resource_type, 'create') == 'update':
+            data = dict(data, id=idempotency.key_to_id(key))
+            return self.session.put(f"{url}/{data['id']}", **self.body(data, source, self.get_headers()))
+        headers = self.get_headers()
+        if self.capabilities.supports_conditional_create(resource_type):
+            headers['If-None-Exist'] = idempotency.if_none_exist(key)
+        elif self.capabilities.supports_search_param(resource_type, 'identifier'):
+            existing = idempotency.lookup(self.session, url, key, headers)
+            if existing:
+                self.log.info("♻️  %s already exists (client id %s...), not creating again", resource_type, key[:12])
+                return idempotency.found_response(url, existing)
+        return self.session.post(url, **self.body(data, source, headers))
+
+    def body(self, data, source, headers):
+        """requests arguments sending `data`; a fresh stream per attempt when an attachment is streamed"""
+        if source is None:
+            return {'json': data, 'headers': headers}
+        # Do not have the server echo the document back
+        return {'data': source.inline_body(data), 'headers': dict(headers, Prefer='return=minimal')}
+
+    def log_step(self, name):
+        self.log.section("TEST: %s", name)
+
+    def log_response(self, res):
+        self.log.info("Status: %s", res.status_code, status=res.status_code)
         if res.status_code >= 400:
-            print(f"Error: {res.text[:200]}")
-        else:
-            print(f"Response: {res.text[:200]}...")
+            self.log.warning("Error: %s", res.text[:200], status=res.status_code)
+        # Headers and bodies only at DEBUG, and only for a sample of requests
+        self.log.body(res)
 
     def search_patients(self):
-        self.print_step("Search Patients")
+        if self.unsupported('Patient', 'search-type', 'Search Patients'):
+            return
+        self.log_step("Search Patients")
         url = f"{self.fhir_url}/Patient"
         try:
             res = self.session.get(url, headers=self.get_headers())
-            self.print_response(res)
+            self.log_response(res)
             if res.status_code == 200:
-                print("✅ Success")
+                self.store.put_bundle(res.json())
+                self.log.info("✅ Success")
                 return True
             else:
-                print(f"❌ Failed with status {res.status_code}")
+                self.log.error("❌ Failed with status %s", res.status_code)
                 return False
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
+            self.log.error("❌ Request failed: %s", e)
             return False
 
     def search_encounters(self):
-        self.print_step("Search Encounters")
+        if self.unsupported('Encounter', 'search-type', 'Search Encounters'):
+            return
+        self.log_step("Search Encounters")
         url = f"{self.fhir_url}/Encounter"
         try:
             res = self.session.get(url, headers=self.get_headers())
-            self.print_response(res)
+            self.log_response(res)
             if res.status_code == 200:
-                print("✅ Success - Encounters searchable (Unlike OpenEMR)")
+                self.log.info("✅ Success")
                 return True
             else:
-                print(f"❌ Failed with status {res.status_code}")
+                self.log.error("❌ Failed with status %s", res.status_code)
                 return False
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
+            self.log.error("❌ Request failed: %s", e)
+            return False
+
+    def list_patients(self):
+        """List view: only id, name and birthDate, gzip-negotiated"""
+        if self.unsupported('Patient', 'search-type', 'List Patients'):
+            return
+        self.log_step("List Patients (projected)")
+        try:
+            result = Search(self).search('Patient', elements=['name', 'birthDate'], count=50)
+        except requests.exceptions.RequestException as e:
+            self.log.error("❌ Request failed: %s", e)
+            return False
+        self.log.info(result.describe())
+        for record in result.records[:5]:
+            self.log.info("  %s: %s %s", record.id, display_name(record.name), record.birthDate or '')
+        return True
+
+    def count_patients(self):
+        """Count only (_summary=count): no resources are transferred"""
+        if self.unsupported('Patient', 'search-type', 'Count Patients'):
+            return
+        self.log_step("Count Patients")
+        try:
+            total = Search(self).count('Patient')
+        except requests.exceptions.RequestException as e:
+            self.log.error("❌ Request failed: %s", e)
             return False
+        self.log.info("✅ %s patients", total if total is not None else 'Unknown number of')
+        return total is not None
+
+    def fetch_chart(self, patient_id=None):
+        """Patient graph in as few requests as the server allows ($everything / _revinclude / batch)"""
+        patient_id = patient_id or self.ids.get('patient')
+        if not patient_id:
+            self.log.warning("⚠️  Skipping Chart: No Patient ID")
+            return
+        self.log_step("Fetch Chart (joined)")
+        try:
+            graph = JoinedFetch(self).patient_graph(patient_id)
+        except requests.exceptions.RequestException as e:
+            self.log.error("❌ Request failed: %s", e)
+            return False
+        for line in graph.chart(patient_id):
+            self.log.info(line)
+        return graph.get('Patient', patient_id) is not None
+
+    def read_back(self):
+        """Everything in self.ids, read from the server in as few requests as possible"""
+        if not self.ids:
+            self.log.warning("⚠️  Skipping Read Back: nothing was created")
+            return
+        self.log_step("Read Back (batched)")
+        refs = [(self.ID_TYPES[k], v) for k, v in self.ids.items() if k in self.ID_TYPES]
+        result = BatchReader(self, use_store=False).read(refs)
+        self.log.info(result.describe())
+        for key in result.missing:
+            self.log.error("❌ Missing: %s", key)
+        for chunk, error in result.errors.items():
+            self.log.error("❌ %s: %s", chunk, error)
+        return not result.missing
 
     def create_patient(self):
-        self.print_step("Create Patient")
+        if self.unsupported('Patient', 'create', 'Patient'):
+            return
+        self.log_step("Create Patient")
         url = f"{self.fhir_url}/Patient"
         data = {
             "resourceType": "Patient",
@@ -112,18 +332,16 @@ class TestRunner:
             ]
         }
         try:
-            res = self.session.post(url, json=data, headers=self.get_headers())
-            self.print_response(res)
+            res = self.post_resource(url, data)
+            self.log_response(res)
             if res.status_code in [200, 201]:
-                print("✅ Patient Created Successfully - Full CRUD Support")
+                self.log.info("✅ Patient Created Successfully")
                 # Parse response body
                 response_data = {}
                 if res.text.strip():
                     try:
                         response_data = res.json()
-                        print(f"DEBUG: Response Body: {json.dumps(response_data, indent=2)}")
                     except json.JSONDecodeError:
-                        print(f"DEBUG: Response Body (non-JSON): {res.text}")
                         return True
 
                 # Extract patient ID from response
@@ -133,23 +351,25 @@ class TestRunner:
                     self.extract_id_from_location_header(res.headers)
                 )
 
-                print(f"Captured Patient ID: {self.ids.get('patient', 'NOT FOUND')}")
+                self.log.info("Captured Patient ID: %s", self.ids.get('patient', 'NOT FOUND'))
                 return True
             else:
-                print(f"❌ Failed with status {res.status_code}")
+                self.log.error("❌ Failed with status %s", res.status_code)
                 return False
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
+            self.log.error("❌ Request failed: %s", e)
             return False
 
     def create_encounter(self):
+        if self.unsupported('Encounter', 'create', 'Encounter'):
+            return
         if not self.ids.get('patient'):
-            print("⚠️  Creating patient first for encounter test...")
+            self.log.warning("⚠️  Creating patient first for encounter test...")
             if not self.create_patient():
-                print("⚠️  Skipping Encounter: No Patient ID available")
+                self.log.warning("⚠️  Skipping Encounter: No Patient ID available")
                 return False
                 
-        self.print_step("Create Encounter - FULLY SUPPORTED unlike OpenEMR")
+        self.log_step("Create Encounter")
         url = f"{self.fhir_url}/Encounter"
         data = {
             "resourceType": "Encounter",
@@ -180,38 +400,40 @@ class TestRunner:
             ]
         }
         try:
-            res = self.session.post(url, json=data, headers=self.get_headers())
-            self.print_response(res)
+            res = self.post_resource(url, data)
+            self.log_response(res)
             if res.status_code in [200, 201]:
-                print("✅ Encounter Created Successfully - This works in OpenMRS!")
+                self.log.info("✅ Encounter Created Successfully - This works in OpenMRS!")
                 response_data = res.json() if res.text.strip() else {}
                 self.ids['encounter'] = (
                     response_data.get('id') or
                     response_data.get('identifier', [{}])[0].get('value') if response_data.get('identifier') else None or
                     self.extract_id_from_location_header(res.headers)
                 )
-                print(f"✅ Created Encounter ID: {self.ids.get('encounter', 'NOT FOUND')}")
+                self.log.info("✅ Created Encounter ID: %s", self.ids.get('encounter', 'NOT FOUND'))
                 return True
             else:
-                print(f"❌ Failed with status {res.status_code}")
+                self.log.error("❌ Failed with status %s", res.status_code)
                 return False
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
+            self.log.error("❌ Request failed: %s", e)
             return False
 
     def create_observation(self):
+        if self.unsupported('Observation', 'create', 'Observation'):
+            return
         if 'patient' not in self.ids:
-            print("⚠️  Creating patient first for observation test...")
+            self.log.warning("⚠️  Creating patient first for observation test...")
             if not self.create_patient():
-                print("⚠️  Skipping Observation: No Patient ID available")
+                self.log.warning("⚠️  Skipping Observation: No Patient ID available")
                 return False
         if 'encounter' not in self.ids:
-            print("⚠️  Creating encounter first for observation test...")
+            self.log.warning("⚠️  Creating encounter first for observation test...")
             if not self.create_encounter():
-                print("⚠️  Skipping Observation: No Encounter ID available")
+                self.log.warning("⚠️  Skipping Observation: No Encounter ID available")
                 return False
                 
-        self.print_step("Create Observation - Now possible with Encounter support")
+        self.log_step("Create Observation - Now possible with Encounter support")
         url = f"{self.fhir_url}/Observation"
         data = {
             "resourceType": "Observation",
@@ -279,8 +501,8 @@ class TestRunner:
             ]
         }
         try:
-            res = self.session.post(url, json=data, headers=self.get_headers())
-            self.print_response(res)
+            res = self.post_resource(url, data)
+            self.log_response(res)
             if res.status_code in [200, 201]:
                 response_data = res.json() if res.text.strip() else {}
                 self.ids['observation'] = (
@@ -288,23 +510,25 @@ class TestRunner:
                     response_data.get('identifier', [{}])[0].get('value') if response_data.get('identifier') else None or
                     self.extract_id_from_location_header(res.headers)
                 )
-                print(f"✅ Created Observation ID: {self.ids.get('observation', 'NOT FOUND')}")
+                self.log.info("✅ Created Observation ID: %s", self.ids.get('observation', 'NOT FOUND'))
                 return True
             else:
-                print(f"❌ Failed with status {res.status_code}")
+                self.log.error("❌ Failed with status %s", res.status_code)
                 return False
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
+            self.log.error("❌ Request failed: %s", e)
             return False
 
     def create_appointment(self):
+        if self.unsupported('Appointment', 'create', 'Appointment'):
+            return
         if not self.ids.get('patient'):
-            print("⚠️  Creating patient first for appointment test...")
+            self.log.warning("⚠️  Creating patient first for appointment test...")
             if not self.create_patient():
-                print("⚠️  Skipping Appointment: No Patient ID available")
+                self.log.warning("⚠️  Skipping Appointment: No Patient ID available")
                 return False
                 
-        self.print_step("Create Appointment - FULLY SUPPORTED unlike OpenEMR")
+        self.log_step("Create Appointment")
         url = f"{self.fhir_url}/Appointment"
         start_time = (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%dT09:00:00Z")
         end_time = (datetime.now() + timedelta(days=1, hours=1)).strftime("%Y-%m-%dT10:00:00Z")
@@ -343,8 +567,8 @@ class TestRunner:
             ]
         }
         try:
-            res = self.session.post(url, json=data, headers=self.get_headers())
-            self.print_response(res)
+            res = self.post_resource(url, data)
+            self.log_response(res)
             if res.status_code in [200, 201]:
                 response_data = res.json() if res.text.strip() else {}
                 self.ids['appointment'] = (
@@ -352,13 +576,13 @@ class TestRunner:
                     response_data.get('identifier', [{}])[0].get('value') if response_data.get('identifier') else None or
                     self.extract_id_from_location_header(res.headers)
                 )
-                print(f"✅ Created Appointment ID: {self.ids.get('appointment', 'NOT FOUND')}")
+                self.log.info("✅ Created Appointment ID: %s", self.ids.get('appointment', 'NOT FOUND'))
                 return True
             else:
-                print(f"❌ Failed with status {res.status_code}")
+                self.log.error("❌ Failed with status %s", res.status_code)
                 return False
         except requests.exceptions.RequestException as e:
-            print(f"❌ Request failed: {e}")
+            self.log.error("❌ Request failed: %s", e)
             return False
 
     def extract_id_from_location_header(self, headers):
@@ -372,54 +596,94 @@ class TestRunner:
         return None
 
     def run(self):
-        print("Starting OpenMRS FHIR Tests...")
-        print("Note: Unlike OpenEMR, OpenMRS supports full CRUD operations for Patients and Encounters!")
+        self.log.info("Starting OpenMRS FHIR Tests...")
         try:
             # Validate token first
-            print(f"Using token: {'Present' if self.token else 'Missing'}")
-            print(f"FHIR URL: {self.fhir_url}")
+            self.log.info("Using token: %s", 'Present' if self.token else 'Missing')
+            self.log.info("FHIR URL: %s", self.fhir_url)
+            self.deadline = Deadline(float(os.environ.get('FHIR_DEADLINE', self.WORKFLOW_DEADLINE)))
+            for line in self.capabilities.describe(self.RESOURCE_TYPES):
+                self.log.info(line)
 
             # Run search tests first to validate authentication
             search_patients_success = self.search_patients()
             search_encounters_success = self.search_encounters()  # This works in OpenMRS!
 
             if not search_patients_success:
-                print("\n❌ Authentication or connectivity issue detected. Stopping tests.")
+                self.log.error("\n❌ Authentication or connectivity issue detected. Stopping tests.")
                 return
 
-            # Run write operations sequentially
-            operations = [
-                ('create_patient', 'Patient'),
-                ('create_encounter', 'Encounter'),  # This works in OpenMRS!
-                ('create_observation', 'Observation'),
-                ('create_appointment', 'Appointment')  # This works in OpenMRS!
-            ]
+            # Write operations in order: the workflows of FHIR_SCENARIO, else SCENARIO
+            path = os.environ.get('FHIR_SCENARIO')
+            scenario = Scenario.load(path) if path else Scenario(self.SCENARIO)
+            unknown = unknown_operations(self, scenario.operations())
+            if unknown:
+                self.log.error("❌ Unknown operation(s) in %s: %s", path, ', '.join(unknown))
+                return
 
-            for method_name, resource_name in operations:
-                print(f"\n--- Processing {resource_name} ---")
-                method = getattr(self, method_name)
+            # Weights only shape a load run's mix; here every workflow runs once, in file order
+            if len(set(w.weight for w in scenario.workflows.values())) > 1:
+                self.log.info("ℹ️  Workflow weights apply to load runs; each workflow runs once here")
+            results = StatsTable()
+            started = time.perf_counter()
+            for step, ids in scenario.sequence():
+                resource_name = step.label
+                # Each workflow starts from its own ids: its data source's next set, else none
+                if ids is not None:
+                    self.ids = ids
+                self.log.info("\n--- Processing %s ---", resource_name)
+                if self.deadline.expired():
+                    self.log.info("⏭️  Skipping %s: workflow deadline of %gs spent", resource_name, self.deadline.seconds)
+                    continue
+                method = getattr(self, step.op)
+                start = time.perf_counter()
+                before = self.session.timed_out
+                outcome = 'error'
                 try:
-                    success = method()
-                    if not success:
-                        print(f"⚠️  {resource_name} creation failed, continuing with other tests...")
+                    success = method(**step.args)
+                    outcome = 'ok' if success else ('skipped' if success is None else 'failed')
+                    if success is False:
+                        self.log.warning("⚠️  %s creation failed, continuing with other tests...", resource_name)
                 except Exception as e:
-                    print(f"❌ Error creating {resource_name}: {e}")
+                    self.log.error("❌ Error creating %s: %s", resource_name, e)
+                if outcome in ('failed', 'error') and self.session.timed_out > before:
+                    outcome = 'timeout'
+                results.record(step.op, time.perf_counter() - start, outcome)
+                if step.think is not None:
+                    # Not charged to the deadline, as in a load run
+                    pause = step.think(random)
+                    time.sleep(pause)
+                    self.deadline.extend(pause)
+
+            # Read everything back as one graph
+            if self.ids.get('patient') and not self.deadline.expired():
+                self.fetch_chart()
 
-            print("\n" + "="*50)
-            print("OPENMRS TEST REPORT - IMPROVED OVER OPENEMR")
-            print("="*50)
+            if self.session.timed_out:
+                self.log.info("\n⏱️  %s request(s) timed out", self.session.timed_out)
+            self.log.section("OPENMRS TEST REPORT", rule="=", width=50)
+            checks = scenario.evaluate(results, time.perf_counter() - started)
+            if checks:
+                self.log.info(format_checks(checks))
+            if self.validator.checked:
+                self.log.info(self.validator.summary())
+            if len(self.store):
+                self.log.info(self.store.describe())
+            if self.session.single_flight is not None and self.session.single_flight.joined:
+                self.log.info(self.session.single_flight.describe())
             if self.ids:
                 for k, v in self.ids.items():
-                    print(f"{k.title()}: {v}")
-                print("\n✅ SUCCESS: All operations that were attempted succeeded!")
-                print("✅ Unlike OpenEMR, OpenMRS supports full FHIR resource operations")
+                    self.log.info("%s: %s", k.title(), v)
+                self.log.info("\n✅ SUCCESS: All operations that were attempted succeeded!")
             else:
-                print("No resources were created successfully.")
+                self.log.info("No resources were created successfully.")
 
+            # False (exit status 1) when an assertion of the scenario is not met
+            return all(met for _, met, _ in checks)
         except Exception as e:
-            print(f"CRITICAL ERROR: {e}")
-            import traceback
-            traceback.print_exc()
+            self.log.exception("CRITICAL ERROR: %s", e)
+        finally:
+            self.log.flush()
 
 if __name__ == "__main__":
-    TestRunner().run()
\ No newline at end of file
+    sys.exit(1 if TestRunner().run() is False else 0)
\ No newline at end of file
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+OpenMRS Tools Script
+1. load: Run a load test from this machine
+2. coordinator / worker: Distributed load test across several machines
+3. probe: Continuous health probe with latency SLOs and a metrics endpoint
+4. teardown: Delete the resources earlier runs created
+5. record / replay: Capture a session to a cassette and replay it offline
+6. proxy: Local proxy injecting latency and faults per route
+7. bench: Before/after benchmark of the nginx proxy profile
+8. search: Projected search with wire vs decoded byte counts
+9. chart: A patient's graph in as few requests as the server allows
+10. read: Many resources by id in a few batched requests
+11. integrity: Scan for dangling subject / encounter references
+12. fixtures: Pre-create the patient / encounter pool used by load runs
+13. upload / download: Stream large documents to and from the server
+14. ingest: Bulk-load vital signs from columnar (NumPy) feeds
+15. export: Search results or Bulk NDJSON to Parquet / Arrow tables
+16. subscribe: React to changes through rest-hook Subscriptions
+
+Run `python3 4_openmrs_tools.py <command> --help` for options.
+"""
+
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fhirkit import cli  # noqa: E402
+
+
+def make_runner():
+    """One TestRunner (own session and ids) per virtual user"""
+    return importlib.import_module('3_openmrs_test').TestRunner()
+
+
+if __name__ == "__main__":
+    sys.exit(cli.main("OpenMRS", make_runner))
@@ -95,11 +95,6 @@ else
     exit 1
 fi
 
-# Wait for containers to start
-echo ""
-echo "Waiting for containers to start (10 seconds)..."
-sleep 10
-
 # Show container status
 echo ""
 echo "Container status:"
@@ -114,8 +109,14 @@ echo "Monitor initialization with this command in another terminal:"
 echo "docker-compose logs -f openmrs_server"
 echo ""
 
-# Wait for initialization
-sleep 30
+# Wait for initialization: poll with exponential backoff and continue as soon as OpenMRS answers
+if python3 -c "import requests" 2>/dev/null; then
+    python3 1_check_prerequisites.py --wait --checks connection --timeout 600 \
+        || print_warning "OpenMRS did not answer within 10 minutes"
+else
+    print_warning "Python requests not installed; falling back to a fixed 40 second wait"
+    sleep 40
+fi
 
 # Check if OpenMRS is responding
 echo ""
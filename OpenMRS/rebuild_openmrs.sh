@@ -44,9 +44,15 @@ docker-compose pull
 echo "Starting OpenMRS containers..."
 docker-compose up -d --force-recreate
 
-# Wait for containers to start
+# Wait for containers to start: poll with backoff instead of a fixed sleep
 echo "Waiting for containers to start..."
-sleep 10
+if python3 -c "import requests" 2>/dev/null; then
+    python3 1_check_prerequisites.py --wait --checks connection --timeout 120 \
+        && echo "✅ OpenMRS is answering through the proxy" \
+        || echo "⚠️  OpenMRS is not answering yet (normal on first start)"
+else
+    sleep 10
+fi
 
 # Show container status
 echo "Container status:"
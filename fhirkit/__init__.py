@@ -0,0 +1,7 @@
+"""
+FHIR Toolkit
+Shared helpers used by the OpenEMR and OpenMRS scripts:
+1. Latency histograms and load generation
+2. Coordinator/worker distributed load runs
+3. Command line entry point for the per-server tools scripts
+"""
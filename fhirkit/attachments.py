@@ -0,0 +1,252 @@
+"""
+Streaming Attachments
+1. Uploads a document from a file or a (memory-mapped) buffer
+   without building the body: base64 is encoded chunk by chunk while the
+   request is being sent, inline in the JSON or as a separate Binary
+2. Downloads attachments straight to disk, from Binary (raw bytes) or by
+   decoding the inline base64 out of the response stream
+3. Memory stays at a few chunks whatever the document size; size and SHA-1
+   are filled in so the server (and the download) can check the content
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+
+from fhirkit.manifest import created_id
+
+CHUNK = 3 * 64 * 1024  # multiple of 3: base64 of each chunk concatenates cleanly
+SENTINEL = '__fhirkit_streamed_attachment__'
+DATA_KEY = re.compile(rb'"data"\s*:\s*"')
+URL_KEY = re.compile(rb'"url"\s*:\s*"([^"]*)"')
+
+
+class AttachmentSource:
+    """A document to upload: a file path, or a bytes-like buffer such as an mmap"""
+
+    def __init__(self, source, content_type='application/octet-stream', title=None):
+        self.path = source if isinstance(source, (str, os.PathLike)) else None
+        self.buffer = None if self.path else memoryview(source)
+        self.size = os.path.getsize(self.path) if self.path else self.buffer.nbytes
+        self.content_type = content_type
+        self.title = title or (os.path.basename(self.path) if self.path else None)
+        self._sha1 = None
+
+    def blocks(self, size=CHUNK):
+        """The content in slices of `size` bytes"""
+        if self.buffer is not None:
+            for i in range(0, self.size, size):
+                yield self.buffer[i:i + size]
+            return
+        # Plain reads rather than mmap: mapped pages would count against the process's resident size
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(size), b''):
+                yield block
+
+    def sha1(self):
+        """Base64 SHA-1, as Attachment.hash wants it (one streaming pass, cached)"""
+        if self._sha1 is None:
+            digest = hashlib.sha1()
+            for block in self.blocks():
+                digest.update(block)
+            self._sha1 = base64.b64encode(digest.digest()).decode('ascii')
+        return self._sha1
+
+    def attachment(self, **extra):
+        """Attachment element without the data"""
+        attachment = {'contentType': self.content_type, 'size': self.size, 'hash': self.sha1()}
+        if self.title:
+            attachment['title'] = self.title
+        attachment.update(extra)
+        return attachment
+
+    def raw_body(self):
+        """File-like request body of the raw bytes (for Binary)"""
+        return StreamBody(self.blocks(), self.size)
+
+    def inline_body(self, resource, index=0):
+        """File-like JSON body of `resource` with content[index].attachment.data streamed in"""
+        skeleton = json.loads(json.dumps(resource))
+        skeleton['content'][index]['attachment']['data'] = SENTINEL
+        prefix, suffix = json.dumps(skeleton).split(f'"{SENTINEL}"')
+        prefix, suffix = (prefix + '"').encode('utf-8'), ('"' + suffix).encode('utf-8')
+
+        def parts():
+            yield prefix
+            for block in self.blocks():
+                yield base64.b64encode(block)
+            yield suffix
+        return StreamBody(parts(), len(prefix) + 4 * ((self.size + 2) // 3) + len(suffix))
+
+
+class StreamBody:
+    """Read-only file-like over an iterator of byte strings, with a known length
+
+    requests sends it with a Content-Length (no chunked encoding) and reads
+    it in blocks, so only the current part is ever in memory.
+    """
+
+    def __init__(self, parts, length):
+        self.parts = iter(parts)
+        self.length = length
+        self.part = b''
+        self.pos = 0
+        self.sent = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        out = []
+        while size != 0:
+            if self.pos >= len(self.part):
+                part = next(self.parts, None)
+                if part is None:
+                    break
+                self.part, self.pos = bytes(part), 0
+            take = len(self.part) - self.pos if size < 0 else min(size, len(self.part) - self.pos)
+            out.append(self.part[self.pos:self.pos + take])
+            self.pos += take
+            if size > 0:
+                size -= take
+        data = b''.join(out)
+        self.sent += len(data)
+        return data
+
+
+def base64_stream(chunks):
+    """Decode a base64 text stream (with JSON escapes such as '\\/' left in) into byte chunks"""
+    carry = b''
+    for chunk in chunks:
+        chunk = carry + chunk.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'')
+        usable = len(chunk) - len(chunk) % 4
+        carry = chunk[usable:]
+        if usable:
+            yield base64.b64decode(chunk[:usable])
+    if carry:
+        yield base64.b64decode(carry)
+
+
+def inline_data(chunks, seen=None):
+    """Base64 text of the first "data" string in a JSON byte stream, in chunks
+
+    An attachment "url" met on the way is put in `seen`, for content that is
+    not inline.
+    """
+    buffer, inside = b'', False
+    for chunk in chunks:
+        buffer += chunk
+        if not inside:
+            match = DATA_KEY.search(buffer)
+            url = URL_KEY.search(buffer[:match.start()] if match else buffer)
+            if url is not None and seen is not None:
+                seen.setdefault('url', url.group(1).replace(b'\\/', b'/').decode('utf-8'))
+            if not match:
+                buffer = buffer[-256:]  # enough to hold a key split across chunks
+                continue
+            buffer, inside = buffer[match.end():], True
+        end = buffer.find(b'"')
+        if end >= 0:
+            yield buffer[:end]
+            return
+        # Hold back a trailing backslash: it escapes the next chunk's first byte
+        keep = 1 if buffer.endswith(b'\\') else 0
+        yield buffer[:len(buffer) - keep]
+        buffer = buffer[len(buffer) - keep:]
+    raise ValueError("No inline attachment data in the response")
+
+
+def save_stream(chunks, path):
+    """Write byte chunks to `path`; returns (bytes written, base64 SHA-1)"""
+    digest, written = hashlib.sha1(), 0
+    tmp = path + '.part'
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    return written, base64.b64encode(digest.digest()).decode('ascii')
+
+
+def download(runner, attachment, path, chunk=CHUNK):
+    """Attachment content to `path`, streamed; returns (bytes, sha1) and raises on a hash mismatch
+
+    `attachment` is an Attachment element: with a url (Binary, fetched as raw
+    bytes) or with the reference of the resource holding it, as
+    {'inline': 'DocumentReference/12'}; when that resource has no inline
+    data, its attachment url is followed instead.
+    """
+    headers = runner.get_headers()
+    if attachment.get('url'):
+        url = attachment['url']
+        url = url if url.startswith(('http://', 'https://')) else f"{runner.fhir_url}/{url}"
+        headers['Accept'] = attachment.get('contentType') or 'application/octet-stream'
+        res = runner.session.get(url, headers=headers, stream=True)
+        res.raise_for_status()
+        if res.headers.get('Content-Type', '').startswith(('application/fhir+json', 'application/json')) and \
+                not headers['Accept'].endswith('json'):
+            chunks = base64_stream(inline_data(res.iter_content(chunk)))  # Binary resource instead of raw bytes
+        else:
+            chunks = res.iter_content(chunk)
+    else:
+        res = runner.session.get(f"{runner.fhir_url}/{attachment['inline']}", headers=headers, stream=True)
+        res.raise_for_status()
+        seen = {}
+        chunks = base64_stream(inline_data(res.iter_content(chunk), seen))
+    try:
+        with res:
+            written, sha1 = save_stream(chunks, path)
+    except ValueError:
+        if attachment.get('url') or not seen.get('url'):
+            raise
+        return download(runner, dict(attachment, url=seen['url']), path, chunk)
+    if attachment.get('hash') and attachment['hash'] != sha1:
+        raise ValueError(f"Downloaded content does not match the attachment hash ({sha1} != {attachment['hash']})")
+    return written, sha1
+
+
+def document_reference(source, patient_id, encounter_id=None, url=None):
+    """DocumentReference skeleton for `source` (no data; url when it lives in a Binary)"""
+    attachment = source.attachment(**({'url': url} if url else {}))
+    data = {
+        "resourceType": "DocumentReference",
+        "status": "current",
+        "docStatus": "final",
+        "type": {"coding": [{"system": "http://loinc.org", "code": "55107-7", "display": "Addendum Document"}]},
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "content": [{"attachment": attachment}]
+    }
+    if encounter_id:
+        data["context"] = {"encounter": [{"reference": f"Encounter/{encounter_id}"}]}
+    return data
+
+
+def upload_binary(runner, source):
+    """POST the raw document as a Binary, streamed; the id is recorded for teardown"""
+    headers = dict(runner.get_headers(), **{'Content-Type': source.content_type, 'Prefer': 'return=minimal'})
+    res = runner.session.post(f"{runner.fhir_url}/Binary", data=source.raw_body(), headers=headers)
+    runner.manifest.record_response('Binary', res)
+    return res
+
+
+def upload(runner, source, patient_id, encounter_id=None, mode='inline'):
+    """Create a DocumentReference for `source`; returns the create response
+
+    mode='inline' streams the base64 into the DocumentReference body;
+    mode='binary' uploads a Binary first and points attachment.url at it.
+    """
+    url = f"{runner.fhir_url}/DocumentReference"
+    if mode == 'binary':
+        res = upload_binary(runner, source)
+        if not 200 <= res.status_code < 300:
+            return res
+        binary_id = created_id('Binary', res)
+        return runner.post_resource(url, document_reference(source, patient_id, encounter_id, f"Binary/{binary_id}"))
+    return runner.post_resource(url, document_reference(source, patient_id, encounter_id), source=source)
@@ -0,0 +1,175 @@
+"""
+Batched Multi-ID Reads
+1. Groups the requested ids per resource type into `_id=a,b,c` searches,
+   each sized to stay under the URL limit, or into batch Bundles of GETs
+   where the server cannot search by _id
+2. Chunks run concurrently; resources already in the runner's store can
+   be served locally
+3. Results come back in the requested order, with misses marked
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fhirkit.graph import parse_reference
+
+MAX_URL = 2000  # conservative: proxies and servers commonly cap the request line at 4-8 KB
+MAX_IDS = 100  # per _id search; servers cap the page size
+BATCH_SIZE = 50  # GETs per batch Bundle
+
+
+def as_key(ref):
+    """'Type/id' for 'Type/id', absolute/versioned references or (type, id)"""
+    parsed = tuple(ref) if isinstance(ref, (tuple, list)) else parse_reference(ref)
+    if not parsed or len(parsed) != 2:
+        raise ValueError(f"Not a resource reference: {ref!r}")
+    return f"{parsed[0]}/{parsed[1]}"
+
+
+def referenced(resources, field='subject'):
+    """Unique references held in `field` of the given resources, in first-seen order"""
+    refs = {}
+    for resource in resources:
+        values = resource.get(field)
+        for value in values if isinstance(values, list) else [values]:
+            if isinstance(value, dict) and parse_reference(value.get('reference')):
+                refs.setdefault(as_key(value['reference']), None)
+    return list(refs)
+
+
+def chunk_ids(base_url, ids, max_url=MAX_URL, max_ids=MAX_IDS):
+    """Split ids into lists whose `?_id=...&_count=n` URL stays under max_url"""
+    chunks, chunk, length = [], [], len(base_url) + len('?_id=&_count=') + len(str(max_ids))
+    for resource_id in ids:
+        extra = len(resource_id) + (3 if chunk else 0)  # ',' is sent as %2C
+        if chunk and (length + extra > max_url or len(chunk) >= max_ids):
+            chunks.append(chunk)
+            chunk, length = [], len(base_url) + len('?_id=&_count=') + len(str(max_ids))
+            extra = len(resource_id)
+        chunk.append(resource_id)
+        length += extra
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class BatchReadResult:
+    def __init__(self, keys, found, errors, requests_sent, from_store, failed=()):
+        self.keys = keys
+        self.found = found
+        self.errors = errors
+        self.failed = set(failed)  # keys whose chunk errored: unknown, not missing
+        self.requests = requests_sent
+        self.from_store = from_store
+
+    @property
+    def resources(self):
+        """One entry per requested reference, in order; None marks a miss"""
+        return [self.found.get(key) for key in self.keys]
+
+    @property
+    def missing(self):
+        return [key for key in self.keys if key not in self.found and key not in self.failed]
+
+    def __iter__(self):
+        return iter(zip(self.keys, self.resources))
+
+    def describe(self):
+        unique = len(set(self.keys))
+        text = (f"{len(self.found)}/{unique} found in {self.requests} request(s)"
+                f" ({self.from_store} from the local store)")
+        if self.errors:
+            text += f", {len(self.errors)} chunk(s) failed"
+        return text
+
+
+class BatchReader:
+    """Multi-id reads through a runner's session"""
+
+    def __init__(self, runner, workers=4, max_url=MAX_URL, max_ids=MAX_IDS, batch_size=BATCH_SIZE, use_store=True):
+        self.runner = runner
+        self.caps = runner.capabilities
+        self.store = getattr(runner, 'store', None) if use_store else None
+        self.workers = workers
+        self.max_url = max_url
+        self.max_ids = max_ids
+        self.batch_size = batch_size
+
+    def plan(self, resource_type, ids):
+        """[(kind, resource_type, ids)] for one type: '_id' searches, 'batch' Bundles or single 'read's"""
+        base = f"{self.runner.fhir_url}/{resource_type}"
+        if self.caps.supports(resource_type, 'search-type') and self.caps.supports_search_param(resource_type, '_id'):
+            return [('_id', resource_type, chunk) for chunk in chunk_ids(base, ids, self.max_url, self.max_ids)]
+        if self.caps.known and self.caps.supports_system('batch'):
+            return [('batch', resource_type, ids[i:i + self.batch_size]) for i in range(0, len(ids), self.batch_size)]
+        return [('read', resource_type, [resource_id]) for resource_id in ids]
+
+    def fetch(self, task):
+        """({'Type/id': resource}, requests sent) for one chunk"""
+        kind, resource_type, ids = task
+        headers = self.runner.get_headers()
+        found, sent = {}, 0
+        if kind == '_id':
+            url = f"{self.runner.fhir_url}/{resource_type}"
+            params = {'_id': ','.join(ids), '_count': len(ids)}
+            while url:
+                res = self.runner.session.get(url, params=params, headers=headers)
+                sent += 1
+                res.raise_for_status()
+                bundle = res.json()
+                for entry in bundle.get('entry', []):
+                    resource = entry.get('resource') or {}
+                    if resource.get('resourceType') == resource_type:
+                        found[f"{resource_type}/{resource['id']}"] = resource
+                url = next((link['url'] for link in bundle.get('link', []) if link.get('relation') == 'next'), None)
+                params = None
+        elif kind == 'batch':
+            bundle = {"resourceType": "Bundle", "type": "batch",
+                      "entry": [{"request": {"method": "GET", "url": f"{resource_type}/{i}"}} for i in ids]}
+            res = self.runner.session.post(self.runner.fhir_url, json=bundle, headers=headers)
+            sent += 1
+            res.raise_for_status()
+            for entry in res.json().get('entry', []):
+                resource = entry.get('resource') or {}
+                if resource.get('resourceType') == resource_type:
+                    found[f"{resource_type}/{resource['id']}"] = resource
+        else:
+            res = self.runner.session.get(f"{self.runner.fhir_url}/{resource_type}/{ids[0]}", headers=headers)
+            sent += 1
+            if res.status_code not in (404, 410):
+                res.raise_for_status()
+                found[f"{resource_type}/{ids[0]}"] = res.json()
+        return found, sent
+
+    def read(self, refs):
+        """BatchReadResult for 'Type/id' references (or (type, id) pairs), in the given order"""
+        keys = [as_key(ref) for ref in refs]
+        found, from_store, wanted = {}, 0, {}
+        for key in dict.fromkeys(keys):
+            record = self.store.get(*key.split('/', 1)) if self.store is not None else None
+            if record is not None:
+                found[key] = record.resource
+                from_store += 1
+            else:
+                resource_type, resource_id = key.split('/', 1)
+                wanted.setdefault(resource_type, []).append(resource_id)
+
+        tasks = [task for resource_type, ids in wanted.items() for task in self.plan(resource_type, ids)]
+        errors, failed, sent = {}, set(), 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [(task, pool.submit(self.fetch, task)) for task in tasks]
+            for (kind, resource_type, ids), future in futures:
+                try:
+                    chunk, chunk_sent = future.result()
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    errors[f"{kind} {resource_type}/{ids[0]} (+{len(ids) - 1})"] = str(e)
+                    failed.update(f"{resource_type}/{i}" for i in ids)
+                    sent += 1
+                    continue
+                sent += chunk_sent
+                found.update(chunk)
+                if self.store is not None:
+                    for resource in chunk.values():
+                        self.store.put(resource)
+        return BatchReadResult(keys, found, errors, sent, from_store, failed)
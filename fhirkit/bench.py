@@ -0,0 +1,115 @@
+"""
+Proxy Benchmark
+1. Hammers a fixed set of requests (metadata, SMART configuration, a
+   Patient search) through the runner's session, concurrently
+2. Reports latency percentiles, bytes on the wire vs decoded, and proxy
+   cache hits (X-Cache-Status) per target
+3. --save / --compare turn two runs into a before/after table, e.g. for
+   the default vs tuned nginx profile
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fhirkit.deadline import resize_pool
+from fhirkit.histogram import LatencyHistogram
+
+TARGETS = [
+    ('metadata', '/metadata', None),
+    ('smart-configuration', '/.well-known/smart-configuration', None),
+    ('search', '/Patient', {'_count': 50}),
+]
+
+
+class TargetStats:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.lock = threading.Lock()
+        self.wire = 0
+        self.decoded = 0
+        self.hits = 0
+        self.errors = 0
+
+    def to_dict(self):
+        n = self.latency.count or 1
+        return dict(self.latency.summary(), wire_bytes=round(self.wire / n), decoded_bytes=round(self.decoded / n),
+                    cache_hits=self.hits, errors=self.errors)
+
+
+def fetch(session, url, params, headers, stats):
+    start = time.perf_counter()
+    try:
+        res = session.get(url, params=params, headers=headers, stream=True)
+        content = res.content
+        wire = res.raw.tell() or len(content)
+    except requests.exceptions.RequestException:
+        with stats.lock:
+            stats.errors += 1
+        return
+    latency = time.perf_counter() - start
+    with stats.lock:
+        if res.status_code >= 400:
+            stats.errors += 1
+            return
+        stats.latency.record(latency)
+        stats.wire += wire
+        stats.decoded += len(content)
+        stats.hits += res.headers.get('X-Cache-Status', '') == 'HIT'
+
+
+def run_bench(runner, requests_per_target=200, concurrency=8, targets=TARGETS):
+    """{target: summary dict}"""
+    headers = dict(runner.get_headers(), **{'Accept': 'application/fhir+json', 'Accept-Encoding': 'gzip'})
+    resize_pool(runner.session, runner.fhir_url, concurrency)
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, path, params in targets:
+            stats = TargetStats()
+            fetch(runner.session, runner.fhir_url + path, params, headers, TargetStats())  # warm-up
+            list(pool.map(lambda _: fetch(runner.session, runner.fhir_url + path, params, headers, stats),
+                          range(requests_per_target)))
+            results[name] = stats.to_dict()
+    return results
+
+
+def format_results(results, label=''):
+    lines = [f"{'Target':<22}{'n':>6}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'wire B':>10}{'decoded B':>11}"
+             f"{'hits':>7}{'err':>5}  {label}"]
+    for name, r in results.items():
+        def fmt(v):
+            return f"{v:>9.1f}" if v is not None else f"{'-':>9}"
+        lines.append(f"{name:<22}{r['count']:>6}{fmt(r['p50'])}{fmt(r['p95'])}{fmt(r['p99'])}"
+                     f"{r['wire_bytes']:>10}{r['decoded_bytes']:>11}{r['cache_hits']:>7}{r['errors']:>5}")
+    return "\n".join(lines)
+
+
+def format_comparison(before, after):
+    """p50/p95/wire-size change per target, after vs before"""
+    def change(a, b):
+        if not a or b is None:
+            return f"{'-':>9}"
+        return f"{(b - a) / a * 100:>+8.0f}%"
+    lines = [f"{'Target':<22}{'p50 before':>11}{'after':>9}{'change':>9}{'p95 before':>11}{'after':>9}{'change':>9}"
+             f"{'wire B before':>14}{'after':>8}{'change':>9}"]
+    for name in after:
+        if name not in before:
+            continue
+        a, b = before[name], after[name]
+        lines.append(f"{name:<22}{a['p50'] or 0:>11.1f}{b['p50'] or 0:>9.1f}{change(a['p50'], b['p50'])}"
+                     f"{a['p95'] or 0:>11.1f}{b['p95'] or 0:>9.1f}{change(a['p95'], b['p95'])}"
+                     f"{a['wire_bytes']:>14}{b['wire_bytes']:>8}{change(a['wire_bytes'], b['wire_bytes'])}")
+    return "\n".join(lines)
+
+
+def save(path, label, results):
+    with open(path, 'w') as f:
+        json.dump({'label': label, 'at': time.time(), 'results': results}, f, indent=2)
+
+
+def load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
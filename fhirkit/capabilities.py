@@ -0,0 +1,188 @@
+"""
+CapabilityStatement Planner
+1. Fetches /metadata once and caches it on disk, keyed by server URL,
+   software and version (.fhir_cache/); a cheap /metadata?_summary=true
+   check drops the cached copy once the server reports another version
+2. Indexes resource types, interactions, search params and _include /
+   _revinclude values
+3. Plans each interaction before it is sent: send it, skip it, or reroute
+   a create to an update-as-create (PUT with a client id)
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+
+CACHE_DIR = '.fhir_cache'
+MAX_AGE = 24 * 3600
+
+
+def slug(text):
+    return re.sub(r'[^A-Za-z0-9.]+', '-', str(text)).strip('-') or 'unknown'
+
+
+class Capabilities:
+    """What one server declares it supports"""
+
+    _loaded = {}
+    _loaded_lock = threading.Lock()
+
+    def __init__(self, statement=None):
+        self.statement = statement
+        self.known = bool(statement)
+        self.resources = {}
+        self.system_interactions = set()
+        software = (statement or {}).get('software', {})
+        self.software = (software.get('name', 'unknown'), software.get('version', 'unknown'))
+        self.fhir_version = (statement or {}).get('fhirVersion')
+
+        for rest in (statement or {}).get('rest', []):
+            if rest.get('mode', 'server') != 'server':
+                continue
+            self.system_interactions.update(i.get('code') for i in rest.get('interaction', []))
+            for res in rest.get('resource', []):
+                self.resources[res['type']] = {
+                    'interactions': {i.get('code') for i in res.get('interaction', [])},
+                    'search_params': {p.get('name') for p in res.get('searchParam', [])},
+                    'includes': set(res.get('searchInclude', [])),
+                    'revincludes': set(res.get('searchRevInclude', [])),
+                    'update_create': bool(res.get('updateCreate')),
+                    'conditional_create': bool(res.get('conditionalCreate')),
+                    'operations': {o.get('name', '').lstrip('$') for o in res.get('operation', [])},
+                }
+
+    @classmethod
+    def load(cls, session, fhir_url, headers=None, cache_dir=CACHE_DIR, max_age=MAX_AGE, refresh=False, timeout=10,
+             check_version=True):
+        """Capabilities for `fhir_url`: process memory, then disk cache, then /metadata
+
+        The disk cache is used only while the server still reports the software
+        version it was fetched from (check_version=False trusts it as is). A server that cannot be reached yields
+        permissive (unknown) capabilities, so nothing is skipped on the
+        strength of a failed fetch.
+        """
+        with cls._loaded_lock:
+            if not refresh and fhir_url in cls._loaded:
+                return cls._loaded[fhir_url]
+
+            index_path = os.path.join(cache_dir, 'index.json')
+            index = {}
+            if os.path.exists(index_path):
+                try:
+                    with open(index_path, 'r') as f:
+                        index = json.load(f)
+                except (OSError, ValueError):
+                    index = {}
+
+            entry = index.get(fhir_url)
+            if not refresh and entry and time.time() - entry.get('fetched_at', 0) < max_age:
+                try:
+                    with open(os.path.join(cache_dir, entry['file']), 'r') as f:
+                        cached = cls(json.load(f))
+                except (OSError, ValueError, KeyError):
+                    cached = None
+                # An unreachable server keeps the cached copy; an upgraded one does not
+                current = cls.current_software(session, fhir_url, headers, timeout) \
+                    if cached and check_version else None
+                if cached is not None and current in (None, cached.software):
+                    caps = cls._loaded[fhir_url] = cached
+                    return caps
+
+            try:
+                res = session.get(f"{fhir_url}/metadata", headers=headers, timeout=timeout)
+                statement = res.json() if res.status_code == 200 else None
+            except (requests.exceptions.RequestException, ValueError):
+                statement = None
+            if not statement or statement.get('resourceType') != 'CapabilityStatement':
+                return cls()  # not cached: try again next time
+
+            caps = cls._loaded[fhir_url] = cls(statement)
+            url = urllib.parse.urlsplit(fhir_url)
+            name = f"capabilities-{slug(url.netloc + url.path)}-{slug(caps.software[0])}-{slug(caps.software[1])}.json"
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(os.path.join(cache_dir, name), 'w') as f:
+                    json.dump(statement, f)
+                index[fhir_url] = {'file': name, 'fetched_at': time.time(),
+                                   'software': list(caps.software)}
+                tmp = index_path + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(index, f, indent=2)
+                os.replace(tmp, index_path)
+            except OSError:
+                pass  # the cache is an optimization only
+            return caps
+
+    @staticmethod
+    def current_software(session, fhir_url, headers=None, timeout=10):
+        """(name, version) the server reports now, from /metadata?_summary=true; None if it cannot say"""
+        try:
+            res = session.get(f"{fhir_url}/metadata", params={'_summary': 'true'}, headers=headers, timeout=timeout)
+            statement = res.json() if res.status_code == 200 else None
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+        if not isinstance(statement, dict) or statement.get('resourceType') != 'CapabilityStatement':
+            return None
+        software = statement.get('software', {})
+        return software.get('name', 'unknown'), software.get('version', 'unknown')
+
+    def supports(self, resource_type, interaction):
+        if not self.known:
+            return True
+        return interaction in self.resources.get(resource_type, {}).get('interactions', ())
+
+    def supports_system(self, interaction):
+        """System-level interactions such as 'batch' and 'transaction'"""
+        return not self.known or interaction in self.system_interactions
+
+    def search_params(self, resource_type):
+        return self.resources.get(resource_type, {}).get('search_params', set())
+
+    def supports_search_param(self, resource_type, param):
+        return not self.known or param in self.search_params(resource_type)
+
+    def supports_include(self, resource_type, include):
+        """e.g. supports_include('Encounter', 'Encounter:subject')"""
+        if not self.known:
+            return True
+        includes = self.resources.get(resource_type, {}).get('includes', set())
+        return include in includes or '*' in includes
+
+    def supports_revinclude(self, resource_type, revinclude):
+        """e.g. supports_revinclude('Patient', 'Encounter:subject')"""
+        if not self.known:
+            return True
+        revincludes = self.resources.get(resource_type, {}).get('revincludes', set())
+        return revinclude in revincludes or '*' in revincludes
+
+    def supports_operation(self, resource_type, name):
+        """Only when declared, e.g. supports_operation('Patient', 'everything')"""
+        return name.lstrip('$') in self.resources.get(resource_type, {}).get('operations', ())
+
+    def supports_conditional_create(self, resource_type):
+        """Only when declared: a server that ignores If-None-Exist would create duplicates"""
+        return self.resources.get(resource_type, {}).get('conditional_create', False)
+
+    def plan(self, resource_type, interaction):
+        """'send', 'skip', or 'update' (create rerouted to update-as-create)"""
+        if self.supports(resource_type, interaction):
+            return 'send'
+        if (interaction == 'create' and self.supports(resource_type, 'update')
+                and self.resources.get(resource_type, {}).get('update_create')):
+            return 'update'
+        return 'skip'
+
+    def describe(self, resource_types):
+        """Printable lines summarizing support for the given resource types"""
+        if not self.known:
+            return ["Server capabilities unknown (/metadata unavailable); all operations will be attempted"]
+        lines = [f"Server: {self.software[0]} {self.software[1]} (FHIR {self.fhir_version or '?'})"]
+        for resource_type in resource_types:
+            interactions = sorted(self.resources.get(resource_type, {}).get('interactions', ()))
+            lines.append(f"  {resource_type}: {', '.join(interactions) or 'not supported'}")
+        return lines
@@ -0,0 +1,313 @@
+"""
+Record / Replay
+1. RecordingAdapter captures every request/response pair of a session into a
+   gzip JSON-lines cassette, with bearer tokens and OAuth secrets redacted
+2. ReplayAdapter serves a cassette back from memory, at full speed or on
+   the recorded timeline (start offsets and latencies), so client-side
+   changes can be benchmarked offline
+3. configure() / attach() pick the mode for every TestRunner session in the
+   process (also settable with FHIR_RECORD / FHIR_REPLAY / FHIR_REPLAY_SPEED);
+   while replaying, ReplayTokens stands in for the TokenStore
+4. stream=True response bodies are copied as the caller reads them, into a
+   spool that moves to a temp file past SPILL_AT, and written into the
+   cassette on save() without being held in memory
+"""
+
+import atexit
+import base64
+import datetime
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+VERSION = 1
+REDACTED = '<redacted>'
+SPILL_AT = 1024 * 1024  # streamed bodies beyond this are spooled to disk while recording
+SPOOLED = '\x00spooled\x00'  # body placeholder, replaced by the spool's base64 on save
+SECRET_HEADERS = {'authorization', 'cookie', 'set-cookie', 'proxy-authorization'}
+SECRET_FIELDS = ('access_token', 'refresh_token', 'id_token', 'client_secret')
+# Form posts to the token endpoint also carry the authorization code and PKCE verifier
+# ("code" is left alone in JSON: every FHIR coding has one)
+SECRET_FORM_FIELDS = SECRET_FIELDS + ('code', 'code_verifier', 'password')
+SECRET_JSON = re.compile(r'("(?:%s)"\s*:\s*")[^"]*(")' % '|'.join(SECRET_FIELDS))
+# Path segments that look like server-assigned ids (numbers, uuids, long hex)
+ID_SEGMENT = re.compile(r'^([0-9]+|[0-9a-fA-F-]{16,})$')
+
+
+def redact_headers(headers):
+    return {k: (REDACTED if k.lower() in SECRET_HEADERS else v) for k, v in headers.items()}
+
+
+def redact_body(text):
+    if not text:
+        return text
+    if '=' in text and not text.lstrip().startswith(('{', '[')):
+        fields = urllib.parse.parse_qsl(text, keep_blank_values=True)
+        if fields:
+            return urllib.parse.urlencode([(k, REDACTED if k in SECRET_FORM_FIELDS else v) for k, v in fields])
+    return SECRET_JSON.sub(r'\1%s\2' % REDACTED, text)
+
+
+def encode_body(body):
+    """(text, is_base64) for a request/response body"""
+    if body is None:
+        return None, False
+    if isinstance(body, str):
+        return body, False
+    if not isinstance(body, (bytes, bytearray)):
+        return f"<streamed body, {len(body)} bytes>", False  # not buffered just to be recorded
+    try:
+        return body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        return base64.b64encode(body).decode('ascii'), True
+
+
+def route(method, url):
+    """Looser match key: ids collapsed, query params sorted"""
+    parts = urllib.parse.urlsplit(url)
+    path = '/'.join(':id' if ID_SEGMENT.match(p) else p for p in parts.path.split('/'))
+    query = sorted(k for k, _ in urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    return method, path, tuple(query)
+
+
+def exact(method, url):
+    parts = urllib.parse.urlsplit(url)
+    query = sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    return method, parts.path, tuple(query)
+
+
+class Recorder:
+    """Interactions captured in this process; saved to `path` on save() or at exit"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.interactions = []
+
+    def add(self, request, response, elapsed, streamed=False):
+        body, body_b64 = encode_body(request.body)
+        if streamed:
+            content, content_b64 = None, True  # filled in as the caller reads it
+        else:
+            content, content_b64 = encode_body(response.content)
+        interaction = {
+            'at': round(time.perf_counter() - self.started - elapsed, 4),
+            'elapsed': round(elapsed, 4),
+            'method': request.method,
+            'url': request.url,
+            'request_headers': redact_headers(request.headers),
+            'request_body': body if body_b64 else redact_body(body),
+            'request_body_b64': body_b64,
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': redact_headers(response.headers),
+            'body': content if content_b64 else redact_body(content),
+            'body_b64': content_b64,
+        }
+        if streamed:
+            self.tee(response, interaction)
+        with self.lock:
+            self.interactions.append(interaction)
+
+    @staticmethod
+    def tee(response, interaction):
+        """Copy the decoded chunks of a streamed body into a spool while the caller reads them"""
+        spool = tempfile.SpooledTemporaryFile(max_size=SPILL_AT)
+        interaction['spool'] = spool
+        stream = response.raw.stream
+
+        def teed(*args, **kwargs):
+            for chunk in stream(*args, **kwargs):
+                spool.write(chunk)
+                yield chunk
+        response.raw.stream = teed
+
+    @staticmethod
+    def write_interaction(f, interaction):
+        spool = interaction.get('spool')
+        if spool is None:
+            f.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+            return
+        line = json.dumps(dict((k, v) for k, v in interaction.items() if k != 'spool'), separators=(',', ':'))
+        head, tail = line.replace('"body":null', '"body":' + json.dumps(SPOOLED), 1).split(json.dumps(SPOOLED), 1)
+        f.write(head + '"')
+        end = spool.tell()
+        spool.seek(0)
+        while True:
+            block = spool.read(3 * 65536)  # a multiple of 3, so the base64 pieces join up
+            if not block:
+                break
+            f.write(base64.b64encode(block).decode('ascii'))
+        spool.seek(end)
+        f.write('"' + tail + '\n')
+
+    def save(self):
+        with self.lock:
+            interactions = list(self.interactions)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps({'version': VERSION, 'recorded_at': datetime.datetime.now().isoformat(),
+                                'interactions': len(interactions)}) + '\n')
+            for interaction in interactions:
+                self.write_interaction(f, interaction)
+        os.replace(tmp, self.path)
+        return len(interactions)
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        self.recorder.add(request, response, time.perf_counter() - start, streamed=kwargs.get('stream', False))
+        return response
+
+
+def load_cassette(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != VERSION:
+            raise ValueError(f"{path}: unsupported cassette version {header.get('version')}")
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayAdapter(BaseAdapter):
+    """Serves recorded responses in order: exact URL match first, then by route (ids collapsed)
+
+    With a speed, each response waits until its recorded start offset (`at`,
+    scaled) and then its recorded latency, so the gaps between requests are
+    kept as well.
+    """
+
+    def __init__(self, interactions, speed=None):
+        super().__init__()
+        self.speed = speed
+        self.started = None
+        self.first_at = min((i.get('at', 0) for i in interactions), default=0)
+        self.lock = threading.Lock()
+        self.by_exact = {}
+        self.by_route = {}
+        for i, interaction in enumerate(interactions):
+            self.by_exact.setdefault(exact(interaction['method'], interaction['url']), []).append(i)
+            self.by_route.setdefault(route(interaction['method'], interaction['url']), []).append(i)
+        self.interactions = interactions
+        self.used = set()
+        self.misses = 0
+
+    def take(self, request):
+        with self.lock:
+            for index, key in ((self.by_exact, exact(request.method, request.url)),
+                               (self.by_route, route(request.method, request.url))):
+                for i in index.get(key, ()):
+                    if i not in self.used:
+                        self.used.add(i)
+                        return self.interactions[i]
+            self.misses += 1
+        return None
+
+    def send(self, request, **kwargs):
+        interaction = self.take(request)
+        if interaction is None:
+            raise requests.exceptions.ConnectionError(
+                f"replay: no recorded interaction for {request.method} {request.url}", request=request)
+        if self.speed:
+            with self.lock:
+                if self.started is None:
+                    self.started = time.perf_counter()
+            due = self.started + (interaction.get('at', self.first_at) - self.first_at) / self.speed
+            time.sleep(max(0.0, due - time.perf_counter()) + interaction['elapsed'] / self.speed)
+
+        response = requests.models.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction.get('reason')
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        body = interaction['body'] or ''
+        response._content = base64.b64decode(body) if interaction['body_b64'] else body.encode('utf-8')
+        for name in ('Content-Encoding', 'Content-Length', 'Transfer-Encoding'):
+            response.headers.pop(name, None)  # recorded bodies are stored decoded
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=interaction['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+
+class ReplayTokens:
+    """TokenStore stand-in while replaying: nothing is refreshed over the network or written to .env
+
+    A replayed 401 is retried with the same token; the cassette answers the
+    retry with whatever the recorded one got.
+    """
+
+    def __init__(self, token=None):
+        self.value = token or REDACTED
+
+    def token(self):
+        return self.value
+
+    def refresh(self, stale_token=None):
+        return self.value
+
+
+# -- process-wide mode
+
+_settings = {'record': None, 'replay': None, 'speed': None}
+_recorder = None
+_cassettes = {}
+_lock = threading.Lock()
+
+
+def configure(record=None, replay=None, speed=None):
+    """Set the mode for sessions attached from now on (replay wins over record)"""
+    _settings.update(record=record, replay=replay, speed=speed)
+
+
+def recorder():
+    """The process Recorder (None unless recording)"""
+    global _recorder
+    with _lock:
+        path = _settings['record'] or os.environ.get('FHIR_RECORD')
+        if path and (_recorder is None or _recorder.path != path):
+            _recorder = Recorder(path)
+            atexit.register(_recorder.save)
+        return _recorder if path else None
+
+
+def replaying():
+    return bool(_settings['replay'] or os.environ.get('FHIR_REPLAY'))
+
+
+def attach(session):
+    """Mount the recording or replay adapter on `session` if a mode is configured; returns it"""
+    replay = _settings['replay'] or os.environ.get('FHIR_REPLAY')
+    if replay:
+        speed = _settings['speed'] if _settings['speed'] is not None else float(os.environ.get('FHIR_REPLAY_SPEED', 0))
+        with _lock:
+            if replay not in _cassettes:
+                _cassettes[replay] = load_cassette(replay)
+        # Own cursor per session, so every runner replays the whole cassette
+        adapter = ReplayAdapter(_cassettes[replay], speed=speed or None)
+    elif recorder() is not None:
+        adapter = RecordingAdapter(_recorder)
+    else:
+        return None
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
@@ -0,0 +1,566 @@
+"""
+Tools Command Line
+Shared argument parsing for the per-server tools scripts
+(4_openemr_tools.py / 4_openmrs_tools.py).
+"""
+
+import argparse
+import contextlib
+import json
+import mimetypes
+import os
+import statistics
+import time
+
+import requests
+
+from fhirkit import attachments, bench, cassette, export, fixtures, ingest, subscriptions
+from fhirkit.batchread import BatchReader
+from fhirkit.distributed import Coordinator, Worker
+from fhirkit.faultproxy import FaultProxy
+from fhirkit.graph import CHART_TYPES, PATIENT_PARAM, JoinedFetch
+from fhirkit.healthprobe import SLO, HealthProbe
+from fhirkit.integrity import SOURCES, IntegrityScanner
+from fhirkit.loadgen import LoadGenerator, SyntheticRunner, WorkloadPlan, format_report, parse_mix
+from fhirkit.manifest import created_id
+from fhirkit.runlog import RunLog
+from fhirkit.scenario import format_checks
+from fhirkit.search import Search
+from fhirkit.singleflight import SingleFlight
+from fhirkit.teardown import teardown
+
+
+def add_plan_arguments(parser):
+    parser.add_argument('--plan', help="JSON workload plan or scenario file (vus, rate, duration, mix, workflows)")
+    parser.add_argument('--vus', type=int, help="Virtual users (default 1)")
+    parser.add_argument('--rate', type=float, help="Arrival rate per second (default: closed model)")
+    parser.add_argument('--duration', type=float, help="Run length in seconds (default 30)")
+    parser.add_argument('--mix', help="Scenario weights, e.g. search_patients=70,create_patient=30")
+    parser.add_argument('--deadline', type=float, help="Seconds each scenario iteration may take (default: none)")
+    parser.add_argument('--fixtures', type=int, help="Pre-create this many patients (+ encounters) before the run")
+    parser.add_argument('--fixture-order', choices=fixtures.ORDERS, help="How fixtures are handed out")
+    parser.add_argument('--fixture-file', help=f"Where fixtures persist between runs (default {fixtures.FIXTURES_FILE})")
+
+
+def add_runner_arguments(parser):
+    parser.add_argument('--synthetic', action='store_true',
+                        help="Use simulated operations instead of a live FHIR server")
+
+
+def build_plan(args):
+    plan = WorkloadPlan.load(args.plan) if args.plan else WorkloadPlan()
+    if args.vus is not None:
+        plan.vus = args.vus
+    if args.rate is not None:
+        plan.rate = args.rate or None
+    if args.duration is not None:
+        plan.duration = args.duration
+    if args.mix:
+        plan.mix = parse_mix(args.mix)
+    if args.deadline is not None:
+        plan.deadline = args.deadline or None
+    if args.fixtures is not None:
+        plan.fixtures = dict(plan.fixtures or {}, patients=args.fixtures) if args.fixtures else None
+    if plan.fixtures and args.fixture_order:
+        plan.fixtures['order'] = args.fixture_order
+    if plan.fixtures and args.fixture_file:
+        plan.fixtures['file'] = args.fixture_file
+    return plan
+
+
+def pick_runner_factory(args, runner_factory):
+    return SyntheticRunner if args.synthetic else runner_factory
+
+
+def load_plan(args):
+    """build_plan(), or None after saying why the plan / scenario file is unusable"""
+    try:
+        return build_plan(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ Invalid plan: {e}")
+        return None
+
+
+def check_assertions(plan, totals):
+    """Print the scenario's assertions; exit status 0 when all are met"""
+    if plan.scenario is None or not plan.scenario.checks:
+        return 0
+    results = plan.scenario.evaluate(totals, plan.duration)
+    print(format_checks(results))
+    return 0 if all(met for _, met, _ in results) else 1
+
+
+def cmd_load(args, runner_factory):
+    plan = load_plan(args)
+    if plan is None:
+        return 2
+    print(f"🚀 Load run: {plan.vus} VUs, rate {plan.rate or 'closed'}, {plan.duration:.0f}s, mix {plan.mix}")
+    generator = LoadGenerator(plan, pick_runner_factory(args, runner_factory))
+    try:
+        totals = generator.run()
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    print(format_report(totals, plan.duration))
+    if SingleFlight.shared().joined:
+        print(SingleFlight.shared().describe())
+    return check_assertions(plan, totals)
+
+
+def cmd_coordinator(args, runner_factory):
+    plan = load_plan(args)
+    if plan is None:
+        return 2
+    coordinator = Coordinator(plan, args.workers, host=args.host, port=args.port, start_delay=args.start_delay)
+    totals = coordinator.run()
+    return check_assertions(plan, totals) if totals is not None else 1
+
+
+def cmd_worker(args, runner_factory):
+    worker = Worker(args.coordinator, pick_runner_factory(args, runner_factory), name=args.name)
+    return 0 if worker.run() is not None else 1
+
+
+def cmd_probe(args, runner_factory):
+    intervals = {'metadata': args.interval, 'search': args.interval,
+                 'roundtrip': args.roundtrip_interval, 'token': args.token_interval}
+    names = [n.strip() for n in args.transactions.split(',') if n.strip()]
+    unknown = [n for n in names if n not in intervals]
+    if unknown:
+        print(f"❌ Unknown transaction(s) {', '.join(unknown)} (expected some of {', '.join(intervals)})")
+        return 2
+    try:
+        slos = [SLO(spec, window=args.slo_window) for spec in args.slo]
+        probe = HealthProbe(runner_factory(), intervals={n: intervals[n] for n in names}, slos=slos,
+                            alert_webhook=args.alert_webhook, timeout=args.timeout)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+    probe.serve(args.host, args.port)
+    return 0
+
+
+def cmd_teardown(args, runner_factory):
+    return teardown(runner_factory(), run_ids=args.run or None, dry_run=args.dry_run, workers=args.workers,
+                    batch_size=args.batch_size, use_batch=not args.no_batch)
+
+
+def cmd_record(args, runner_factory):
+    cassette.configure(record=args.cassette)
+    runner_factory().run()
+    print(f"📼 Recorded {cassette.recorder().save()} interactions to {args.cassette} (tokens redacted)")
+    return 0
+
+
+def cmd_replay(args, runner_factory):
+    cassette.configure(replay=args.cassette, speed=args.speed)
+    timings = []
+    misses = 0
+    for i in range(args.repeat):
+        start = time.perf_counter()
+        # Only the first pass is shown; repeats are for timing
+        with RunLog.shared().silenced() if i or args.quiet else contextlib.nullcontext():
+            runner = runner_factory()
+            runner.run()
+        timings.append(time.perf_counter() - start)
+        misses += getattr(runner.session.get_adapter(runner.fhir_url), 'misses', 0)
+    mode = 'full speed' if not args.speed else f"{args.speed:g}x recorded timing"
+    print(f"\n📼 Replayed {args.cassette} {args.repeat}x at {mode}: "
+          f"mean {statistics.mean(timings) * 1000:.1f} ms, best {min(timings) * 1000:.1f} ms per run")
+    if misses:
+        print(f"⚠️  {misses} request(s) had no recorded interaction (client traffic differs from the recording)")
+    return 0
+
+
+def cmd_proxy(args, runner_factory):
+    try:
+        rules = FaultProxy.load_rules(args.rules) if args.rules else []
+        proxy = FaultProxy(args.upstream, rules, host=args.host, port=args.port, seed=args.seed).start()
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return 2
+    print(f"💥 Fault proxy {proxy.url} -> {proxy.upstream} ({len(rules)} rule(s), seed {args.seed})")
+    print(f"   Point the base URL in .env at {proxy.url}; stats at {proxy.url}/__fault/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.stop()
+    for rule in proxy.stats():
+        print(f"  {rule['route'] or '(all)'}: " + ', '.join(f"{k}={v}" for k, v in rule.items()
+                                                           if k not in ('route', 'methods') and v))
+    return 0
+
+
+def cmd_bench(args, runner_factory):
+    runner = runner_factory()
+    print(f"📊 Benchmarking {runner.fhir_url}: {args.requests} requests per target, concurrency {args.concurrency}")
+    results = bench.run_bench(runner, args.requests, args.concurrency)
+    print(bench.format_results(results, args.label))
+    if args.save:
+        bench.save(args.save, args.label, results)
+        print(f"Saved to {args.save}")
+    if args.compare:
+        before = bench.load(args.compare)
+        print(f"\nvs {before['label'] or args.compare}:")
+        print(bench.format_comparison(before['results'], results))
+    return 0
+
+
+def cmd_search(args, runner_factory):
+    runner = runner_factory()
+    params = dict(p.split('=', 1) for p in args.param)
+    if args.summary == 'count':
+        print(f"{args.resource_type}: {Search(runner).count(args.resource_type, params)} matching")
+        return 0
+    elements = [e.strip() for e in args.elements.split(',') if e.strip()] if args.elements else None
+    result = Search(runner).search(args.resource_type, elements=elements, summary=args.summary, params=params,
+                                   pages=args.pages, count=args.count)
+    print(result.describe())
+    for record in result.records[:args.show]:
+        print(f"  {record.to_dict()}")
+    return 0
+
+
+def cmd_chart(args, runner_factory):
+    runner = runner_factory()
+    types = [t.strip() for t in args.types.split(',') if t.strip()] if args.types else CHART_TYPES
+    unknown = [t for t in types if t not in PATIENT_PARAM]
+    if unknown:
+        print(f"❌ Unknown chart type(s) {', '.join(unknown)} (expected some of {', '.join(PATIENT_PARAM)})")
+        return 2
+    graph = JoinedFetch(runner).patient_graph(args.patient_id, types=types)
+    for line in graph.chart(args.patient_id):
+        print(line)
+    return 0 if graph.get('Patient', args.patient_id) else 1
+
+
+def cmd_read(args, runner_factory):
+    runner = runner_factory()
+    refs = list(args.refs)
+    if args.file:
+        with open(args.file, 'r') as f:
+            refs += [line.strip() for line in f if line.strip()]
+    result = BatchReader(runner, workers=args.workers, max_url=args.max_url, use_store=False).read(refs)
+    print(result.describe())
+    for key, resource in result:
+        if resource is None:
+            print(f"  ❌ {key}: missing")
+        elif args.show:
+            print(f"  {key}: {json.dumps(resource)[:200]}")
+    for chunk, error in result.errors.items():
+        print(f"  ❌ {chunk}: {error}")
+    return 1 if result.missing else 0
+
+
+def cmd_integrity(args, runner_factory):
+    runner = runner_factory()
+    sources = [t.strip() for t in args.types.split(',') if t.strip()] if args.types else None
+    scan = [t.strip() for t in args.scan.split(',') if t.strip()] if args.scan else ()
+    report = IntegrityScanner(runner, sources=sources, scan=scan, memory_mb=args.memory_mb,
+                              page_size=args.page_size, out=args.out).run()
+    print(report.format())
+    if args.out:
+        print(f"Dangling references written to {args.out}")
+    return 1 if report.dangling_total else 0
+
+
+def cmd_fixtures(args, runner_factory):
+    pool = fixtures.prepare(runner_factory, args.patients, encounters=args.encounters, path=args.file,
+                            workers=args.workers)
+    print(f"✅ {len(pool)} fixture(s) ready in {args.file}")
+    return 0 if len(pool) else 1
+
+
+def cmd_upload(args, runner_factory):
+    runner = runner_factory()
+    content_type = args.content_type or mimetypes.guess_type(args.path)[0] or 'application/octet-stream'
+    source = attachments.AttachmentSource(args.path, content_type)
+    start = time.perf_counter()
+    res = attachments.upload(runner, source, args.patient, args.encounter, mode=args.mode)
+    elapsed = time.perf_counter() - start
+    if not 200 <= res.status_code < 300:
+        print(f"❌ Upload failed with status {res.status_code}: {res.text[:200]}")
+        return 1
+    print(f"✅ DocumentReference/{created_id('DocumentReference', res)}: {source.size:,} bytes in {elapsed:.1f}s "
+          f"({source.size / 1024 / 1024 / max(elapsed, 1e-9):.1f} MB/s, {args.mode})")
+    return 0
+
+
+def cmd_download(args, runner_factory):
+    runner = runner_factory()
+    attachment = {'url': args.url} if args.url else {'inline': f"DocumentReference/{args.document_id}"}
+    start = time.perf_counter()
+    try:
+        written, sha1 = attachments.download(runner, attachment, args.out)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"❌ Download failed: {e}")
+        return 1
+    print(f"✅ {written:,} bytes to {args.out} in {time.perf_counter() - start:.1f}s (sha1 {sha1})")
+    return 0
+
+
+def cmd_ingest(args, runner_factory):
+    try:
+        ingest.require_numpy()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    runner = runner_factory()
+    if args.npz or args.csv:
+        feed = ingest.VitalsFeed.from_npz(args.npz) if args.npz else ingest.VitalsFeed.from_csv(args.csv)
+    else:
+        pool = fixtures.prepare(runner_factory, args.patients, encounters=0, path=args.fixture_file, runner=runner)
+        fixture_list = pool.fixtures[:args.patients]
+        encounters = [f.get('encounter', '') for f in fixture_list]
+        feed = ingest.VitalsFeed.synthetic([f['patient'] for f in fixture_list], args.readings, args.interval,
+                                           seed=args.seed, encounters=encounters if any(encounters) else None)
+    print(f"🧪 {len(feed)} reading(s) of {', '.join(feed.readings)}")
+    sender = ingest.VitalsIngest(runner, batch_size=args.batch_size, workers=args.workers)
+    if not sender.use_batch:
+        print("⚠️  Server does not declare batch: sending one create per Observation")
+    report = sender.run(feed)
+    print(report.format())
+    return 0 if not report.failed else 1
+
+
+def cmd_export(args, runner_factory):
+    try:
+        exporter = export.ColumnarExporter(args.out, args.format, args.batch_rows)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return 1
+    types = [t.strip() for t in args.types.split(',') if t.strip()]
+    params = dict(p.split('=', 1) for p in args.param)
+    start = time.perf_counter()
+    try:
+        if args.ndjson:
+            for path in args.ndjson:
+                print(f"📄 {path}: {exporter.write(export.ndjson_file(path))} resource(s)")
+        else:
+            runner = runner_factory()
+            if args.bulk:
+                for resource_type, url in export.bulk_export(runner, types, since=args.since):
+                    print(f"📄 {resource_type} ({url}): {exporter.write(export.ndjson_url(runner, url))} resource(s)")
+            for resource_type in types if not args.bulk else ():
+                if not runner.capabilities.supports(resource_type, 'search-type'):
+                    print(f"⏭️  Skipping {resource_type}: server does not declare 'search-type'")
+                    continue
+                print(f"🔎 {resource_type}: {exporter.export_search(runner, resource_type, args.page_size, params)} "
+                      f"resource(s)")
+    except (requests.exceptions.RequestException, RuntimeError, ValueError) as e:
+        print(f"❌ Export failed: {e}")
+        exporter.close()
+        return 1
+    summary = exporter.close()
+    elapsed = time.perf_counter() - start
+    total = sum(rows for rows, _, _, _ in summary.values())
+    for resource_type, (rows, skipped, path, size) in summary.items():
+        note = f", {skipped} malformed resource(s) skipped" if skipped else ""
+        print(f"✅ {path}: {rows} row(s), {size / 1024:.0f} KB{note}")
+    print(f"⏱️  {total} row(s) in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)")
+    return 0
+
+
+def cmd_subscribe(args, runner_factory):
+    runner = runner_factory()
+    types = [t.strip() for t in args.types.split(',') if t.strip()]
+    endpoint = args.endpoint or f"http://{args.host}:{args.port}/notify"
+    manager = subscriptions.SubscriptionManager(runner, types, endpoint, mode=args.mode, state_file=args.state_file)
+    counts = {}
+
+    def handle(resource, source):
+        runner.store.put(resource)
+        counts[resource['resourceType']] = counts.get(resource['resourceType'], 0) + 1
+        if args.verbose:
+            print(f"📨 {resource['resourceType']}/{resource['id']} ({source})")
+
+    feed = subscriptions.ChangeFeed(manager, handle, host=args.host, port=args.port, queue_size=args.queue_size,
+                                    consumers=args.consumers, progress=args.progress)
+    stats = feed.run(duration=args.duration, replay=args.replay, keep=args.keep)
+    for resource_type, count in sorted(counts.items()):
+        print(f"   {resource_type}: {count}")
+    return 0 if not stats['errors'] else 1
+
+
+def main(server_name, runner_factory, argv=None):
+    """Entry point; runner_factory builds one TestRunner per virtual user"""
+    parser = argparse.ArgumentParser(description=f"{server_name} FHIR tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('load', help="Run a load test from this machine")
+    add_plan_arguments(p)
+    add_runner_arguments(p)
+    p.set_defaults(func=cmd_load)
+
+    p = sub.add_parser('coordinator', help="Distribute a load test across worker agents")
+    add_plan_arguments(p)
+    p.add_argument('--workers', type=int, required=True, help="Number of workers to wait for")
+    p.add_argument('--host', default='127.0.0.1', help="Address to listen on (default 127.0.0.1)")
+    p.add_argument('--port', type=int, default=9400, help="Port to listen on (default 9400)")
+    p.add_argument('--start-delay', type=float, default=2.0,
+                   help="Seconds between the last registration and the synchronized start")
+    p.set_defaults(func=cmd_coordinator)
+
+    p = sub.add_parser('worker', help="Run a share of a coordinator's load test")
+    p.add_argument('--coordinator', default='http://127.0.0.1:9400', help="Coordinator URL")
+    p.add_argument('--name', help="Worker name shown by the coordinator (default: hostname)")
+    add_runner_arguments(p)
+    p.set_defaults(func=cmd_worker)
+
+    p = sub.add_parser('probe', help="Continuously probe the server and serve latency/availability metrics")
+    p.add_argument('--host', default='127.0.0.1', help="Status page address (default 127.0.0.1)")
+    p.add_argument('--port', type=int, default=9500, help="Status page port (default 9500)")
+    p.add_argument('--transactions', default='metadata,search,roundtrip,token',
+                   help="Synthetic transactions to run (default metadata,search,roundtrip,token)")
+    p.add_argument('--interval', type=float, default=15, help="Seconds between metadata/search probes")
+    p.add_argument('--roundtrip-interval', type=float, default=60, help="Seconds between create+delete probes")
+    p.add_argument('--token-interval', type=float, default=300, help="Seconds between token refresh probes")
+    p.add_argument('--timeout', type=float, default=10, help="Per-request timeout in seconds")
+    p.add_argument('--slo', action='append', default=[],
+                   help="SLO such as search:p95<300 (ms) or search:availability>=99.5; repeatable")
+    p.add_argument('--slo-window', choices=['5m', '1h'], default='5m', help="Window SLOs are judged over")
+    p.add_argument('--alert-webhook', help="URL to POST a JSON alert to on SLO breach/recovery")
+    p.set_defaults(func=cmd_probe)
+
+    p = sub.add_parser('teardown', help="Delete the resources recorded in the run manifests (.fhir_runs/)")
+    p.add_argument('--run', action='append', default=[], help="Run id to tear down (repeatable; default: all)")
+    p.add_argument('--workers', type=int, default=8, help="Concurrent requests (default 8)")
+    p.add_argument('--batch-size', type=int, default=50, help="DELETEs per batch Bundle (default 50)")
+    p.add_argument('--no-batch', action='store_true', help="Send individual DELETEs even if batch is supported")
+    p.add_argument('--dry-run', action='store_true', help="Only count what would be deleted")
+    p.set_defaults(func=cmd_teardown)
+
+    p = sub.add_parser('record', help="Run the test suite once, recording every request/response to a cassette")
+    p.add_argument('--cassette', required=True, help="Cassette file to write (gzip JSON lines)")
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser('replay', help="Run the test suite against a recorded cassette instead of the server")
+    p.add_argument('--cassette', required=True, help="Cassette file to replay")
+    p.add_argument('--speed', type=float, default=0,
+                   help="Replay recorded latencies at this speed factor (default 0: full speed)")
+    p.add_argument('--repeat', type=int, default=1, help="Replay this many times and report timings")
+    p.add_argument('--quiet', action='store_true', help="Hide the test output of the first pass too")
+    p.set_defaults(func=cmd_replay)
+
+    p = sub.add_parser('proxy', help="Run a local proxy that injects latency and faults per route")
+    p.add_argument('--upstream', required=True, help="Server to forward to, e.g. https://localhost:8443")
+    p.add_argument('--rules', help="JSON rules file (list of per-route fault rules)")
+    p.add_argument('--host', default='127.0.0.1', help="Address to listen on (default 127.0.0.1)")
+    p.add_argument('--port', type=int, default=9600, help="Port to listen on (default 9600)")
+    p.add_argument('--seed', type=int, help="Random seed, for reproducible fault sequences")
+    p.set_defaults(func=cmd_proxy)
+
+    p = sub.add_parser('bench', help="Benchmark metadata, SMART configuration and search through the proxy")
+    p.add_argument('--requests', type=int, default=200, help="Requests per target (default 200)")
+    p.add_argument('--concurrency', type=int, default=8, help="Concurrent requests (default 8)")
+    p.add_argument('--label', default='', help="Name for this run, e.g. before / after")
+    p.add_argument('--save', help="Write the results to this JSON file")
+    p.add_argument('--compare', help="Results file of an earlier run to compare against")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser('search', help="Projected search (_elements / _summary) with wire vs decoded byte counts")
+    p.add_argument('resource_type', help="e.g. Patient")
+    p.add_argument('--elements', help="Elements to return, e.g. name,birthDate (id is always included)")
+    p.add_argument('--summary', choices=['true', 'count', 'data', 'text', 'false'], help="_summary mode")
+    p.add_argument('--param', action='append', default=[], help="Search parameter name=value (repeatable)")
+    p.add_argument('--count', type=int, help="Page size (_count)")
+    p.add_argument('--pages', type=int, default=1, help="Pages to follow (default 1)")
+    p.add_argument('--show', type=int, default=10, help="Records to print (default 10)")
+    p.set_defaults(func=cmd_search)
+
+    p = sub.add_parser('chart', help="Fetch a patient's graph ($everything / _revinclude / batched searches)")
+    p.add_argument('patient_id', help="Patient id")
+    p.add_argument('--types', help=f"Resource types to join (default {','.join(CHART_TYPES)})")
+    p.set_defaults(func=cmd_chart)
+
+    p = sub.add_parser('read', help="Read many resources by id in a few _id searches or batch Bundles")
+    p.add_argument('refs', nargs='*', help="References like Patient/123")
+    p.add_argument('--file', help="File with one reference per line")
+    p.add_argument('--workers', type=int, default=4, help="Chunks fetched concurrently (default 4)")
+    p.add_argument('--max-url', type=int, default=2000, help="URL length limit per _id search (default 2000)")
+    p.add_argument('--show', action='store_true', help="Print each resource found")
+    p.set_defaults(func=cmd_read)
+
+    p = sub.add_parser('integrity', help="Scan for subject / encounter references that point at nothing")
+    p.add_argument('--types', help=f"Source types to scan (default {','.join(SOURCES)})")
+    p.add_argument('--scan', help="Target types to stream too instead of looking them up, e.g. Patient")
+    p.add_argument('--memory-mb', type=float, default=64, help="Memory for id sets before spilling to disk (default 64)")
+    p.add_argument('--page-size', type=int, default=200, help="Search page size (default 200)")
+    p.add_argument('--out', help="Write every dangling target and its sources to this JSONL file")
+    p.set_defaults(func=cmd_integrity)
+
+    p = sub.add_parser('fixtures', help="Pre-create and persist the patient / encounter fixture pool")
+    p.add_argument('--patients', type=int, default=20, help="Patients in the pool (default 20)")
+    p.add_argument('--encounters', type=int, default=1, help="Encounters per patient (default 1; 0 for none)")
+    p.add_argument('--file', default=fixtures.FIXTURES_FILE, help=f"Pool file (default {fixtures.FIXTURES_FILE})")
+    p.add_argument('--workers', type=int, default=8, help="Parallel creates (default 8)")
+    p.set_defaults(func=cmd_fixtures)
+
+    p = sub.add_parser('upload', help="Create a DocumentReference for a large file, streamed from disk")
+    p.add_argument('path', help="Document to upload")
+    p.add_argument('--patient', required=True, help="Patient id")
+    p.add_argument('--encounter', help="Encounter id")
+    p.add_argument('--mode', choices=['inline', 'binary'], default='inline',
+                   help="Base64 inline in the DocumentReference, or a separate Binary (default inline)")
+    p.add_argument('--content-type', help="Default: guessed from the file name")
+    p.set_defaults(func=cmd_upload)
+
+    p = sub.add_parser('download', help="Stream a DocumentReference's attachment to disk")
+    p.add_argument('document_id', help="DocumentReference id")
+    p.add_argument('--out', required=True, help="File to write")
+    p.add_argument('--url', help="Attachment url (e.g. Binary/12) when already known")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser('ingest', help="Bulk-load vital signs from columnar arrays as batch Bundles of Observations")
+    p.add_argument('--npz', help="NumPy .npz with patient, time, [encounter,] systolic, diastolic... arrays")
+    p.add_argument('--csv', help="CSV with the same columns (time as ISO UTC or epoch seconds)")
+    p.add_argument('--patients', type=int, default=20,
+                   help="Without --npz/--csv: synthetic readings for this many fixture patients (default 20)")
+    p.add_argument('--readings', type=int, default=60, help="Synthetic readings per patient (default 60)")
+    p.add_argument('--interval', type=int, default=60, help="Seconds between synthetic readings (default 60)")
+    p.add_argument('--seed', type=int, help="Random seed for the synthetic feed")
+    p.add_argument('--fixture-file', default=fixtures.FIXTURES_FILE,
+                   help=f"Fixture pool file (default {fixtures.FIXTURES_FILE})")
+    p.add_argument('--batch-size', type=int, default=ingest.BATCH_SIZE,
+                   help=f"Observations per batch Bundle (default {ingest.BATCH_SIZE})")
+    p.add_argument('--workers', type=int, default=4, help="Bundles in flight at once (default 4)")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('export', help="Export resources as typed columns to Parquet / Arrow files")
+    p.add_argument('--types', default='Patient,Encounter,Observation',
+                   help="Resource types to export (default Patient,Encounter,Observation)")
+    p.add_argument('--out', default='exports', help="Output directory, one file per type (default exports)")
+    p.add_argument('--format', choices=sorted(export.FORMATS), default='parquet', help="Default parquet")
+    p.add_argument('--param', action='append', default=[],
+                   help="Search parameter applied to every type, e.g. _lastUpdated=gt2024-01-01 (repeatable)")
+    p.add_argument('--page-size', type=int, default=200, help="Search page size (default 200)")
+    p.add_argument('--batch-rows', type=int, default=export.BATCH_ROWS,
+                   help=f"Rows per record batch / row group (default {export.BATCH_ROWS})")
+    p.add_argument('--bulk', action='store_true', help="Use a Bulk Data $export instead of searches")
+    p.add_argument('--since', help="With --bulk: only resources changed since this instant")
+    p.add_argument('--ndjson', nargs='+', help="Convert local NDJSON files (.ndjson / .ndjson.gz) instead")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('subscribe', help="Watch resource types through rest-hook Subscriptions instead of polling")
+    p.add_argument('--types', default='Encounter', help="Resource types to watch (default Encounter)")
+    p.add_argument('--host', default='127.0.0.1', help="Receiver address (default 127.0.0.1)")
+    p.add_argument('--port', type=int, default=9700, help="Receiver port (default 9700)")
+    p.add_argument('--endpoint', help="URL the server should notify (default http://<host>:<port>/notify)")
+    p.add_argument('--mode', choices=subscriptions.MODES, default='auto',
+                   help="criteria (R4), topic (R5 SubscriptionTopic) or auto (default)")
+    p.add_argument('--replay', action='store_true', help="First replay changes made since the last run")
+    p.add_argument('--state-file', default=subscriptions.SUBSCRIPTIONS_FILE,
+                   help=f"High-water mark file (default {subscriptions.SUBSCRIPTIONS_FILE})")
+    p.add_argument('--duration', type=float, help="Seconds to listen (default: until Ctrl-C)")
+    p.add_argument('--keep', action='store_true', help="Leave the Subscriptions in place on exit")
+    p.add_argument('--queue-size', type=int, default=10000, help="Processing queue bound (default 10000)")
+    p.add_argument('--consumers', type=int, default=4, help="Consumer tasks draining the queue (default 4)")
+    p.add_argument('--progress', type=float, default=5.0, help="Seconds between status lines (0: none)")
+    p.add_argument('--verbose', action='store_true', help="Print every resource received")
+    p.set_defaults(func=cmd_subscribe)
+
+    args = parser.parse_args(argv)
+    return args.func(args, runner_factory)
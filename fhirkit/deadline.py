@@ -0,0 +1,179 @@
+"""
+Timeouts and Deadlines
+1. Every request gets a (connect, read) timeout chosen by interaction:
+   metadata, search, read, create, update, delete, batch, token
+2. A workflow Deadline set on the session clips each timeout to the budget
+   left, and fails fast once it is spent, so the dependent create_* steps
+   after it are cancelled instead of queueing behind a stuck server
+3. The session counts timeouts so callers can report them separately
+4. resize_pool() sizes the connection pool for concurrent callers while
+   keeping the adapter's retry and blocking settings
+"""
+
+import threading
+import time
+import urllib.parse
+
+import requests
+
+DEFAULT_TIMEOUTS = {
+    'metadata': (3.05, 10),
+    'search': (3.05, 30),
+    'read': (3.05, 15),
+    'create': (3.05, 30),
+    'update': (3.05, 30),
+    'delete': (3.05, 30),
+    'batch': (3.05, 60),
+    'token': (3.05, 20),
+}
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The workflow budget was spent before the request could be sent"""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def extend(self, seconds):
+        """Push the expiry back, e.g. by time spent pausing between requests"""
+        self.expires_at += seconds
+
+    def clip(self, timeout):
+        """`timeout` shortened to the time left; raises DeadlineExceeded when none is"""
+        left = self.remaining()
+        if left <= 0:
+            raise DeadlineExceeded(f"workflow deadline of {self.seconds:g}s exceeded")
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        return (min(connect, left), min(read, left))
+
+
+def classify(method, url, base_url=None):
+    """Interaction name used to pick a timeout
+
+    With the FHIR base URL the path is classified relative to it (Type is a
+    search, Type/id a read, the base itself a batch); without it a capitalised
+    second-last segment marks a read.
+    """
+    path = urllib.parse.urlsplit(url).path.rstrip('/')
+    if path.endswith('/metadata'):
+        return 'metadata'
+    if '/oauth2/' in path and path.endswith('/token'):
+        return 'token'
+    base = urllib.parse.urlsplit(base_url).path.rstrip('/') if base_url else None
+    if base is not None and (path == base or path.startswith(base + '/')):
+        return classify_relative(method, [s for s in path[len(base):].split('/') if s])
+    if method == 'GET':
+        segments = path.split('/')
+        # .../Patient/123 is a read, .../Patient a search
+        return 'read' if len(segments) >= 2 and segments[-2][:1].isupper() else 'search'
+    if method == 'POST':
+        last = path.split('/')[-1]
+        return 'create' if last[:1].isupper() else ('search' if last == '_search' else 'batch')
+    return {'PUT': 'update', 'PATCH': 'update', 'DELETE': 'delete'}.get(method, 'read')
+
+
+def classify_relative(method, segments):
+    """classify() for the path segments after the FHIR base URL"""
+    if method in ('PUT', 'PATCH'):
+        return 'update'
+    if method == 'DELETE':
+        return 'delete'
+    if not segments:
+        return 'batch' if method == 'POST' else 'search'
+    if segments[-1] == '_search':
+        return 'search'
+    if segments[-1].startswith('$'):
+        # Operations ($everything, $export, ...) run as long as a search, or a batch when posted
+        return 'batch' if method == 'POST' else 'search'
+    if method == 'POST':
+        return 'create' if len(segments) == 1 else 'batch'
+    return 'search' if len(segments) == 1 else 'read'
+
+
+def parse_timeouts(text):
+    """'search=5,create=3:20' -> {'search': (5, 5), 'create': (3, 20)} (connect:read seconds)"""
+    timeouts = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        connect, _, read = value.partition(':')
+        try:
+            timeouts[name.strip()] = (float(connect), float(read or connect))
+        except ValueError:
+            raise ValueError(f"Invalid timeout '{item.strip()}' (expected name=seconds or name=connect:read)")
+    return timeouts
+
+
+class TimeoutSession(requests.Session):
+    """Session applying per-interaction timeouts and an optional workflow deadline
+
+    With a SingleFlight table set, concurrent identical GETs share one call.
+    """
+
+    def __init__(self, timeouts=None, single_flight=None, base_url=None):
+        super().__init__()
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        # The runner's fhir_url; request paths are classified relative to it
+        self.base_url = base_url
+        self.deadline = None
+        self.timed_out = 0
+        self.lock = threading.Lock()
+        self.single_flight = single_flight
+
+    def request(self, method, url, **kwargs):
+        try:
+            timeout = kwargs.get('timeout') or self.timeouts[classify(method.upper(), url, self.base_url)]
+            if self.deadline is not None:
+                timeout = self.deadline.clip(timeout)
+            kwargs['timeout'] = timeout
+            if self.single_flight is None:
+                return super().request(method, url, **kwargs)
+            if method.upper() == 'GET' and not kwargs.get('stream'):
+                return self.coalesced(url, kwargs)
+            try:
+                return super().request(method, url, **kwargs)
+            finally:
+                if method.upper() not in ('GET', 'HEAD', 'OPTIONS'):
+                    self.single_flight.wrote()
+        except requests.exceptions.Timeout:
+            with self.lock:
+                self.timed_out += 1
+            raise
+
+    def coalesced(self, url, kwargs):
+        headers = requests.structures.CaseInsensitiveDict(self.headers)
+        headers.update(kwargs.get('headers') or {})
+        full_url = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+        timeout = kwargs['timeout']
+        try:
+            return self.single_flight.do(self.single_flight.key(full_url, headers),
+                                         lambda: super(TimeoutSession, self).request('GET', url, **kwargs),
+                                         sum(timeout) if isinstance(timeout, tuple) else timeout)
+        except TimeoutError as e:
+            raise requests.exceptions.ReadTimeout(str(e))
+
+
+def resize_pool(session, url, maxsize):
+    """Mount a copy of the plain HTTPAdapter serving `url` with `maxsize` pooled connections
+
+    max_retries and pool_block carry over, and only `url` is remounted. Any
+    other adapter (e.g. a cassette's) is left alone; returns whether it resized.
+    """
+    current = session.get_adapter(url)
+    # Exact type: a cassette's RecordingAdapter is an HTTPAdapter too
+    if type(current) is not requests.adapters.HTTPAdapter:
+        return False
+    session.mount(url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=maxsize,
+                                                     max_retries=current.max_retries,
+                                                     pool_block=current._pool_block))
+    return True
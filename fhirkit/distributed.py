@@ -0,0 +1,251 @@
+"""
+Distributed Load Generation
+1. Coordinator: waits for workers, hands each a share of the workload plan,
+   then, once every worker has built its runners and fixtures, a
+   synchronized start; merges their per-second histogram snapshots into
+   one live view and a final report
+2. Worker: registers with the coordinator, prepares and runs its share with
+   a LoadGenerator and streams snapshots back over HTTP; a share of 0 VUs
+   (more workers than VUs) finishes at once without running anything
+
+The control channel is plain HTTP + JSON, so several workers can be run on
+localhost to try it out.
+"""
+
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from fhirkit.loadgen import LoadGenerator, StatsTable, WorkloadPlan, format_report, format_tick
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self.reply(400, {'error': 'invalid JSON'})
+            return
+
+        coordinator = self.server.coordinator
+        if self.path == '/register':
+            self.reply(200, coordinator.register(body.get('name')))
+        elif self.path == '/ready':
+            self.reply(200, coordinator.ready(body['worker_id']))
+        elif self.path == '/snapshot':
+            coordinator.add_snapshot(body['worker_id'], body['tick'], body['stats'], body.get('gauges', {}))
+            self.reply(200, {'stop': coordinator.aborted.is_set()})
+        elif self.path == '/finish':
+            coordinator.finish(body['worker_id'], body['stats'])
+            self.reply(200, {})
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def reply(self, status, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        return  # Suppress default logging
+
+
+class Coordinator:
+    """Distributes a WorkloadPlan over `workers` agents and merges their results"""
+
+    def __init__(self, plan, workers, host='127.0.0.1', port=9400, start_delay=2.0,
+                 register_timeout=300, out=None):
+        self.plan = plan
+        self.expected = workers
+        self.host = host
+        self.port = port
+        self.start_delay = start_delay
+        self.register_timeout = register_timeout
+        self.out = out or sys.stdout
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.shares = plan.split(workers)
+        # Workers that report ticks; idle ones (0 VUs) never do
+        self.active = sum(1 for share in self.shares if share.vus)
+        self.all_registered = threading.Event()
+        self.all_ready = threading.Event()
+        self.all_finished = threading.Event()
+        self.aborted = threading.Event()
+        self.start_at = None
+        self.ticks = {}  # tick -> {worker_id: (StatsTable, gauges)}
+        self.shown = 0
+        self.totals = StatsTable()
+
+    def register(self, name):
+        with self.lock:
+            if len(self.workers) >= self.expected:
+                return {'error': 'all worker slots are taken'}
+            worker_id = len(self.workers)
+            self.workers[worker_id] = {'name': name or f"worker-{worker_id}", 'ready': False, 'finished': False}
+            print(f"🔗 Worker {worker_id} registered ({self.workers[worker_id]['name']}) "
+                  f"[{len(self.workers)}/{self.expected}]", file=self.out, flush=True)
+            if len(self.workers) == self.expected:
+                self.all_registered.set()
+
+        if not self.all_registered.wait(self.register_timeout):
+            return {'error': 'timed out waiting for the other workers'}
+        return {'worker_id': worker_id, 'plan': self.shares[worker_id].to_dict()}
+
+    def ready(self, worker_id):
+        """Blocks until every worker has prepared its share, then hands out the common start"""
+        with self.lock:
+            self.workers[worker_id]['ready'] = True
+            self.check_ready()
+        if not self.all_ready.wait(self.register_timeout):
+            return {'error': 'timed out waiting for the other workers to prepare'}
+        # Relative start so worker clocks need not agree with ours
+        return {'start_in': max(0.0, self.start_at - time.monotonic())}
+
+    def check_ready(self):
+        """Fix the start once every worker is ready or already done (idle, or failed in setup)"""
+        if not self.all_ready.is_set() and len(self.workers) == self.expected and \
+                all(w['ready'] or w['finished'] for w in self.workers.values()):
+            self.start_at = time.monotonic() + self.start_delay
+            self.all_ready.set()
+
+    def add_snapshot(self, worker_id, tick, stats, gauges):
+        with self.lock:
+            self.ticks.setdefault(tick, {})[worker_id] = (StatsTable.from_dict(stats), gauges)
+        self.show_ready_ticks()
+
+    def finish(self, worker_id, stats):
+        with self.lock:
+            self.totals.merge(StatsTable.from_dict(stats))
+            self.workers[worker_id]['finished'] = True
+            self.check_ready()
+            done = all(w['finished'] for w in self.workers.values())
+        self.show_ready_ticks(flush=done)
+        if done:
+            self.all_finished.set()
+
+    def show_ready_ticks(self, flush=False):
+        """Print merged ticks once every worker has reported them (or a later tick)"""
+        with self.lock:
+            while True:
+                tick = self.shown + 1
+                reports = self.ticks.get(tick)
+                if reports is None:
+                    if flush and any(t > tick for t in self.ticks):
+                        self.shown = tick
+                        continue
+                    break
+                newer = any(t > tick + 1 for t in self.ticks)
+                if len(reports) < self.active and not (flush or newer):
+                    break
+                merged = StatsTable()
+                gauges = {}
+                for table, g in reports.values():
+                    merged.merge(table)
+                    for k, v in g.items():
+                        gauges[k] = gauges.get(k, 0) + v
+                gauges['workers'] = len(reports)
+                print(format_tick(tick, merged, gauges), file=self.out, flush=True)
+                del self.ticks[tick]
+                self.shown = tick
+
+    def run(self):
+        server = ThreadingHTTPServer((self.host, self.port), CoordinatorHandler)
+        server.daemon_threads = True
+        server.coordinator = self
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        print(f"📡 Coordinator listening on http://{self.host}:{self.port} "
+              f"- waiting for {self.expected} worker(s)", file=self.out, flush=True)
+        try:
+            if not self.all_registered.wait(self.register_timeout):
+                print("❌ Error: Timeout waiting for workers to register", file=self.out)
+                return None
+            print("⏳ All workers registered; waiting for them to prepare", file=self.out, flush=True)
+            if not self.all_ready.wait(self.register_timeout):
+                print("❌ Error: Timeout waiting for workers to prepare", file=self.out)
+                return None
+            print(f"🚀 All workers ready; starting in {self.start_delay:.0f}s", file=self.out, flush=True)
+            # Workers finish after duration; allow generous slack for stragglers
+            if not self.all_finished.wait(self.start_delay + self.plan.duration + 120):
+                print("⚠️  Some workers did not report back; report is partial", file=self.out)
+        except KeyboardInterrupt:
+            self.aborted.set()
+            print("\n⚠️  Interrupted; asking workers to stop", file=self.out)
+            self.all_finished.wait(10)
+        finally:
+            server.shutdown()
+
+        print(format_report(self.totals, self.plan.duration), file=self.out)
+        return self.totals
+
+
+class Worker:
+    """Runs its share of the coordinator's plan and streams snapshots back"""
+
+    def __init__(self, coordinator_url, runner_factory, name=None, out=None):
+        self.url = coordinator_url.rstrip('/')
+        self.runner_factory = runner_factory
+        self.name = name or socket.gethostname()
+        self.out = out or sys.stdout
+
+    def post(self, path, data, timeout=10):
+        res = requests.post(f"{self.url}{path}", json=data, timeout=timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def run(self):
+        print(f"🔗 Registering with coordinator at {self.url}", file=self.out, flush=True)
+        # Blocks until every worker has registered
+        assignment = self.post('/register', {'name': self.name}, timeout=None)
+        if 'error' in assignment:
+            print(f"❌ Error: {assignment['error']}", file=self.out)
+            return None
+
+        worker_id = assignment['worker_id']
+        plan = WorkloadPlan.from_dict(assignment['plan'])
+        if not plan.vus:
+            print(f"💤 Worker {worker_id}: no VUs left for this worker; staying idle", file=self.out)
+            self.post('/finish', {'worker_id': worker_id, 'stats': {}})
+            return StatsTable()
+        print(f"✅ Worker {worker_id}: {plan.vus} VUs, rate {plan.rate or 'closed'}, "
+              f"{plan.duration:.0f}s", file=self.out, flush=True)
+
+        generator = LoadGenerator(plan, self.runner_factory)
+        try:
+            generator.prepare()
+        except Exception:
+            # Do not hold up the others' start
+            self.post('/finish', {'worker_id': worker_id, 'stats': {}})
+            raise
+        start = self.post('/ready', {'worker_id': worker_id}, timeout=None)
+        if 'error' in start:
+            print(f"❌ Error: {start['error']}", file=self.out)
+            return None
+
+        def on_tick(tick, table, gauges):
+            try:
+                reply = self.post('/snapshot', {
+                    'worker_id': worker_id,
+                    'tick': tick,
+                    'stats': table.to_dict(),
+                    'gauges': gauges,
+                })
+                if reply.get('stop'):
+                    generator.stop_event.set()
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  Snapshot {tick} not delivered: {e}", file=self.out)
+
+        totals = generator.run(start_in=start['start_in'], on_tick=on_tick)
+        self.post('/finish', {'worker_id': worker_id, 'stats': totals.to_dict()})
+        print(f"✅ Worker {worker_id} finished", file=self.out)
+        return totals
@@ -0,0 +1,316 @@
+"""
+Columnar Export
+1. Streams resources from search pages, a Bulk Data $export or local
+   NDJSON files, one page / line at a time
+2. Flattens each type into fixed, typed columns: codes split into system /
+   code / display, Observation components into systolic, diastolic...
+   columns, dates into UTC timestamps
+3. Writes record batches of a bounded number of rows to one Parquet (or
+   Arrow IPC) file per type, so memory stays flat whatever the extract size
+"""
+
+import gzip
+import json
+import os
+import time
+from datetime import date, datetime, timezone
+
+from fhirkit.graph import parse_reference
+from fhirkit.ingest import VITALS
+from fhirkit.integrity import stream
+from fhirkit.store import effective_of, encounter_of, subject_of
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only the export needs it
+    pa = pq = None
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+BATCH_ROWS = 50000
+# Observation component code -> column (BP panel members and the other vitals)
+COMPONENT_COLUMNS = {code: name for name, (code, _, _, _, _) in VITALS.items()}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The columnar export needs pyarrow: pip3 install pyarrow")
+
+
+# Field extraction
+
+def coding(concept):
+    """(system, code, display) of a CodeableConcept's first coding"""
+    if not isinstance(concept, dict):
+        return None, None, None
+    first = (concept.get('coding') or [{}])[0]
+    return first.get('system'), first.get('code'), first.get('display') or concept.get('text')
+
+
+def ref_id(value):
+    """'123' for 'Patient/123' (or a reference element)"""
+    ref = parse_reference(value.get('reference') if isinstance(value, dict) else value)
+    return ref[1] if ref else None
+
+
+def timestamp(value):
+    """UTC datetime for a FHIR date / dateTime / instant (partial dates are padded), or None"""
+    if not isinstance(value, str) or not value:
+        return None
+    text = value.replace('Z', '+00:00')
+    if len(text) == 4:
+        text += '-01-01'
+    elif len(text) == 7:
+        text += '-01'
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def day(value):
+    parsed = timestamp(value)
+    return date(parsed.year, parsed.month, parsed.day) if parsed else None
+
+
+def number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def last_updated(resource):
+    return timestamp((resource.get('meta') or {}).get('lastUpdated'))
+
+
+def patient_row(resource):
+    name = (resource.get('name') or [{}])[0]
+    address = (resource.get('address') or [{}])[0]
+    deceased = resource.get('deceasedBoolean')
+    if deceased is None and resource.get('deceasedDateTime'):
+        deceased = True
+    return (resource.get('id'), ((resource.get('identifier') or [{}])[0]).get('value'), name.get('family'),
+            ' '.join(name.get('given') or []) or None, resource.get('gender'), day(resource.get('birthDate')),
+            deceased, address.get('city'), address.get('state'), address.get('postalCode'), address.get('country'),
+            last_updated(resource))
+
+
+def encounter_row(resource):
+    period = resource.get('period') or {}
+    encounter_class = resource.get('class')
+    if isinstance(encounter_class, list):  # R5
+        encounter_class = coding(encounter_class[0] if encounter_class else None)[1]
+    elif isinstance(encounter_class, dict):
+        encounter_class = encounter_class.get('code')
+    type_system, type_code, type_display = coding((resource.get('type') or [None])[0])
+    reason = coding((resource.get('reasonCode') or [None])[0])[1]
+    return (resource.get('id'), ref_id(resource.get('subject')), resource.get('status'), encounter_class,
+            type_system, type_code, type_display, timestamp(period.get('start')), timestamp(period.get('end')),
+            reason, last_updated(resource))
+
+
+def value_of(element):
+    """(number, unit, code system, code, text) of an Observation or component value[x]"""
+    quantity = element.get('valueQuantity')
+    if isinstance(quantity, dict):
+        return number(quantity.get('value')), quantity.get('unit') or quantity.get('code'), None, None, None
+    if 'valueCodeableConcept' in element:
+        system, code, display = coding(element['valueCodeableConcept'])
+        return None, None, system, code, display
+    for key in ('valueInteger', 'valueDecimal'):
+        if key in element:
+            return number(element[key]), None, None, None, None
+    if 'valueBoolean' in element:
+        return None, None, None, None, str(element['valueBoolean']).lower()
+    return None, None, None, None, element.get('valueString')
+
+
+def observation_row(resource):
+    category = coding((resource.get('category') or [None])[0])[1]
+    code_system, code, code_display = coding(resource.get('code'))
+    components = dict.fromkeys(COMPONENT_COLUMNS.values())
+    others = []
+    for component in resource.get('component') or []:
+        column = COMPONENT_COLUMNS.get(coding(component.get('code'))[1])
+        if column:
+            components[column] = value_of(component)[0]
+        else:
+            others.append(component)
+    effective = resource.get('effectiveDateTime') or (resource.get('effectivePeriod') or {}).get('start') or \
+        resource.get('effectiveInstant')
+    return (resource.get('id'), ref_id(resource.get('subject')), ref_id(resource.get('encounter')),
+            resource.get('status'), category, code_system, code, code_display, timestamp(effective)) + \
+        value_of(resource) + tuple(components.values()) + \
+        (json.dumps(others, separators=(',', ':')) if others else None, last_updated(resource))
+
+
+def generic_row(resource):
+    subject, encounter = subject_of(resource), encounter_of(resource)
+    code = coding(resource.get('code') or (resource.get('type') if isinstance(resource.get('type'), dict) else None))
+    return (resource.get('id'), resource.get('resourceType'), subject.split('/', 1)[1] if subject else None,
+            encounter.split('/', 1)[1] if encounter else None, resource.get('status')) + code + \
+        (timestamp(effective_of(resource)), last_updated(resource), json.dumps(resource, separators=(',', ':')))
+
+
+# Resource type -> ([(column, type)], row function); anything else gets GENERIC
+TIMESTAMP = 'timestamp'
+TABLES = {
+    'Patient': ([('id', 'string'), ('identifier', 'string'), ('family', 'string'), ('given', 'string'),
+                 ('gender', 'string'), ('birth_date', 'date'), ('deceased', 'bool'), ('city', 'string'),
+                 ('state', 'string'), ('postal_code', 'string'), ('country', 'string'),
+                 ('last_updated', TIMESTAMP)], patient_row),
+    'Encounter': ([('id', 'string'), ('patient_id', 'string'), ('status', 'string'), ('class_code', 'string'),
+                   ('type_system', 'string'), ('type_code', 'string'), ('type_display', 'string'),
+                   ('period_start', TIMESTAMP), ('period_end', TIMESTAMP), ('reason_code', 'string'),
+                   ('last_updated', TIMESTAMP)], encounter_row),
+    'Observation': ([('id', 'string'), ('patient_id', 'string'), ('encounter_id', 'string'), ('status', 'string'),
+                     ('category', 'string'), ('code_system', 'string'), ('code', 'string'),
+                     ('code_display', 'string'), ('effective', TIMESTAMP), ('value', 'float64'),
+                     ('value_unit', 'string'), ('value_code_system', 'string'), ('value_code', 'string'),
+                     ('value_text', 'string')] +
+                    [(column, 'float64') for column in COMPONENT_COLUMNS.values()] +
+                    [('other_components', 'string'), ('last_updated', TIMESTAMP)], observation_row),
+}
+GENERIC = ([('id', 'string'), ('resource_type', 'string'), ('patient_id', 'string'), ('encounter_id', 'string'),
+            ('status', 'string'), ('code_system', 'string'), ('code', 'string'), ('code_display', 'string'),
+            ('effective', TIMESTAMP), ('last_updated', TIMESTAMP), ('resource', 'string')], generic_row)
+
+
+def arrow_type(name):
+    if name == TIMESTAMP:
+        return pa.timestamp('us', tz='UTC')
+    return {'date': pa.date32(), 'bool': pa.bool_(), 'float64': pa.float64(), 'string': pa.string()}[name]
+
+
+# Sources
+
+def ndjson_file(path):
+    """Resources of a local NDJSON file (.ndjson or .ndjson.gz), one line at a time"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def ndjson_url(runner, url):
+    """Resources of a Bulk Data output file, streamed"""
+    headers = dict(runner.get_headers(), Accept='application/fhir+ndjson')
+    with runner.session.get(url, headers=headers, stream=True) as res:
+        res.raise_for_status()
+        for line in res.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def bulk_export(runner, types, since=None, poll=2.0, timeout=600):
+    """[(type, url)] of a system-level $export: kick-off, then poll the status URL until complete"""
+    headers = dict(runner.get_headers(), Accept='application/fhir+json', Prefer='respond-async')
+    params = {'_type': ','.join(types)}
+    if since:
+        params['_since'] = since
+    res = runner.session.get(f"{runner.fhir_url}/$export", params=params, headers=headers)
+    if res.status_code != 202 or not res.headers.get('Content-Location'):
+        raise RuntimeError(f"$export kick-off failed with status {res.status_code}: {res.text[:200]}")
+    status_url = res.headers['Content-Location']
+    give_up = time.monotonic() + timeout
+    while True:
+        res = runner.session.get(status_url, headers=runner.get_headers())
+        if res.status_code == 200:
+            return [(item['type'], item['url']) for item in res.json().get('output', [])]
+        if res.status_code != 202:
+            raise RuntimeError(f"$export failed with status {res.status_code}: {res.text[:200]}")
+        if time.monotonic() > give_up:
+            raise RuntimeError(f"$export not complete after {timeout}s ({res.headers.get('X-Progress', '')})")
+        try:
+            wait = float(res.headers.get('Retry-After', poll))
+        except ValueError:
+            wait = poll
+        time.sleep(min(max(wait, 0.5), 30))
+
+
+# Writing
+
+class TableWriter:
+    """One output file; rows are buffered column-wise and written every `batch_rows`"""
+
+    def __init__(self, path, resource_type, fmt='parquet', batch_rows=BATCH_ROWS):
+        self.path = path
+        self.columns, self.row = TABLES.get(resource_type, GENERIC)
+        self.schema = pa.schema([(name, arrow_type(kind)) for name, kind in self.columns])
+        self.batch_rows = batch_rows
+        self.buffer = [[] for _ in self.columns]
+        self.rows = 0
+        self.batches = 0
+        self.skipped = 0
+        if fmt == 'parquet':
+            self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(path, self.schema)
+
+    def add(self, resource):
+        try:
+            values = self.row(resource)
+        except (AttributeError, TypeError, ValueError, IndexError):
+            self.skipped += 1  # malformed beyond what the flattening tolerates
+            return
+        for column, value in zip(self.buffer, values):
+            column.append(value)
+        if len(self.buffer[0]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer[0]:
+            return
+        arrays = [pa.array(values, type=field.type) for values, field in zip(self.buffer, self.schema)]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.rows += len(self.buffer[0])
+        self.batches += 1
+        self.buffer = [[] for _ in self.columns]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class ColumnarExporter:
+    """Routes resources to one TableWriter per type under `out_dir`"""
+
+    def __init__(self, out_dir, fmt='parquet', batch_rows=BATCH_ROWS):
+        require_pyarrow()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}' (expected one of {', '.join(FORMATS)})")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.writers = {}
+        self.start = time.perf_counter()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def writer(self, resource_type):
+        if resource_type not in self.writers:
+            path = os.path.join(self.out_dir, f"{resource_type}{FORMATS[self.fmt]}")
+            self.writers[resource_type] = TableWriter(path, resource_type, self.fmt, self.batch_rows)
+        return self.writers[resource_type]
+
+    def write(self, resources):
+        """Add resources of any types; returns how many were taken"""
+        count = 0
+        for resource in resources:
+            resource_type = resource.get('resourceType') if isinstance(resource, dict) else None
+            if resource_type and resource_type not in ('Bundle', 'OperationOutcome'):
+                self.writer(resource_type).add(resource)
+                count += 1
+        return count
+
+    def close(self):
+        """{type: (rows, rows skipped, path, bytes on disk)}"""
+        summary = {}
+        for resource_type, writer in self.writers.items():
+            writer.close()
+            summary[resource_type] = (writer.rows, writer.skipped, writer.path, os.path.getsize(writer.path))
+        return summary
+
+    def export_search(self, runner, resource_type, page_size=200, params=None):
+        """Stream every page of a type's search into its table (an empty table when nothing matches)"""
+        self.writer(resource_type)
+        return self.write(stream(runner, resource_type, page_size, elements=None, params=params))
@@ -0,0 +1,301 @@
+"""
+Fault / Latency Injection Proxy
+1. A local reverse proxy between the scripts and nginx (or the EMR directly)
+2. Per-route rules (first match wins): latency distributions, bandwidth caps,
+   slow bodies, connection resets, hangs and bursts of 5xx responses
+3. Seeded, so a bad-conditions run can be reproduced; rules can be swapped
+   at runtime from Python (set_rules) or over HTTP (PUT /__fault/rules)
+4. Chunked request bodies are decoded before forwarding, and upstream
+   Location / Content-Location headers point back at the proxy
+
+Rules file example:
+    [{"route": "/oauth2/token", "latency": "uniform:500,2000"},
+     {"route": "/Patient", "methods": ["POST"], "burst": {"status": 503, "probability": 0.05, "length": 5}},
+     {"route": "/Observation", "bandwidth": 20000, "slow_body": {"chunk": 512, "delay": 0.2}, "reset": 0.02}]
+"""
+
+import json
+import random
+import re
+import socket
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+import urllib3
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+              'transfer-encoding', 'upgrade', 'content-length'}
+FAULTS = ('latency', 'burst', 'reset', 'hang', 'throttled', 'upstream_error')
+LOCATION_HEADERS = ('location', 'content-location')
+
+
+def parse_latency(spec):
+    """Sampler (rng -> seconds) for 'fixed:100', 'uniform:50,200', 'normal:200,50',
+    'lognormal:200,0.5' (median ms, sigma), 'exponential:100' (mean ms) or a bare number"""
+    if spec is None:
+        return None
+    if isinstance(spec, (int, float)):
+        spec = f"fixed:{spec}"
+    kind, _, args = str(spec).partition(':')
+    if not args:
+        kind, args = 'fixed', kind
+    try:
+        values = [float(v) for v in args.split(',')]
+        samplers = {
+            'fixed': lambda rng: values[0],
+            'uniform': lambda rng: rng.uniform(values[0], values[1]),
+            'normal': lambda rng: max(0.0, rng.gauss(values[0], values[1])),
+            'lognormal': lambda rng: values[0] * rng.lognormvariate(0, values[1]),
+            'exponential': lambda rng: rng.expovariate(1.0 / values[0]),
+        }
+        sampler = samplers[kind]
+        sampler(random.Random(0))
+    except (KeyError, IndexError, ValueError, ZeroDivisionError):
+        raise ValueError(f"Invalid latency spec '{spec}'")
+    return lambda rng: sampler(rng) / 1000.0
+
+
+class FaultRule:
+    """One route's faults; probabilities are per request"""
+
+    def __init__(self, spec):
+        if not isinstance(spec, dict):
+            raise ValueError(f"Invalid fault rule {spec!r} (expected an object with a \"route\")")
+        self.spec = spec
+        self.route = spec.get('route', '')
+        try:
+            self.pattern = re.compile(self.route)
+        except (re.error, TypeError) as e:
+            raise ValueError(f"Invalid route regex {self.route!r}: {e}")
+        self.methods = {m.upper() for m in spec.get('methods', [])}
+        self.latency = parse_latency(spec.get('latency'))
+        self.bandwidth = spec.get('bandwidth')  # bytes per second
+        self.slow_body = spec.get('slow_body')  # {"chunk": bytes, "delay": seconds}
+        self.reset = spec.get('reset', 0)
+        self.hang = spec.get('hang', 0)
+        self.hang_seconds = spec.get('hang_seconds', 600)
+        self.burst = spec.get('burst')  # {"status": 503, "probability": p, "length": n}
+        self.burst_left = 0
+        self.counts = dict.fromkeys(FAULTS, 0)
+        self.counts['requests'] = 0
+
+    def matches(self, method, path):
+        return (not self.methods or method in self.methods) and self.pattern.search(path) is not None
+
+
+class FaultHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.handle_any()
+
+    do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = do_OPTIONS = do_GET
+
+    def handle_any(self):
+        proxy = self.server.proxy
+        body = self.read_body()
+
+        if self.path.startswith('/__fault/'):
+            self.control(proxy, body)
+            return
+
+        rule = proxy.match(self.command, self.path)
+        plan = proxy.decide(rule)
+        if plan['latency']:
+            time.sleep(plan['latency'])
+        if plan['reset']:
+            self.abort()
+            return
+        if plan['hang']:
+            proxy.stopping.wait(rule.hang_seconds)
+            self.abort()
+            return
+        if plan['status']:
+            outcome = {"resourceType": "OperationOutcome", "issue": [
+                {"severity": "error", "code": "transient", "diagnostics": f"injected {plan['status']} ({rule.route})"}]}
+            self.reply(plan['status'], {'Content-Type': 'application/fhir+json'}, json.dumps(outcome).encode('utf-8'))
+            return
+
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP and k.lower() != 'host'}
+        try:
+            res = proxy.session.request(self.command, proxy.upstream + self.path, data=body, headers=headers,
+                                        stream=True, allow_redirects=False, timeout=proxy.upstream_timeout)
+            content = res.raw.read(decode_content=False)
+        except requests.exceptions.RequestException as e:
+            proxy.count(rule, 'upstream_error')
+            self.reply(502, {'Content-Type': 'text/plain'}, f"upstream error: {e}\n".encode('utf-8'))
+            return
+        out_headers = {k: self.rewrite_location(proxy, v) if k.lower() in LOCATION_HEADERS else v
+                       for k, v in res.headers.items() if k.lower() not in HOP_BY_HOP}
+        self.reply(res.status_code, out_headers, content, rule if plan['throttled'] else None)
+
+    def read_body(self):
+        """Request body from Content-Length or Transfer-Encoding: chunked (None when there is none)"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            parts = []
+            while True:
+                length = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if length == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):  # trailers
+                        pass
+                    return b''.join(parts)
+                parts.append(self.rfile.read(length))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        return self.rfile.read(length) if length else None
+
+    def rewrite_location(self, proxy, value):
+        """Upstream URL in a Location header, moved onto the address the client used for the proxy"""
+        if not value.startswith(proxy.upstream):
+            return value
+        host = self.headers.get('Host')
+        return (f"http://{host}" if host else proxy.url) + value[len(proxy.upstream):]
+
+    def reply(self, status, headers, content, rule=None):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if rule is None:
+            self.wfile.write(content)
+            return
+        # Slow body / bandwidth cap: trickle the payload out in chunks
+        chunk = (rule.slow_body or {}).get('chunk', 4096)
+        delay = (rule.slow_body or {}).get('delay', 0)
+        for i in range(0, len(content), chunk):
+            part = content[i:i + chunk]
+            self.wfile.write(part)
+            self.wfile.flush()
+            time.sleep(delay + (len(part) / rule.bandwidth if rule.bandwidth else 0))
+
+    def abort(self):
+        """Drop the connection with a TCP RST instead of a clean close"""
+        self.close_connection = True
+        try:
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.connection.close()
+        except OSError:
+            pass
+
+    def control(self, proxy, body):
+        if self.path == '/__fault/stats':
+            payload = json.dumps(proxy.stats(), indent=2).encode('utf-8')
+            self.reply(200, {'Content-Type': 'application/json'}, payload)
+        elif self.path == '/__fault/rules' and self.command in ('PUT', 'POST'):
+            try:
+                proxy.set_rules(json.loads(body or b'[]'))
+            except (ValueError, TypeError) as e:
+                self.reply(400, {'Content-Type': 'text/plain'}, f"{e}\n".encode('utf-8'))
+                return
+            self.reply(200, {'Content-Type': 'application/json'}, b'{"ok": true}')
+        else:
+            self.reply(404, {'Content-Type': 'text/plain'}, b'not found\n')
+
+    def log_message(self, format, *args):
+        return  # Suppress default logging
+
+
+class FaultProxy:
+    """Reverse proxy to `upstream` injecting faults per route; usable as a context manager"""
+
+    def __init__(self, upstream, rules=None, host='127.0.0.1', port=0, seed=None, upstream_timeout=(10, 300)):
+        self.upstream = upstream.rstrip('/')
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.upstream_timeout = upstream_timeout
+        self.session = requests.Session()
+        self.session.verify = False
+        self.stopping = threading.Event()
+        self.httpd = None
+        self.rules = []
+        self.set_rules(rules or [])
+
+    @classmethod
+    def load_rules(cls, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def set_rules(self, specs):
+        """Replace the rules; ValueError (rules unchanged) if any of them is invalid"""
+        if not isinstance(specs, list):
+            raise ValueError("Fault rules must be a JSON list")
+        rules = [FaultRule(spec) for spec in specs]  # parse before swapping in
+        with self.lock:
+            self.rules = rules
+
+    def match(self, method, path):
+        route = path.split('?', 1)[0]
+        for rule in self.rules:
+            if rule.matches(method, route):
+                return rule
+        return None
+
+    def count(self, rule, fault):
+        if rule is not None:
+            with self.lock:
+                rule.counts[fault] += 1
+
+    def decide(self, rule):
+        """All random draws for one request, under one lock so a seed replays exactly"""
+        plan = {'latency': 0, 'reset': False, 'hang': False, 'status': None, 'throttled': False}
+        if rule is None:
+            return plan
+        with self.lock:
+            rng = self.rng
+            rule.counts['requests'] += 1
+            if rule.latency:
+                plan['latency'] = rule.latency(rng)
+                rule.counts['latency'] += 1
+            if rule.burst and not rule.burst_left and rng.random() < rule.burst.get('probability', 0):
+                rule.burst_left = rule.burst.get('length', 1)
+            if rule.burst_left:
+                rule.burst_left -= 1
+                plan['status'] = rule.burst.get('status', 503)
+                rule.counts['burst'] += 1
+            elif rule.reset and rng.random() < rule.reset:
+                plan['reset'] = True
+                rule.counts['reset'] += 1
+            elif rule.hang and rng.random() < rule.hang:
+                plan['hang'] = True
+                rule.counts['hang'] += 1
+            elif rule.bandwidth or rule.slow_body:
+                plan['throttled'] = True
+                rule.counts['throttled'] += 1
+        return plan
+
+    def stats(self):
+        with self.lock:
+            return [{'route': r.route, 'methods': sorted(r.methods), **r.counts} for r in self.rules]
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.httpd.server_address[1]}" if self.httpd else None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), FaultHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.proxy = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
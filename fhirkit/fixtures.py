@@ -0,0 +1,146 @@
+"""
+Fixture Pool
+1. Pre-creates patients and encounters in parallel before a measured run,
+   so scenarios needing them do not pay two or three setup POSTs each time
+2. Persists them per server (.fhir_fixtures.json) and reuses them on the
+   next run after checking, in batched reads, that they still exist
+3. Hands them out round-robin or at random, thread-safely
+"""
+
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fhirkit.batchread import BatchReader
+from fhirkit.runlog import RunLog
+
+FIXTURES_FILE = '.fhir_fixtures.json'
+ORDERS = ('round-robin', 'random')
+
+
+class FixturePool:
+    """Patient (+ encounter) id sets to seed runner.ids with"""
+
+    def __init__(self, fixtures=None, order='round-robin', seed=None):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown fixture order '{order}' (expected one of {', '.join(ORDERS)})")
+        self.fixtures = list(fixtures or [])
+        self.order = order
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_index = itertools.count()
+        self.handed_out = 0
+
+    def __len__(self):
+        return len(self.fixtures)
+
+    def checkout(self):
+        """A copy of the next fixture, e.g. {'patient': '12', 'encounter': '40'}"""
+        if not self.fixtures:
+            raise LookupError("Fixture pool is empty")
+        with self.lock:
+            self.handed_out += 1
+            if self.order == 'random':
+                return dict(self.rng.choice(self.fixtures))
+            return dict(self.fixtures[next(self.next_index) % len(self.fixtures)])
+
+    @staticmethod
+    def read(path, fhir_url):
+        """Fixtures saved for `fhir_url` (empty when there are none)"""
+        if not path or not os.path.exists(path):
+            return []
+        try:
+            with open(path, 'r') as f:
+                return json.load(f).get(fhir_url, {}).get('fixtures', [])
+        except (OSError, ValueError, AttributeError):
+            return []
+
+    def save(self, path, fhir_url):
+        """Store this pool for `fhir_url`, keeping other servers' entries"""
+        data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+        data[fhir_url] = {'saved_at': round(time.time(), 3), 'fixtures': self.fixtures}
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+
+def verify(runner, fixtures):
+    """Fixtures whose every id still exists on the server (one batched read for all of them)"""
+    types = runner.ID_TYPES
+    refs = {(types[k], v) for fixture in fixtures for k, v in fixture.items() if k in types}
+    if not refs:
+        return list(fixtures)
+    result = BatchReader(runner, use_store=False).read(sorted(refs))
+    gone = set(result.missing) | result.failed
+    return [f for f in fixtures if not any(f"{types[k]}/{v}" in gone for k, v in f.items() if k in types)]
+
+
+def create_fixture(runner, encounters):
+    """[{'patient': id, 'encounter': id}, ...] for one new patient; [] when its create failed"""
+    runner.ids = {}
+    runner.scope = uuid.uuid4().hex  # never deduplicated against earlier fixtures
+    if not runner.create_patient() or not runner.ids.get('patient'):
+        return []
+    patient = runner.ids['patient']
+    if not encounters or not hasattr(runner, 'create_encounter'):
+        return [{'patient': patient}]
+    fixtures = []
+    for _ in range(encounters):
+        runner.ids = {'patient': patient}
+        runner.scope = uuid.uuid4().hex  # otherwise the identical encounters collapse into one
+        if runner.create_encounter() and runner.ids.get('encounter'):
+            fixtures.append({'patient': patient, 'encounter': runner.ids['encounter']})
+    return fixtures
+
+
+def build(runner_factory, patients, encounters=1, workers=8, existing=()):
+    """Create fixtures until `patients` patients are covered, one runner per worker thread"""
+    local = threading.local()
+
+    def task(_):
+        if not hasattr(local, 'runner'):
+            local.runner = runner_factory()
+        return create_fixture(local.runner, encounters)
+
+    covered = {f['patient'] for f in existing}
+    missing = max(0, patients - len(covered))
+    fixtures = list(existing)
+    if missing:
+        with RunLog.shared().silenced():
+            with ThreadPoolExecutor(max_workers=min(workers, missing)) as pool:
+                for created in pool.map(task, range(missing)):
+                    fixtures.extend(created)
+    return fixtures
+
+
+def prepare(runner_factory, patients, encounters=1, order='round-robin', path=FIXTURES_FILE, workers=8,
+            seed=None, runner=None):
+    """FixturePool for the runner's server: saved fixtures that still exist, topped up to `patients`"""
+    runner = runner or runner_factory()
+    saved = FixturePool.read(path, runner.fhir_url)
+    live = verify(runner, saved) if saved else []
+    if encounters:
+        live = [f for f in live if 'encounter' in f]
+    if saved:
+        print(f"♻️  Fixtures: {len(live)}/{len(saved)} saved fixture(s) still exist")
+    start = time.perf_counter()
+    fixtures = build(runner_factory, patients, encounters, workers, live)
+    created = len(fixtures) - len(live)
+    if created:
+        print(f"🧪 Fixtures: created {created} in {time.perf_counter() - start:.1f}s")
+    pool = FixturePool(fixtures, order=order, seed=seed)
+    if path and (created or len(live) != len(saved)):
+        pool.save(path, runner.fhir_url)
+    return pool
@@ -0,0 +1,215 @@
+"""
+Joined Fetch
+1. Gets a patient's chart in as few requests as the server allows:
+   Patient/$everything, else one search with _revinclude per chart type,
+   else batched searches (one batch Bundle, or concurrent GETs)
+2. Assembles the resources into a ResourceGraph: every reference is
+   resolved to the node it points at, with reverse links for "what
+   points here" (encounter -> its observations)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CHART_TYPES = ['Encounter', 'Observation', 'MedicationRequest', 'DocumentReference']
+# Search parameter linking each chart type to the patient (used for _revinclude too)
+PATIENT_PARAM = {'Encounter': 'subject', 'Observation': 'subject', 'MedicationRequest': 'subject',
+                 'DocumentReference': 'subject', 'Appointment': 'actor'}
+
+
+def parse_reference(reference):
+    """('Type', 'id') for 'Type/id', absolute URLs and versioned references; None otherwise"""
+    if not isinstance(reference, str) or reference.startswith(('#', 'urn:')):
+        return None
+    parts = reference.split('/_history/')[0].rstrip('/').split('/')
+    if len(parts) < 2 or not parts[-2][:1].isupper():
+        return None
+    return parts[-2], parts[-1]
+
+
+def references(value, path=''):
+    """(path, 'Type/id') for every Reference inside a resource"""
+    if isinstance(value, dict):
+        if isinstance(value.get('reference'), str):
+            yield path, value['reference']
+        for key, item in value.items():
+            if key != 'reference':
+                yield from references(item, f"{path}.{key}" if path else key)
+    elif isinstance(value, list):
+        for item in value:
+            yield from references(item, path)
+
+
+class Node:
+    """One resource plus its resolved references in both directions"""
+
+    __slots__ = ('type', 'id', 'resource', 'refs', 'referenced_by')
+
+    def __init__(self, resource):
+        self.type = resource['resourceType']
+        self.id = resource.get('id')
+        self.resource = resource
+        self.refs = {}  # path -> [Node]
+        self.referenced_by = []  # (Node, path)
+
+    def ref(self, path):
+        """First node referenced at `path`, e.g. obs.ref('encounter')"""
+        nodes = self.refs.get(path)
+        return nodes[0] if nodes else None
+
+    def children(self, resource_type=None):
+        """Nodes referencing this one, optionally of one type"""
+        return [n for n, _ in self.referenced_by if resource_type is None or n.type == resource_type]
+
+    def __repr__(self):
+        return f"<{self.type}/{self.id}>"
+
+
+class ResourceGraph:
+    def __init__(self):
+        self.nodes = {}
+        self.requests = 0
+        self.strategy = None
+
+    def add(self, resource):
+        if resource and resource.get('resourceType') and resource.get('id'):
+            key = (resource['resourceType'], resource['id'])
+            if key not in self.nodes:
+                self.nodes[key] = Node(resource)
+
+    def add_bundle(self, bundle):
+        for entry in bundle.get('entry', []):
+            resource = entry.get('resource') or {}
+            if resource.get('resourceType') == 'Bundle':
+                self.add_bundle(resource)  # batch-response entries carry searchset Bundles
+            elif resource.get('resourceType') != 'OperationOutcome':
+                self.add(resource)
+
+    def link(self):
+        """Resolve every reference between nodes already in the graph"""
+        for node in self.nodes.values():
+            node.refs.clear()
+            node.referenced_by.clear()
+        for node in self.nodes.values():
+            for path, reference in references(node.resource):
+                target = self.nodes.get(parse_reference(reference))
+                if target is not None:
+                    node.refs.setdefault(path, []).append(target)
+                    target.referenced_by.append((node, path))
+        return self
+
+    def get(self, resource_type, resource_id):
+        return self.nodes.get((resource_type, resource_id))
+
+    def resolve(self, reference):
+        return self.nodes.get(parse_reference(reference))
+
+    def of_type(self, resource_type):
+        return [n for n in self.nodes.values() if n.type == resource_type]
+
+    def chart(self, patient_id):
+        """Printable chart: encounters with what hangs off them, then everything else"""
+        patient = self.get('Patient', patient_id)
+        if patient is None:
+            return [f"Patient/{patient_id} not found"]
+        lines = [f"Patient/{patient_id} ({len(self.nodes)} resources, {self.requests} request(s), {self.strategy})"]
+        encounters = sorted(patient.children('Encounter'),
+                            key=lambda n: n.resource.get('period', {}).get('start', ''))
+        attached = set()
+        for encounter in encounters:
+            lines.append(f"  Encounter/{encounter.id} {encounter.resource.get('period', {}).get('start', '')}")
+            for child in encounter.children():
+                attached.add(id(child))
+                lines.append(f"    {child.type}/{child.id}")
+        for child in patient.children():
+            if child.type != 'Encounter' and id(child) not in attached:
+                lines.append(f"  {child.type}/{child.id}")
+        return lines
+
+
+class JoinedFetch:
+    """Builds patient graphs through a runner's session, planned from its CapabilityStatement"""
+
+    def __init__(self, runner, workers=4):
+        self.runner = runner
+        self.caps = runner.capabilities
+        self.store = getattr(runner, 'store', None)
+        self.workers = workers
+
+    def get(self, graph, url, params=None):
+        res = self.runner.session.get(url, params=params, headers=self.runner.get_headers())
+        graph.requests += 1
+        if res.status_code != 200:
+            raise requests.exceptions.HTTPError(f"{res.status_code} for {url}: {res.text[:200]}", response=res)
+        return res.json()
+
+    def add_bundle(self, graph, bundle):
+        graph.add_bundle(bundle)
+        if self.store is not None:
+            self.store.put_bundle(bundle)
+
+    def get_all_pages(self, graph, url, params=None):
+        bundle = self.get(graph, url, params)
+        self.add_bundle(graph, bundle)
+        self.next_pages(graph, bundle)
+
+    def next_pages(self, graph, bundle):
+        """Follow link[next] from a first page already in the graph"""
+        while True:
+            url = next((link['url'] for link in bundle.get('link', []) if link.get('relation') == 'next'), None)
+            if not url:
+                return
+            bundle = self.get(graph, url)
+            self.add_bundle(graph, bundle)
+
+    def patient_param(self, resource_type):
+        """Search parameter to find a type's resources for one patient"""
+        if self.caps.supports_search_param(resource_type, 'patient') and resource_type != 'Appointment':
+            return 'patient'
+        return PATIENT_PARAM.get(resource_type, 'subject')
+
+    def patient_graph(self, patient_id, types=CHART_TYPES):
+        fhir_url = self.runner.fhir_url
+        graph = ResourceGraph()
+
+        if self.caps.known and self.caps.supports_operation('Patient', 'everything'):
+            graph.strategy = '$everything'
+            self.get_all_pages(graph, f"{fhir_url}/Patient/{patient_id}/$everything")
+            return graph.link()
+
+        types = [t for t in types if self.caps.supports(t, 'search-type')]
+        # Types without a known link to Patient are searched on their own, never _revinclude'd
+        joined = [t for t in types
+                  if t in PATIENT_PARAM and self.caps.supports_revinclude('Patient', f"{t}:{PATIENT_PARAM[t]}")]
+        rest = [t for t in types if t not in joined]
+        params = [('_id', patient_id)] + [('_revinclude', f"{t}:{PATIENT_PARAM[t]}") for t in joined]
+        self.get_all_pages(graph, f"{fhir_url}/Patient", params)
+        graph.strategy = f"_revinclude x{len(joined)}" if joined else 'search'
+
+        if rest:
+            searches = [f"{t}?{self.patient_param(t)}=Patient/{patient_id}" for t in rest]
+            if len(searches) > 1 and self.caps.supports_system('batch') and self.batch(graph, searches):
+                graph.strategy += f" + batch of {len(searches)}"
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    list(pool.map(lambda s: self.get_all_pages(graph, f"{fhir_url}/{s}"), searches))
+                graph.strategy += f" + {len(searches)} search(es)"
+        return graph.link()
+
+    def batch(self, graph, searches):
+        """All fallback searches in one batch Bundle; False if the server would not take it"""
+        bundle = {"resourceType": "Bundle", "type": "batch",
+                  "entry": [{"request": {"method": "GET", "url": s}} for s in searches]}
+        res = self.runner.session.post(self.runner.fhir_url, json=bundle, headers=self.runner.get_headers())
+        graph.requests += 1
+        if res.status_code != 200:
+            return False
+        response = res.json()
+        self.add_bundle(graph, response)
+        # Each entry holds the first page of its searchset only
+        for entry in response.get('entry', []):
+            resource = entry.get('resource') or {}
+            if resource.get('resourceType') == 'Bundle':
+                self.next_pages(graph, resource)
+        return True
@@ -0,0 +1,325 @@
+"""
+Health Probe Service
+1. Runs synthetic transactions on a schedule: /metadata, token refresh,
+   Patient search and a Patient create+delete round trip
+2. Keeps rolling latency percentiles and availability in memory
+3. Serves a status page (/), JSON (/status.json) and Prometheus text
+   metrics (/metrics) on a local port
+4. Alerts when a configured SLO (e.g. `search:p95<300`) is breached
+"""
+
+import collections
+import html
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from fhirkit.histogram import LatencyHistogram
+
+WINDOWS = (('5m', 300), ('1h', 3600))
+
+
+class RollingWindow:
+    """Latency and availability over the last `seconds`, kept in fixed time slots"""
+
+    def __init__(self, seconds, slot=10):
+        self.seconds = seconds
+        self.slot = slot
+        self.slots = collections.deque()  # [slot_start, LatencyHistogram, ok, total]
+
+    def record(self, now, latency, ok):
+        start = now - now % self.slot
+        if not self.slots or self.slots[-1][0] != start:
+            self.slots.append([start, LatencyHistogram(), 0, 0])
+        entry = self.slots[-1]
+        entry[1].record(latency)
+        entry[2] += 1 if ok else 0
+        entry[3] += 1
+        self.expire(now)
+
+    def expire(self, now):
+        while self.slots and self.slots[0][0] <= now - self.seconds - self.slot:
+            self.slots.popleft()
+
+    def summary(self, now):
+        self.expire(now)
+        hist = LatencyHistogram()
+        ok = total = 0
+        for start, h, n_ok, n in self.slots:
+            if start > now - self.seconds - self.slot:
+                hist.merge(h)
+                ok += n_ok
+                total += n
+        s = hist.summary()
+        s['availability'] = round(100.0 * ok / total, 3) if total else None
+        return s
+
+
+class SLO:
+    """Objective such as `search:p95<300` (milliseconds) or `search:availability>=99.5` (percent)"""
+
+    PATTERN = re.compile(r'^(\w+):(p\d+|mean|max|availability)\s*(<=|>=|<|>)\s*([\d.]+)$')
+
+    def __init__(self, spec, window='5m', min_samples=5):
+        match = self.PATTERN.match(spec.replace(' ', ''))
+        if not match:
+            raise ValueError(f"Invalid SLO '{spec}' (expected e.g. search:p95<300 or search:availability>=99.5)")
+        self.spec = spec
+        self.transaction, self.metric, self.op, threshold = match.groups()
+        self.threshold = float(threshold)
+        self.window = window
+        self.min_samples = min_samples
+        self.breached = False
+        self.value = None
+
+    def evaluate(self, summary):
+        """Returns True/False for met/breached, or None without enough samples"""
+        self.value = summary.get(self.metric)
+        if summary['count'] < self.min_samples or self.value is None:
+            return None
+        return {
+            '<': self.value < self.threshold,
+            '<=': self.value <= self.threshold,
+            '>': self.value > self.threshold,
+            '>=': self.value >= self.threshold,
+        }[self.op]
+
+    def unit(self):
+        return '%' if self.metric == 'availability' else 'ms'
+
+
+class HealthProbe:
+    """Scheduled synthetic transactions against one FHIR server"""
+
+    def __init__(self, runner, intervals=None, slos=None, alert_webhook=None, timeout=10, out=None):
+        self.runner = runner
+        self.timeout = timeout
+        self.alert_webhook = alert_webhook
+        self.out = out or sys.stdout
+        self.intervals = dict(intervals or {'metadata': 15, 'search': 15, 'roundtrip': 60, 'token': 300})
+        caps = getattr(runner, 'capabilities', None)
+        if 'roundtrip' in self.intervals and caps is not None and \
+                not (caps.supports('Patient', 'create') and caps.supports('Patient', 'delete')):
+            print("⏭️  Skipping roundtrip: the server does not declare Patient create and delete", file=self.out)
+            del self.intervals['roundtrip']
+        self.slos = slos or []
+        unscheduled = [slo.spec for slo in self.slos if slo.transaction not in self.intervals]
+        if unscheduled:
+            raise ValueError(f"SLO {', '.join(unscheduled)} names a transaction that is not scheduled "
+                             f"(scheduled: {', '.join(self.intervals) or 'none'})")
+        self.lock = threading.Lock()
+        self.windows = {name: {w: RollingWindow(seconds) for w, seconds in WINDOWS} for name in self.intervals}
+        self.runs = {name: collections.Counter() for name in self.intervals}
+        self.last = {}
+        self.started = time.time()
+        self.stop_event = threading.Event()
+
+    # -- synthetic transactions: each returns True on success, raises or returns False on failure
+
+    def probe_metadata(self):
+        res = self.runner.session.get(f"{self.runner.fhir_url}/metadata", timeout=self.timeout)
+        return res.status_code == 200
+
+    def probe_token(self):
+        token = self.runner.tokens.refresh(stale_token=self.runner.token)
+        if token:
+            self.runner.token = token
+        return bool(token)
+
+    def probe_search(self):
+        res = self.runner.session.get(f"{self.runner.fhir_url}/Patient", params={'_count': 1},
+                                      headers=self.runner.get_headers(), timeout=self.timeout)
+        return res.status_code == 200
+
+    def probe_roundtrip(self):
+        patient = {
+            "resourceType": "Patient",
+            "active": False,
+            "name": [{"use": "official", "family": "Probe", "given": ["Health", uuid.uuid4().hex[:8]]}],
+            "gender": "unknown",
+            "birthDate": "1970-01-01",
+        }
+        res = self.runner.session.post(f"{self.runner.fhir_url}/Patient", json=patient,
+                                       headers=self.runner.get_headers(), timeout=self.timeout)
+        if res.status_code not in [200, 201]:
+            return False
+        # Recorded like any other create, so teardown removes it if the delete below fails
+        patient_id = self.runner.manifest.record_response('Patient', res)
+        if not patient_id:
+            return False
+        res = self.runner.session.delete(f"{self.runner.fhir_url}/Patient/{patient_id}",
+                                         headers=self.runner.get_headers(), timeout=self.timeout)
+        if res.status_code not in [200, 202, 204]:
+            return False
+        self.runner.manifest.forget('Patient', patient_id)
+        return True
+
+    def run_transaction(self, name):
+        start = time.perf_counter()
+        error = None
+        try:
+            ok = bool(getattr(self, f"probe_{name}")())
+        except Exception as e:
+            ok, error = False, str(e)
+        latency = time.perf_counter() - start
+        now = time.time()
+        with self.lock:
+            for window in self.windows[name].values():
+                window.record(now, latency, ok)
+            self.runs[name]['ok' if ok else 'failed'] += 1
+            self.last[name] = {'at': now, 'ok': ok, 'latency_ms': round(latency * 1000, 2), 'error': error}
+        self.check_slos(name)
+
+    def check_slos(self, name):
+        for slo in self.slos:
+            if slo.transaction != name:
+                continue
+            with self.lock:
+                summary = self.windows[name][slo.window].summary(time.time())
+            met = slo.evaluate(summary)
+            if met is False and not slo.breached:
+                slo.breached = True
+                self.alert('breached', slo)
+            elif met and slo.breached:
+                slo.breached = False
+                self.alert('recovered', slo)
+
+    def alert(self, state, slo):
+        icon = '🚨' if state == 'breached' else '✅'
+        message = (f"{icon} SLO {state}: {slo.spec} - {slo.metric} is {slo.value}{slo.unit()} "
+                   f"over the last {slo.window}")
+        print(message, file=self.out, flush=True)
+        if self.alert_webhook:
+            try:
+                requests.post(self.alert_webhook, json={'state': state, 'slo': slo.spec, 'value': slo.value,
+                                                        'window': slo.window, 'message': message}, timeout=5)
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  Alert webhook failed: {e}", file=self.out)
+
+    def status(self):
+        now = time.time()
+        with self.lock:
+            transactions = {
+                name: {
+                    'interval': self.intervals[name],
+                    'runs': dict(self.runs[name]),
+                    'last': self.last.get(name),
+                    'windows': {w: win.summary(now) for w, win in self.windows[name].items()},
+                }
+                for name in self.intervals
+            }
+        return {
+            'uptime': round(now - self.started, 1),
+            'fhir_url': self.runner.fhir_url,
+            'transactions': transactions,
+            'slos': [{'slo': s.spec, 'window': s.window, 'breached': s.breached, 'value': s.value} for s in self.slos],
+        }
+
+    def metrics(self):
+        """Prometheus text exposition of the current status"""
+        status = self.status()
+        lines = [
+            "# TYPE fhir_probe_runs_total counter",
+            "# TYPE fhir_probe_latency_ms gauge",
+            "# TYPE fhir_probe_availability_percent gauge",
+            "# TYPE fhir_probe_slo_breached gauge",
+        ]
+        for name, t in status['transactions'].items():
+            for outcome, n in t['runs'].items():
+                lines.append(f'fhir_probe_runs_total{{transaction="{name}",outcome="{outcome}"}} {n}')
+            for window, s in t['windows'].items():
+                for q in ('p50', 'p95', 'p99'):
+                    if s[q] is not None:
+                        lines.append(f'fhir_probe_latency_ms{{transaction="{name}",window="{window}",'
+                                     f'quantile="{q}"}} {s[q]}')
+                if s['availability'] is not None:
+                    lines.append(f'fhir_probe_availability_percent{{transaction="{name}",window="{window}"}} '
+                                 f'{s["availability"]}')
+        for slo in status['slos']:
+            lines.append(f'fhir_probe_slo_breached{{slo="{slo["slo"]}"}} {int(slo["breached"])}')
+        return "\n".join(lines) + "\n"
+
+    def status_page(self):
+        status = self.status()
+        rows = []
+        for name, t in status['transactions'].items():
+            s = t['windows']['5m']
+            last = t['last'] or {}
+            state = '✅' if last.get('ok') else ('❌' if last else '…')
+            rows.append(
+                f"<tr><td>{state} {html.escape(name)}</td><td>{t['interval']}s</td>"
+                f"<td>{s['count']}</td><td>{s['availability']}</td><td>{s['p50']}</td>"
+                f"<td>{s['p95']}</td><td>{s['p99']}</td><td>{t['windows']['1h']['availability']}</td>"
+                f"<td>{html.escape(str(last.get('error') or ''))}</td></tr>")
+        slos = "".join(
+            f"<li>{'🚨' if s['breached'] else '✅'} {html.escape(s['slo'])} (now {s['value']})</li>"
+            for s in status['slos']) or "<li>No SLOs configured</li>"
+        return (
+            "<html><head><meta http-equiv='refresh' content='5'><title>FHIR Health Probe</title></head><body>"
+            f"<h1>FHIR Health Probe</h1><p>{html.escape(status['fhir_url'])} - up {status['uptime']:.0f}s</p>"
+            "<table border='1' cellpadding='4'><tr><th>Transaction</th><th>Every</th><th>Runs (5m)</th>"
+            "<th>Avail % (5m)</th><th>p50 ms</th><th>p95 ms</th><th>p99 ms</th><th>Avail % (1h)</th>"
+            f"<th>Last error</th></tr>{''.join(rows)}</table><h2>SLOs</h2><ul>{slos}</ul></body></html>")
+
+    def schedule(self):
+        """Run each transaction on its own interval until stopped"""
+        next_run = {name: time.monotonic() for name in self.intervals}
+        running = set()
+        with ThreadPoolExecutor(max_workers=len(self.intervals)) as pool:
+            while not self.stop_event.is_set():
+                now = time.monotonic()
+                for name, due in next_run.items():
+                    if due <= now and name not in running:
+                        running.add(name)
+                        next_run[name] = now + self.intervals[name]
+                        pool.submit(self.run_transaction, name).add_done_callback(
+                            lambda _, n=name: running.discard(n))
+                self.stop_event.wait(max(0.05, min(next_run.values()) - time.monotonic()))
+
+    def serve(self, host='127.0.0.1', port=9500):
+        server = ThreadingHTTPServer((host, port), ProbeHandler)
+        server.daemon_threads = True
+        server.probe = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"🩺 Health probe for {self.runner.fhir_url}", file=self.out)
+        print(f"   Status page: http://{host}:{port}/   Metrics: http://{host}:{port}/metrics", file=self.out)
+        for slo in self.slos:
+            print(f"   SLO: {slo.spec} over {slo.window}", file=self.out)
+        try:
+            self.schedule()
+        except KeyboardInterrupt:
+            print("\n👋 Stopping health probe", file=self.out)
+        finally:
+            self.stop_event.set()
+            server.shutdown()
+
+
+class ProbeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        probe = self.server.probe
+        if self.path == '/metrics':
+            self.reply(200, 'text/plain; version=0.0.4', probe.metrics())
+        elif self.path == '/status.json':
+            self.reply(200, 'application/json', json.dumps(probe.status(), indent=2))
+        elif self.path == '/':
+            self.reply(200, 'text/html; charset=utf-8', probe.status_page())
+        else:
+            self.reply(404, 'text/plain', 'not found\n')
+
+    def reply(self, status, content_type, text):
+        payload = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        return  # Suppress default logging
@@ -0,0 +1,100 @@
+"""
+Latency Histogram
+Log-bucketed histogram of latencies (in seconds). Buckets have a fixed
+relative width, so a histogram is small enough to snapshot every second,
+ship as JSON and merge with the histograms of other workers.
+"""
+
+import math
+
+
+class LatencyHistogram:
+    """Mergeable latency histogram with ~2% relative precision"""
+
+    PRECISION = 0.02
+    MIN_VALUE = 1e-6  # 1 microsecond
+    LOG_BASE = math.log(1 + PRECISION)
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket_for(self, value):
+        value = max(value, self.MIN_VALUE)
+        return int(math.log(value / self.MIN_VALUE) / self.LOG_BASE)
+
+    def value_for(self, bucket):
+        """Midpoint of a bucket, in seconds"""
+        return self.MIN_VALUE * math.exp((bucket + 0.5) * self.LOG_BASE)
+
+    def record(self, value, count=1):
+        bucket = self.bucket_for(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for bucket, n in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + n
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def percentile(self, p):
+        """Latency at percentile p (0-100), or None when empty"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100.0))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(max(self.value_for(bucket), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def summary(self):
+        """Count plus mean and percentiles in milliseconds"""
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+        return {
+            'count': self.count,
+            'mean': ms(self.mean()),
+            'p50': ms(self.percentile(50)),
+            'p90': ms(self.percentile(90)),
+            'p95': ms(self.percentile(95)),
+            'p99': ms(self.percentile(99)),
+            'max': ms(self.max),
+        }
+
+    def to_dict(self):
+        return {
+            'counts': {str(k): v for k, v in self.counts.items()},
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        hist.counts = {int(k): v for k, v in data.get('counts', {}).items()}
+        hist.count = data.get('count', 0)
+        hist.total = data.get('total', 0.0)
+        hist.min = data.get('min')
+        hist.max = data.get('max')
+        return hist
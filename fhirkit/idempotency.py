@@ -0,0 +1,71 @@
+"""
+Idempotent Creates
+1. Each payload gets a deterministic client identifier: a hash of its
+   content plus an optional scope (e.g. load-test iteration)
+2. Creates are sent as conditional creates (If-None-Exist on that
+   identifier) where the server declares conditionalCreate
+3. Elsewhere a lookup by identifier runs first and the POST only follows
+   when nothing matched, so retries and reruns never duplicate data
+4. Where the server offers none of these, a create is a plain POST and is
+   never retried
+"""
+
+import hashlib
+import json
+import uuid
+
+import requests
+
+IDENTIFIER_SYSTEM = 'urn:fhirkit:client-id'
+IGNORED = ('id', 'meta', 'text')
+
+
+def client_key(resource, scope=''):
+    """Stable key for a payload: same content + scope -> same key"""
+    content = {k: v for k, v in resource.items() if k not in IGNORED}
+    content['identifier'] = [i for i in resource.get('identifier', []) if i.get('system') != IDENTIFIER_SYSTEM]
+    canonical = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{scope}\n{canonical}".encode('utf-8')).hexdigest()[:32]
+
+
+def stamp(resource, scope=''):
+    """Add (or replace) the client identifier on `resource`; returns the key"""
+    key = client_key(resource, scope)
+    others = [i for i in resource.get('identifier', []) if i.get('system') != IDENTIFIER_SYSTEM]
+    resource['identifier'] = others + [{"system": IDENTIFIER_SYSTEM, "value": key}]
+    return key
+
+
+def key_to_id(key):
+    """Deterministic logical id for update-as-create (PUT) servers"""
+    return str(uuid.UUID(key))
+
+
+def if_none_exist(key):
+    return f"identifier={IDENTIFIER_SYSTEM}|{key}"
+
+
+def lookup(session, url, key, headers):
+    """The resource already created with `key`, or None (under the session's timeouts and Deadline)"""
+    res = session.get(url, params={'identifier': f"{IDENTIFIER_SYSTEM}|{key}", '_count': 1},
+                      headers=headers)
+    if res.status_code != 200:
+        return None
+    try:
+        entries = res.json().get('entry', [])
+    except ValueError:
+        return None
+    return entries[0].get('resource') if entries else None
+
+
+def found_response(url, resource):
+    """A 200 response carrying an existing resource, shaped like a conditional create's"""
+    res = requests.models.Response()
+    res.status_code = 200
+    res.url = url
+    res.reason = 'OK (already exists)'
+    res.headers['Content-Type'] = 'application/fhir+json'
+    res.headers['Location'] = f"{url}/{resource.get('id', '')}"
+    res._content = json.dumps(resource).encode('utf-8')
+    res.encoding = 'utf-8'
+    return res
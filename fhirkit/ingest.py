@@ -0,0 +1,399 @@
+"""
+Vital-Sign Ingest
+1. Takes a feed of readings as columns (patient, time, systolic, diastolic
+   and optionally heart rate, SpO2, temperature, respiratory rate) held in
+   NumPy arrays, loaded from .npz / CSV or generated
+2. Range checks, rounding and time formatting run column-wise on whole
+   chunks; rows then become Observations (a BP panel per reading)
+3. Observations go out as batch Bundles with a bounded number in flight,
+   and the report gives the sustained readings per second
+"""
+
+import csv
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fhirkit.deadline import resize_pool
+from fhirkit.histogram import LatencyHistogram
+from fhirkit.idempotency import IDENTIFIER_SYSTEM, if_none_exist
+from fhirkit.manifest import created_id
+from fhirkit.validation import UCUM, UCUM_UNITS
+
+try:
+    import numpy as np
+except ImportError:  # optional: only the ingest needs it
+    np = None
+
+LOINC = 'http://loinc.org'
+BP_PANEL = ('85354-9', 'Blood pressure panel with all children optional')
+# Column -> (LOINC code, display, UCUM unit, plausible range, decimals)
+VITALS = {
+    'systolic': ('8480-6', 'Systolic blood pressure', 'mm[Hg]', (40, 300), 0),
+    'diastolic': ('8462-4', 'Diastolic blood pressure', 'mm[Hg]', (20, 200), 0),
+    'heart_rate': ('8867-4', 'Heart rate', '/min', (20, 300), 0),
+    'spo2': ('59408-5', 'Oxygen saturation in Arterial blood by Pulse oximetry', '%', (50, 100), 0),
+    'temperature': ('8310-5', 'Body temperature', 'Cel', (30, 45), 1),
+    'respiratory_rate': ('9279-1', 'Respiratory rate', '/min', (4, 80), 0),
+}
+BP_COLUMNS = ('systolic', 'diastolic')
+CATEGORY = [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category",
+                         "code": "vital-signs", "display": "Vital Signs"}]}]
+BATCH_SIZE = 100
+MAX_ERRORS = 10
+
+
+def require_numpy():
+    if np is None:
+        raise RuntimeError("The vital-sign ingest needs NumPy: pip3 install numpy")
+
+
+def concept(code, display):
+    return {"coding": [{"system": LOINC, "code": code, "display": display}]}
+
+
+# Shared, never mutated: every Observation of a kind points at the same elements
+CODES = {column: concept(code, display) for column, (code, display, _, _, _) in VITALS.items()}
+BP_CODE = concept(*BP_PANEL)
+UNITS = {column: unit for column, (_, _, unit, _, _) in VITALS.items()}
+
+
+def to_times(values):
+    """datetime64[s] array from datetime64, ISO strings or epoch seconds"""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[s]')
+    if np.issubdtype(values.dtype, np.number):
+        return values.astype('int64').astype('datetime64[s]')
+    # ISO strings; a trailing Z (UTC) is not understood by NumPy
+    return np.char.rstrip(values.astype(str), 'Z').astype('datetime64[s]')
+
+
+class VitalsFeed:
+    """Readings as equal-length columns; NaN marks a value not taken"""
+
+    def __init__(self, patient, time, encounter=None, **readings):
+        require_numpy()
+        unknown = set(readings) - set(VITALS)
+        if unknown:
+            raise ValueError(f"Unknown vital column(s): {', '.join(sorted(unknown))} "
+                             f"(expected {', '.join(VITALS)})")
+        if not readings:
+            raise ValueError("No vital columns given")
+        self.patient = np.asarray(patient).astype(str)
+        self.time = to_times(time)
+        self.encounter = None if encounter is None else np.asarray(encounter).astype(str)
+        self.readings = {name: np.asarray(values, dtype='float64') for name, values in readings.items()}
+        lengths = {len(column) for column in [self.patient, self.time] + list(self.readings.values()) +
+                   ([self.encounter] if self.encounter is not None else [])}
+        if len(lengths) != 1:
+            raise ValueError(f"Columns differ in length: {sorted(lengths)}")
+
+    def __len__(self):
+        return len(self.patient)
+
+    @classmethod
+    def from_npz(cls, path):
+        """Arrays named patient, time, [encounter,] and vital columns"""
+        require_numpy()
+        with np.load(path, allow_pickle=False) as data:
+            columns = {name: data[name] for name in data.files}
+        return cls(**columns)
+
+    @classmethod
+    def from_csv(cls, path):
+        """CSV with a header row naming the same columns; empty cells are missing values"""
+        require_numpy()
+        with open(path, newline='') as f:
+            rows = csv.DictReader(f)
+            columns = {name: [] for name in rows.fieldnames or ()}
+            for row in rows:
+                for name in columns:
+                    columns[name].append(row[name])
+        readings = {name: np.array([float(v) if v.strip() else np.nan for v in values])
+                    for name, values in columns.items() if name in VITALS}
+        times = columns.get('time', [])
+        times = np.array(times, dtype='float64') if times and times[0].replace('.', '', 1).isdigit() else times
+        encounter = columns.get('encounter')
+        return cls(columns.get('patient', []), times, encounter if encounter and any(encounter) else None,
+                   **readings)
+
+    @classmethod
+    def synthetic(cls, patients, per_patient=60, interval=60, start=None, seed=None, encounters=None):
+        """Plausible readings: `per_patient` for each patient id, `interval` seconds apart"""
+        require_numpy()
+        rng = np.random.default_rng(seed)
+        count = len(patients) * per_patient
+        start = np.datetime64(int(start if start is not None else time.time() - per_patient * interval), 's')
+        offsets = np.tile(np.arange(per_patient) * interval, len(patients))
+        baseline = np.repeat(rng.normal(125, 12, len(patients)), per_patient)
+        systolic = baseline + rng.normal(0, 6, count)
+        columns = {
+            'patient': np.repeat(np.asarray(patients).astype(str), per_patient),
+            'time': start + offsets.astype('timedelta64[s]'),
+            'systolic': systolic,
+            'diastolic': systolic * 0.65 + rng.normal(0, 4, count),
+            'heart_rate': rng.normal(72, 9, count),
+            'spo2': np.minimum(100, rng.normal(97, 1.5, count)),
+        }
+        if encounters is not None:
+            columns['encounter'] = np.repeat(np.asarray(encounters).astype(str), per_patient)
+        return cls(**columns)
+
+
+def observations(feed, start, stop, scope=''):
+    """((Observation, client key, row) list, values rejected as implausible) for rows [start, stop)
+
+    The numeric work (range checks, rounding, time strings) is done per column
+    for the whole slice; only the dict building is per row.
+    """
+    times = np.datetime_as_string(feed.time[start:stop], unit='s', timezone='UTC').tolist()
+    subjects = np.char.add('Patient/', feed.patient[start:stop]).tolist()
+    encounters = None if feed.encounter is None else \
+        np.where(feed.encounter[start:stop] != '', np.char.add('Encounter/', feed.encounter[start:stop]), '').tolist()
+    columns, rejected = {}, 0
+    for name, values in feed.readings.items():
+        _, _, _, (low, high), decimals = VITALS[name]
+        values = values[start:stop]
+        taken = np.isfinite(values)
+        plausible = taken & (values >= low) & (values <= high)
+        rejected += int(np.count_nonzero(taken & ~plausible))
+        rounded = np.round(np.where(plausible, values, 0), decimals)  # NaN cannot become an int
+        rounded = rounded.astype('int64').tolist() if decimals == 0 else rounded.tolist()
+        columns[name] = (rounded, plausible.tolist())
+
+    def quantity(name, value):
+        return {"value": value, "unit": UCUM_UNITS.get(UNITS[name], UNITS[name]), "system": UCUM, "code": UNITS[name]}
+
+    def observation(i, code, key_text):
+        resource = {
+            "resourceType": "Observation",
+            "status": "final",
+            "category": CATEGORY,
+            "code": code,
+            "subject": {"reference": subjects[i]},
+            "effectiveDateTime": times[i],
+        }
+        if encounters and encounters[i]:
+            resource["encounter"] = {"reference": encounters[i]}
+        # Client identifier from the reading itself (cheaper than hashing the payload)
+        key = hashlib.sha256(f"{scope}\n{subjects[i]}\n{times[i]}\n{key_text}".encode('utf-8')).hexdigest()[:32]
+        resource["identifier"] = [{"system": IDENTIFIER_SYSTEM, "value": key}]
+        return resource, key
+
+    bp = [name for name in BP_COLUMNS if name in columns]
+    others = [name for name in columns if name not in BP_COLUMNS]
+    out = []
+    for i in range(stop - start):
+        components = [{"code": CODES[name], "valueQuantity": quantity(name, columns[name][0][i])}
+                      for name in bp if columns[name][1][i]]
+        if components:
+            resource, key = observation(i, BP_CODE, repr([c["valueQuantity"]["value"] for c in components]))
+            resource["component"] = components
+            out.append((resource, key, start + i))
+        for name in others:
+            if columns[name][1][i]:
+                value = columns[name][0][i]
+                resource, key = observation(i, CODES[name], f"{name}={value}")
+                resource["valueQuantity"] = quantity(name, value)
+                out.append((resource, key, start + i))
+    return out, rejected
+
+
+class IngestReport:
+    def __init__(self):
+        self.readings = 0  # all of their observations created or already there
+        self.failed_readings = set()  # rows with at least one failed observation
+        self.empty = 0  # rows without a single plausible value
+        self.rejected = 0
+        self.observations = 0
+        self.bundles = 0
+        self.created = 0
+        self.existing = 0
+        self.failed = 0
+        self.errors = []
+        self.per_second = {}  # second since start -> readings completed
+        self.latency = LatencyHistogram()
+        self.elapsed = 0
+
+    @property
+    def rate(self):
+        return self.readings / self.elapsed if self.elapsed else 0
+
+    @property
+    def sustained(self):
+        """Median readings/s over the whole seconds of the run (ramp-up and the last partial second left out)"""
+        seconds = [self.per_second.get(s, 0) for s in range(1, int(self.elapsed))]
+        if not seconds:
+            return self.rate
+        return sorted(seconds)[len(seconds) // 2]
+
+    def format(self):
+        summary = self.latency.summary()
+        lines = [
+            f"Ingested {self.readings} reading(s) as {self.observations} Observation(s) in {self.elapsed:.1f}s "
+            f"({self.bundles} request(s))",
+            f"  Throughput: {self.rate:.0f} readings/s overall, {self.sustained:.0f} readings/s sustained",
+            f"  Created {self.created}, already existed {self.existing}, failed {self.failed}, "
+            f"{self.rejected} implausible value(s) dropped",
+        ]
+        if self.failed_readings:
+            lines.append(f"❌ {len(self.failed_readings)} reading(s) not ingested (an Observation failed)")
+        if self.empty:
+            lines.append(f"  {self.empty} reading(s) without a plausible value, nothing sent")
+        if summary['count']:
+            lines.append(f"  Request latency: p50 {summary['p50']} ms, p95 {summary['p95']} ms, "
+                         f"max {summary['max']} ms")
+        lines.extend(f"⚠️  {error}" for error in self.errors)
+        return "\n".join(lines)
+
+
+class VitalsIngest:
+    """Sends a VitalsFeed through a runner's session"""
+
+    def __init__(self, runner, batch_size=BATCH_SIZE, workers=4, in_flight=None, progress=5.0):
+        require_numpy()
+        self.runner = runner
+        self.batch_size = batch_size
+        self.workers = workers
+        self.in_flight = in_flight or workers * 2  # chunks built ahead of the senders, at most
+        self.progress = progress
+        caps = runner.capabilities
+        self.use_batch = not caps.known or caps.supports_system('batch')
+        # A batch can only be retried when its entries are conditional creates
+        self.conditional = caps.supports_conditional_create('Observation')
+        self.url = f"{runner.fhir_url}/Observation"
+        self.lock = threading.Lock()
+        # One pooled connection per worker (a cassette's adapter is left alone)
+        resize_pool(runner.session, runner.fhir_url, workers)
+
+    def bundle(self, chunk):
+        entries = []
+        for resource, key, _ in chunk:
+            request = {"method": "POST", "url": "Observation"}
+            if self.conditional:
+                request["ifNoneExist"] = if_none_exist(key)
+            entries.append({"resource": resource, "request": request})
+        return {"resourceType": "Bundle", "type": "batch", "entry": entries}
+
+    def send_batch(self, chunk):
+        """(created ids, already existing, rows of failed entries, error) for one batch Bundle"""
+        body = self.bundle(chunk)
+        headers = dict(self.runner.get_headers(), Prefer='return=minimal')
+        for attempt in range(self.runner.CREATE_RETRIES + 1 if self.conditional else 1):
+            try:
+                res = self.runner.session.post(self.runner.fhir_url, json=body, headers=headers)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.runner.CREATE_RETRIES or not self.conditional:
+                    return [], 0, [row for _, _, row in chunk], f"{e.__class__.__name__}: {e}"
+        try:
+            entries = res.json().get('entry', []) if res.status_code == 200 else None
+        except ValueError:
+            entries = None
+        if entries is None or len(entries) != len(chunk):
+            return [], 0, [row for _, _, row in chunk], f"Batch failed with status {res.status_code}: {res.text[:200]}"
+        ids, existing, failed = [], 0, []
+        for entry, (_, _, row) in zip(entries, chunk):
+            response = entry.get('response') or {}
+            status = str(response.get('status', '0')).split(' ')[0]
+            if status == '201':
+                parts = response.get('location', '').split('/_history')[0].rstrip('/').split('/')
+                ids.append(parts[-1])
+            elif status == '200':
+                existing += 1
+            else:
+                failed.append(row)
+        return [i for i in ids if i], existing, failed, None
+
+    def send_single(self, chunk):
+        """Same as send_batch, one create at a time (servers without batch support)"""
+        ids, existing, failed, error = [], 0, [], None
+        for resource, _, row in chunk:
+            try:
+                res = self.runner.post_resource(self.url, resource)
+            except requests.exceptions.RequestException as e:
+                failed.append(row)
+                error = f"{e.__class__.__name__}: {e}"
+                continue
+            if res.status_code == 201:
+                ids.append(created_id('Observation', res))
+            elif res.status_code == 200:
+                existing += 1
+            else:
+                failed.append(row)
+                error = f"Create failed with status {res.status_code}: {res.text[:200]}"
+        return ids, existing, failed, error
+
+    def send(self, chunk, rows, report, start):
+        """Send one chunk; `rows` are the readings whose last Observation is in it"""
+        began = time.perf_counter()
+        ids, existing, failed, error = (self.send_batch if self.use_batch else self.send_single)(chunk)
+        done = time.perf_counter()
+        if ids and self.use_batch:  # post_resource records its own
+            self.runner.manifest.record_many('Observation', ids)
+        with self.lock:
+            report.latency.record(done - began)
+            report.bundles += 1
+            report.created += len(ids)
+            report.existing += existing
+            report.failed += len(failed)
+            report.failed_readings.update(failed)
+            # Only readings with nothing failed so far; a late failure in an earlier chunk is settled in run()
+            readings = sum(1 for row in rows if row not in report.failed_readings)
+            report.readings += readings
+            second = int(done - start)
+            report.per_second[second] = report.per_second.get(second, 0) + readings
+            if error and len(report.errors) < MAX_ERRORS:
+                report.errors.append(error)
+
+    def run(self, feed):
+        """IngestReport for the whole feed"""
+        report = IngestReport()
+        slots = threading.BoundedSemaphore(self.in_flight)
+        start = time.perf_counter()
+        last_tick = start
+        scope = self.runner.scope
+
+        def task(chunk, rows):
+            try:
+                self.send(chunk, rows, report, start)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = []
+            row, pending, sent_rows = 0, [], 0
+            # Rows are prepared a few batches at a time so the columns are worked on in bulk
+            rows_per_slice = max(self.batch_size, 1000)
+            while row < len(feed):
+                stop = min(len(feed), row + rows_per_slice)
+                made, rejected = observations(feed, row, stop, scope)
+                report.rejected += rejected
+                report.observations += len(made)
+                pending.extend(made)
+                row = stop
+                while len(pending) >= self.batch_size or (row >= len(feed) and pending):
+                    chunk, pending = pending[:self.batch_size], pending[self.batch_size:]
+                    # Readings are credited with the chunk holding their last observation
+                    rows = sorted({r for _, _, r in chunk} - ({pending[0][2]} if pending else set()))
+                    sent_rows += len(rows)
+                    slots.acquire()
+                    futures.append(pool.submit(task, chunk, rows))
+                now = time.perf_counter()
+                if self.progress and now - last_tick >= self.progress:
+                    last_tick = now
+                    print(f"⏱️  {now - start:5.1f}s: {report.readings} reading(s) sent "
+                          f"({report.readings / (now - start):.0f}/s)")
+                for future in [f for f in futures if f.done()]:
+                    future.result()  # surfaces anything other than a request failure
+                futures = [f for f in futures if not f.done()]
+            for future in futures:
+                future.result()
+        report.readings = sent_rows - len(report.failed_readings)
+        report.empty = len(feed) - sent_rows
+        report.elapsed = time.perf_counter() - start
+        return report
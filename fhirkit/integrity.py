@@ -0,0 +1,245 @@
+"""
+Referential Integrity Scanner
+1. Streams each source type page by page (projected to id, subject and
+   encounter) and collects referenced and existing ids into sets that
+   spill to sorted files on disk once a memory budget is reached
+2. A merge-join of referenced vs scanned ids leaves the candidates, which
+   are resolved with batched _id lookups (types not scanned, such as
+   Patient, are resolved this way entirely)
+3. Reports dangling references per source type, field and target
+"""
+
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from fhirkit.batchread import BatchReader
+from fhirkit.store import encounter_of, subject_of
+
+# Source type -> reference fields checked
+SOURCES = {
+    'Encounter': ('subject',),
+    'Observation': ('subject', 'encounter'),
+    'DocumentReference': ('subject', 'encounter'),
+    'MedicationRequest': ('subject', 'encounter'),
+}
+FIELDS = {'subject': subject_of, 'encounter': encounter_of}
+ELEMENTS = 'subject,patient,encounter,context'
+ENTRY_OVERHEAD = 90  # bytes a str costs in a set beyond its characters, roughly
+RESOLVE_BATCH = 500
+SAMPLE_SOURCES = 5
+MAX_SOURCES = 1000  # sources kept per dangling target (all are counted)
+
+
+def stream(runner, resource_type, page_size=200, elements=ELEMENTS, params=None):
+    """Every resource of a type, one page in memory at a time (elements=None for full resources)"""
+    url = f"{runner.fhir_url}/{resource_type}"
+    params = dict(params or {}, _count=page_size)
+    if elements:
+        params['_elements'] = elements
+    while url:
+        res = runner.session.get(url, params=params, headers=runner.get_headers())
+        res.raise_for_status()
+        bundle = res.json()
+        for entry in bundle.get('entry', []):
+            resource = entry.get('resource') or {}
+            if resource.get('resourceType') == resource_type:
+                yield resource
+        url = next((link['url'] for link in bundle.get('link', []) if link.get('relation') == 'next'), None)
+        params = None
+
+
+class SpillPool:
+    """Shared memory budget for SpillSets; the largest set spills when it is exceeded"""
+
+    def __init__(self, budget_bytes, directory):
+        self.budget = budget_bytes
+        self.dir = directory
+        self.sets = []
+        self.bytes = 0
+        self.spills = 0
+
+    def new_set(self, name):
+        spill_set = SpillSet(self, name)
+        self.sets.append(spill_set)
+        return spill_set
+
+    def grow(self, size):
+        self.bytes += size
+        if self.bytes > self.budget:
+            max(self.sets, key=lambda s: s.bytes).spill()
+
+
+class SpillSet:
+    """Set of strings that iterates sorted and unique, however much of it is on disk"""
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self.items = set()
+        self.bytes = 0
+        self.runs = []
+
+    def add(self, item):
+        if item not in self.items:
+            self.items.add(item)
+            size = ENTRY_OVERHEAD + len(item)
+            self.bytes += size
+            self.pool.grow(size)
+
+    def spill(self):
+        path = os.path.join(self.pool.dir, f"{self.name}-{len(self.runs)}.run")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(item + '\n' for item in sorted(self.items))
+        self.runs.append(path)
+        self.pool.bytes -= self.bytes
+        self.pool.spills += 1
+        self.items = set()
+        self.bytes = 0
+
+    @staticmethod
+    def read_run(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+    def __iter__(self):
+        last = None
+        for item in heapq.merge(sorted(self.items), *(self.read_run(p) for p in self.runs)):
+            if item != last:
+                yield item
+                last = item
+
+
+class IntegrityReport:
+    def __init__(self):
+        self.scanned = {}  # type -> resources streamed
+        self.references = {}  # target type -> unique ids referenced
+        self.looked_up = {}  # target type -> ids resolved by lookup
+        self.dangling = {}  # (source type, field, target type) -> references
+        self.unresolved = []  # lookup chunks that failed
+        self.samples = []
+        self.requests = 0
+        self.spills = 0
+        self.elapsed = 0
+
+    @property
+    def dangling_total(self):
+        return sum(self.dangling.values())
+
+    def format(self):
+        lines = [f"Scanned {sum(self.scanned.values())} resource(s) in {self.elapsed:.1f}s, "
+                 f"{self.requests} lookup request(s), {self.spills} spill(s) to disk"]
+        for resource_type, count in self.scanned.items():
+            lines.append(f"  {resource_type}: {count}")
+        for target, count in self.references.items():
+            lines.append(f"  -> {target}: {count} referenced, {self.looked_up.get(target, 0)} looked up")
+        if not self.dangling:
+            lines.append("✅ No dangling references" if not self.unresolved else
+                         "⚠️  No dangling references found, but some lookups failed")
+        for (source, field, target), count in sorted(self.dangling.items()):
+            lines.append(f"❌ {source}.{field} -> {target}: {count} dangling reference(s)")
+        for target, sources in self.samples:
+            lines.append(f"   {target} <- {', '.join(sources)}")
+        for chunk, error in self.unresolved:
+            lines.append(f"⚠️  Lookup failed ({chunk}): {error}")
+        return "\n".join(lines)
+
+
+class IntegrityScanner:
+    def __init__(self, runner, sources=None, scan=(), memory_mb=64, page_size=200, out=None, samples=20):
+        self.runner = runner
+        self.sources = {t: SOURCES.get(t, ('subject',)) for t in (sources or SOURCES)}
+        self.scan_only = [t for t in scan if t not in self.sources]  # targets streamed for their ids only
+        self.budget = int(memory_mb * 1024 * 1024)
+        self.page_size = page_size
+        self.out = out
+        self.max_samples = samples
+
+    def run(self):
+        start = time.perf_counter()
+        report = IntegrityReport()
+        directory = tempfile.mkdtemp(prefix='fhir-integrity-')
+        try:
+            pool = SpillPool(self.budget, directory)
+            existing, referenced = {}, {}
+            caps = self.runner.capabilities
+            for resource_type in list(self.sources) + self.scan_only:
+                if not caps.supports(resource_type, 'search-type'):
+                    print(f"⏭️  Skipping {resource_type}: server does not declare 'search-type'")
+                    continue
+                existing[resource_type] = ids = pool.new_set(f"{resource_type}-ids")
+                fields = self.sources.get(resource_type, ())
+                count = 0
+                for resource in stream(self.runner, resource_type, self.page_size):
+                    count += 1
+                    ids.add(resource['id'])
+                    for field in fields:
+                        ref = FIELDS[field](resource)
+                        if ref:
+                            target, target_id = ref.split('/', 1)
+                            if target not in referenced:
+                                referenced[target] = pool.new_set(f"{target}-refs")
+                            referenced[target].add(f"{target_id}\t{resource_type}/{resource['id']}\t{field}")
+                report.scanned[resource_type] = count
+                print(f"🔎 {resource_type}: {count} scanned")
+
+            out = open(self.out, 'w') if self.out else None
+            try:
+                for target, refs in referenced.items():
+                    self.check_target(target, refs, existing.get(target), report, out)
+            finally:
+                if out:
+                    out.close()
+            report.spills = pool.spills
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def check_target(self, target, refs, existing, report, out):
+        """Merge-join sorted references against sorted scanned ids; look up the rest in batches"""
+        existing_ids = iter(existing if existing is not None else ())
+        current = next(existing_ids, None)
+        candidates, unique = {}, 0
+        for target_id, lines in itertools.groupby(refs, key=lambda line: line.split('\t', 1)[0]):
+            unique += 1
+            while current is not None and current < target_id:
+                current = next(existing_ids, None)
+            if current == target_id:
+                continue
+            counts, sources = {}, []
+            for line in lines:
+                _, source, field = line.split('\t')
+                kind = (source.split('/', 1)[0], field)
+                counts[kind] = counts.get(kind, 0) + 1
+                if len(sources) < MAX_SOURCES:
+                    sources.append(f"{source}.{field}")
+            candidates[target_id] = (counts, sources)
+            if len(candidates) >= RESOLVE_BATCH:
+                self.resolve(target, candidates, report, out)
+                candidates = {}
+        if candidates:
+            self.resolve(target, candidates, report, out)
+        report.references[target] = unique
+
+    def resolve(self, target, candidates, report, out):
+        result = BatchReader(self.runner, use_store=False).read([(target, i) for i in candidates])
+        report.requests += result.requests
+        report.looked_up[target] = report.looked_up.get(target, 0) + len(candidates)
+        report.unresolved.extend(result.errors.items())  # failed chunks are not counted as dangling
+        for key in result.missing:
+            counts, sources = candidates[key.split('/', 1)[1]]
+            total = sum(counts.values())
+            for (source_type, field), count in counts.items():
+                dangling = (source_type, field, target)
+                report.dangling[dangling] = report.dangling.get(dangling, 0) + count
+            if len(report.samples) < self.max_samples:
+                more = [f"+{total - SAMPLE_SOURCES} more"] if total > SAMPLE_SOURCES else []
+                report.samples.append((key, sources[:SAMPLE_SOURCES] + more))
+            if out:
+                out.write(json.dumps({'target': key, 'references': total, 'sources': sources}) + '\n')
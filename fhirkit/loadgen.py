@@ -0,0 +1,440 @@
+"""
+Load Generator
+1. Describes a workload plan (virtual users, arrival rate, scenario mix)
+2. Drives TestRunner operations from many virtual users at once
+3. Collects per-operation latency histograms, reported every second
+"""
+
+import contextlib
+import json
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+
+from fhirkit import fixtures
+from fhirkit.deadline import Deadline
+from fhirkit.histogram import LatencyHistogram
+from fhirkit.runlog import RunLog
+from fhirkit.scenario import Scenario, Workflow, unknown_operations
+from fhirkit.singleflight import SingleFlight
+
+OUTCOMES = ('ok', 'failed', 'skipped', 'error', 'timeout')
+
+
+class WorkloadPlan:
+    """What to run: how many virtual users, how fast, and which scenarios
+
+    With a Scenario (a plan file that has "workflows"), the mix defaults to
+    its workflow weights and mix entries name its workflows.
+    """
+
+    def __init__(self, vus=1, rate=None, duration=30, mix=None, scenarios=None, deadline=None, fixtures=None,
+                 scenario=None):
+        self.vus = vus
+        self.rate = rate  # arrivals/second; None means closed model (VUs loop back-to-back)
+        self.duration = duration
+        self.scenario = scenario
+        self.mix = mix or (scenario.mix() if scenario else None) or {'search_patients': 1}
+        self.scenarios = scenarios or {}
+        self.deadline = deadline  # seconds per scenario iteration; None means per-request timeouts only
+        # e.g. {"patients": 50, "encounters": 1, "order": "round-robin"}; None creates setup inline
+        self.fixtures = fixtures
+
+    def steps(self, name):
+        """Operations making up a scenario; a bare operation name is a one-step scenario"""
+        return self.scenarios.get(name, [name])
+
+    def compile(self):
+        """name -> Workflow for every entry of the mix; done once per run"""
+        workflows = self.scenario.workflows if self.scenario else {}
+        return {name: workflows[name] if name in workflows else Workflow.of(name, self.steps(name))
+                for name in self.mix}
+
+    def split(self, parts):
+        """Divide VUs and arrival rate across `parts` workers
+
+        With fewer VUs than workers, the extra workers get 0 VUs (and no rate)
+        and stay idle rather than adding load the plan did not ask for.
+        """
+        active = min(parts, self.vus)
+        shares = []
+        for i in range(parts):
+            vus = self.vus // parts + (1 if i < self.vus % parts else 0)
+            rate = self.rate / active if self.rate and vus else None
+            shares.append(WorkloadPlan(vus, rate, self.duration, dict(self.mix), dict(self.scenarios),
+                                       self.deadline, dict(self.fixtures) if self.fixtures else None,
+                                       self.scenario))
+        return shares
+
+    def to_dict(self):
+        return {
+            'vus': self.vus,
+            'rate': self.rate,
+            'duration': self.duration,
+            'mix': self.mix,
+            'scenarios': self.scenarios,
+            'deadline': self.deadline,
+            'fixtures': self.fixtures,
+            'scenario': self.scenario.to_dict() if self.scenario else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data, base_dir=None):
+        scenario = data.get('scenario')
+        if scenario is None and 'workflows' in data:
+            scenario = data
+        return cls(
+            vus=int(data.get('vus', 1)),
+            rate=data.get('rate'),
+            duration=float(data.get('duration', 30)),
+            mix=data.get('mix'),
+            scenarios=data.get('scenarios'),
+            deadline=data.get('deadline'),
+            fixtures=data.get('fixtures'),
+            scenario=Scenario(scenario, base_dir) if scenario else None,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f), base_dir=os.path.dirname(os.path.abspath(path)))
+
+
+def parse_mix(text):
+    """Parse 'search_patients=70,create_patient=30' into a weight dict"""
+    mix = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+class OperationStats:
+    """Latency histogram plus outcome counters for one operation
+
+    Timed-out calls go to their own histogram: they neither vanish nor drag
+    the percentiles of calls that completed.
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.timeouts = LatencyHistogram()
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+
+    def record(self, seconds, outcome):
+        (self.timeouts if outcome == 'timeout' else self.latency).record(seconds)
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.timeouts.merge(other.timeouts)
+        for outcome, n in other.outcomes.items():
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + n
+        return self
+
+    def to_dict(self):
+        return {'latency': self.latency.to_dict(), 'timeouts': self.timeouts.to_dict(), 'outcomes': self.outcomes}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.latency = LatencyHistogram.from_dict(data['latency'])
+        if 'timeouts' in data:
+            stats.timeouts = LatencyHistogram.from_dict(data['timeouts'])
+        stats.outcomes.update(data.get('outcomes', {}))
+        return stats
+
+
+class StatsTable(dict):
+    """Operation name -> OperationStats"""
+
+    def record(self, op, seconds, outcome):
+        if op not in self:
+            self[op] = OperationStats()
+        self[op].record(seconds, outcome)
+
+    def merge(self, other):
+        for op, stats in other.items():
+            if op not in self:
+                self[op] = OperationStats()
+            self[op].merge(stats)
+        return self
+
+    def overall(self):
+        total = OperationStats()
+        for stats in self.values():
+            total.merge(stats)
+        return total
+
+    def to_dict(self):
+        return {op: stats.to_dict() for op, stats in self.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        table = cls()
+        for op, stats in data.items():
+            table[op] = OperationStats.from_dict(stats)
+        return table
+
+
+def format_tick(tick, table, gauges=None, interval=1.0):
+    """One line of the live view for a one-second interval"""
+    total = table.overall()
+    s = total.latency.summary()
+    line = (f"[{tick:>4}s] {(total.latency.count + total.timeouts.count) / interval:>7.1f} req/s"
+            f"  ok {total.outcomes['ok']:>5}  fail {total.outcomes['failed']:>4}"
+            f"  err {total.outcomes['error']:>4}  t/o {total.outcomes['timeout']:>4}")
+    if s['count']:
+        line += f"  p50 {s['p50']:>8.1f}ms  p95 {s['p95']:>8.1f}ms  p99 {s['p99']:>8.1f}ms"
+    if gauges:
+        line += "".join(f"  {k} {v}" for k, v in gauges.items() if v)
+    return line
+
+
+def format_report(table, duration):
+    """Final per-operation report"""
+    lines = [
+        "=" * 100,
+        "LOAD TEST REPORT",
+        "=" * 100,
+        f"{'Operation':<24}{'Count':>8}{'OK':>8}{'Fail':>6}{'Skip':>6}{'Err':>6}{'T/O':>6}"
+        f"{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}",
+    ]
+    rows = sorted(table.items())
+    if len(rows) > 1:
+        rows.append(('TOTAL', table.overall()))
+    for op, stats in rows:
+        s = stats.latency.summary()
+        o = stats.outcomes
+        count = s['count'] + stats.timeouts.count
+        rps = count / duration if duration else 0.0
+
+        def fmt(v):
+            return f"{v:>9.1f}" if v is not None else f"{'-':>9}"
+        lines.append(f"{op:<24}{count:>8}{o['ok']:>8}{o['failed']:>6}{o['skipped']:>6}{o['error']:>6}{o['timeout']:>6}"
+                     f"{rps:>9.1f}{fmt(s['p50'])}{fmt(s['p95'])}{fmt(s['p99'])}{fmt(s['max'])}")
+    timed_out = [(op, stats.timeouts.summary()) for op, stats in sorted(table.items()) if stats.timeouts.count]
+    if timed_out:
+        lines.append("Timed out (excluded from the percentiles above):")
+        for op, t in timed_out:
+            lines.append(f"  {op:<22}{t['count']:>8} after p50 {t['p50']:.0f}ms / max {t['max']:.0f}ms")
+    return "\n".join(lines)
+
+
+def timed_out(runner):
+    """Requests the runner's session has seen time out (0 for runners without one)"""
+    return getattr(getattr(runner, 'session', None), 'timed_out', 0)
+
+
+class LoadGenerator:
+    """Runs a WorkloadPlan against runners produced by `runner_factory`
+
+    Each virtual user owns one runner (its own HTTP session and ids). With a
+    rate set, a scheduler releases Poisson arrivals that idle VUs pick up
+    (open model); without one, every VU loops back-to-back (closed model).
+    """
+
+    def __init__(self, plan, runner_factory, quiet=True):
+        self.plan = plan
+        self.runner_factory = runner_factory
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.interval = StatsTable()
+        self.totals = StatsTable()
+        self.stop_event = threading.Event()
+        self.arrivals = queue.Queue() if plan.rate else None
+        self.max_backlog = max(plan.vus * 100, 1000)
+        self.dropped = 0
+        self.runners = None
+        self.workflows = plan.compile()
+        self.names = list(plan.mix)
+        weights = [plan.mix[n] for n in self.names]
+        self.cum_weights = [sum(weights[:i + 1]) for i in range(len(weights))]
+
+    def record(self, op, seconds, outcome):
+        with self.lock:
+            self.interval.record(op, seconds, outcome)
+            self.totals.record(op, seconds, outcome)
+
+    def snapshot(self):
+        """Stats since the previous snapshot"""
+        with self.lock:
+            snap, self.interval = self.interval, StatsTable()
+        return snap
+
+    def gauges(self):
+        return {
+            'backlog': self.arrivals.qsize() if self.arrivals is not None else 0,
+            'dropped': self.dropped,
+            'coalesced': SingleFlight.shared().joined,
+            'log_dropped': RunLog.shared().dropped,
+        }
+
+    def run_scenario(self, runner, name, rng=random):
+        workflow = self.workflows[name]
+        # Fresh idempotency scope per iteration: retries dedupe, iterations still create
+        runner.scope = uuid.uuid4().hex
+        # Setup ids come from the workflow's data source or the pool, outside the measured operations
+        pool = workflow.data or getattr(runner, 'fixtures', None)
+        if pool is not None:
+            runner.ids = pool.checkout()
+        # One budget for the whole chain: once spent, the remaining steps fail fast
+        runner.deadline = Deadline(self.plan.deadline) if self.plan.deadline else None
+        for step in workflow.steps:
+            start = time.perf_counter()
+            before = timed_out(runner)
+            try:
+                result = getattr(runner, step.op)(**step.args)
+                outcome = 'ok' if result else ('skipped' if result is None else 'failed')
+            except Exception:
+                outcome = 'error'
+            if outcome in ('failed', 'error') and timed_out(runner) > before:
+                outcome = 'timeout'
+            self.record(step.op, time.perf_counter() - start, outcome)
+            if outcome != 'ok':
+                break  # later steps depend on this one
+            if step.think is not None:
+                # Think time is neither measured nor charged to the deadline; a stopping run cuts it short
+                pause = step.think(rng)
+                self.stop_event.wait(pause)
+                if runner.deadline is not None:
+                    runner.deadline.extend(pause)
+
+    def virtual_user(self, runner):
+        rng = random.Random()
+        while not self.stop_event.is_set():
+            if self.arrivals is not None:
+                try:
+                    self.arrivals.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            name = rng.choices(self.names, cum_weights=self.cum_weights)[0]
+            self.run_scenario(runner, name, rng)
+
+    def schedule_arrivals(self):
+        rng = random.Random()
+        next_at = time.monotonic()
+        while not self.stop_event.is_set():
+            delay = next_at - time.monotonic()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            if self.arrivals.qsize() >= self.max_backlog:
+                self.dropped += 1
+            else:
+                self.arrivals.put(next_at)
+            next_at += rng.expovariate(self.plan.rate)
+
+    def run(self, start_in=0.0, on_tick=None, out=None):
+        """Run the plan; on_tick(tick, table, gauges) is called every second
+
+        Without on_tick, a live view is printed to `out`. Returns the
+        cumulative StatsTable.
+        """
+        out = out or sys.stdout
+        start_at = time.monotonic() + start_in
+        runners = self.prepare()
+        if start_at > time.monotonic():
+            time.sleep(start_at - time.monotonic())
+
+        with contextlib.ExitStack() as stack:
+            if self.quiet:
+                # The runners narrate every request; keep that off the live view (JSON logs go on)
+                stack.enter_context(RunLog.shared().silenced())
+
+            threads = [threading.Thread(target=self.virtual_user, args=(r,), daemon=True) for r in runners]
+            if self.arrivals is not None:
+                threads.append(threading.Thread(target=self.schedule_arrivals, daemon=True))
+            started = time.monotonic()
+            for t in threads:
+                t.start()
+
+            tick = 0
+            deadline = started + self.plan.duration
+            while True:
+                tick += 1
+                wake = min(started + tick, deadline)
+                stopped = self.stop_event.wait(max(0.0, wake - time.monotonic()))
+                if stopped or wake >= deadline:
+                    break
+                self.emit(tick, on_tick, out)
+
+            self.stop_event.set()
+            for t in threads:
+                t.join(timeout=30)
+            self.emit(tick, on_tick, out)
+        return self.totals
+
+    def prepare(self):
+        """Build every runner and the fixture pool; run() does it first unless it was done already
+
+        Call it before agreeing on a start time, so setup does not delay the start.
+        """
+        if self.runners is None:
+            # Up front, so configuration errors surface before the start
+            runners = [self.runner_factory() for _ in range(self.plan.vus)]
+            unknown = unknown_operations(runners[0], {s.op for w in self.workflows.values() for s in w.steps}) \
+                if runners else ()
+            if unknown:
+                raise ValueError(f"Unknown operation(s) in the plan: {', '.join(unknown)}")
+            if runners:
+                self.prepare_fixtures(runners)
+            self.runners = runners
+        return self.runners
+
+    def prepare_fixtures(self, runners):
+        """Attach one shared fixture pool to every runner, before the measured window"""
+        spec = self.plan.fixtures
+        if not spec or not hasattr(runners[0], 'ids'):
+            return None  # no pool asked for, or synthetic runners
+        pool = fixtures.prepare(self.runner_factory, int(spec.get('patients', self.plan.vus)),
+                                encounters=int(spec.get('encounters', 1)), order=spec.get('order', 'round-robin'),
+                                path=spec.get('file', fixtures.FIXTURES_FILE), runner=runners[0])
+        for runner in runners:
+            runner.fixtures = pool
+        return pool
+
+    def emit(self, tick, on_tick, out):
+        snap = self.snapshot()
+        if on_tick:
+            on_tick(tick, snap, self.gauges())
+        else:
+            print(format_tick(tick, snap, self.gauges()), file=out, flush=True)
+
+
+class SyntheticRunner:
+    """Stand-in for a TestRunner with simulated latencies
+
+    Lets the load and distributed modes be exercised on localhost without a
+    FHIR server.
+    """
+
+    LATENCY = {
+        'search_patients': 0.020,
+        'create_patient': 0.060,
+        'create_encounter': 0.050,
+        'create_vitals': 0.040,
+        'create_note': 0.045,
+        'create_medication': 0.040,
+        'create_observation': 0.040,
+        'create_appointment': 0.050,
+    }
+
+    def __init__(self, error_rate=0.01):
+        self.error_rate = error_rate
+        self.rng = random.Random()
+
+    def __getattr__(self, name):
+        if name not in self.LATENCY:
+            raise AttributeError(name)
+
+        def operation():
+            time.sleep(self.rng.lognormvariate(math.log(self.LATENCY[name]), 0.4))
+            return self.rng.random() >= self.error_rate
+        return operation
@@ -0,0 +1,155 @@
+"""
+Run Manifest
+1. Every resource a runner creates is appended to .fhir_runs/<run>.jsonl
+2. One file per process run, so concurrent runs never contend for a file
+3. read_manifests() / prune() let teardown drop what it has deleted; appends
+   and prunes share one lock file per runs directory, so a prune never loses
+   lines a running process appends meanwhile
+"""
+
+import json
+import os
+import threading
+import time
+
+from fhirkit.tokens import file_lock
+
+RUNS_DIR = '.fhir_runs'
+LOCK_NAME = '.lock'
+
+
+def created_id(resource_type, res):
+    """Server-assigned id of a create: response body first, then the Location header"""
+    try:
+        body = res.json() if res.text.strip() else {}
+    except ValueError:
+        body = {}
+    if isinstance(body, dict) and body.get('id'):
+        return str(body['id'])
+    parts = res.headers.get('Location', '').rstrip('/').split('/')
+    # .../Patient/123/_history/1 -> 123
+    for i in range(len(parts) - 1):
+        if parts[i] == resource_type and parts[i + 1]:
+            return parts[i + 1]
+    return parts[-1] if parts and parts[-1] else None
+
+
+def manifest_lock(path):
+    """Inter-process lock for the manifests in `path`'s directory"""
+    return file_lock(os.path.join(os.path.dirname(path) or '.', LOCK_NAME))
+
+
+class RunManifest:
+    """Append-only record of the resources created by one run"""
+
+    _open = {}
+    _open_lock = threading.Lock()
+
+    def __init__(self, path, fhir_url):
+        self.path = path
+        self.fhir_url = fhir_url
+        self.lock = threading.Lock()
+        self.count = 0
+
+    @classmethod
+    def open(cls, fhir_url, runs_dir=RUNS_DIR, run_id=None):
+        """Per-process manifest for `fhir_url`, shared by every runner in the process
+
+        runs_dir=None gives a manifest that only counts (e.g. during cassette replay).
+        """
+        if runs_dir is None:
+            return cls(None, fhir_url)
+        with cls._open_lock:
+            key = (os.path.abspath(runs_dir), fhir_url)
+            if key not in cls._open:
+                run_id = run_id or os.environ.get('FHIR_RUN_ID') or \
+                    f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+                cls._open[key] = cls(os.path.join(runs_dir, f"{run_id}.jsonl"), fhir_url)
+            return cls._open[key]
+
+    def record(self, resource_type, resource_id):
+        line = json.dumps({'type': resource_type, 'id': resource_id, 'url': self.fhir_url,
+                           'at': round(time.time(), 3)}) + '\n'
+        self.append(line, 1)
+
+    def record_many(self, resource_type, resource_ids):
+        """Record several ids of one type with a single append"""
+        now = round(time.time(), 3)
+        lines = ''.join(json.dumps({'type': resource_type, 'id': i, 'url': self.fhir_url, 'at': now}) + '\n'
+                        for i in resource_ids)
+        if not lines:
+            return
+        self.append(lines, len(resource_ids))
+
+    def append(self, lines, count):
+        with self.lock:
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with manifest_lock(self.path), open(self.path, 'a') as f:
+                    f.write(lines)
+            self.count += count
+
+    def forget(self, resource_type, resource_id):
+        """Drop an entry again, e.g. once its resource has been deleted"""
+        with self.lock:
+            if self.path:
+                prune(self.path, {(self.fhir_url, resource_type, resource_id)})
+            self.count -= 1
+
+    def record_response(self, resource_type, res):
+        """Record a successful create; returns the id (or None)"""
+        if not 200 <= res.status_code < 300:
+            return None
+        resource_id = created_id(resource_type, res)
+        if resource_id:
+            self.record(resource_type, resource_id)
+        return resource_id
+
+
+def read_manifests(runs_dir=RUNS_DIR, run_ids=None):
+    """{path: [entry, ...]} for every manifest (or just `run_ids`), skipping torn lines"""
+    manifests = {}
+    if not os.path.isdir(runs_dir):
+        return manifests
+    for name in sorted(os.listdir(runs_dir)):
+        if not name.endswith('.jsonl') or (run_ids and name[:-len('.jsonl')] not in run_ids):
+            continue
+        path = os.path.join(runs_dir, name)
+        manifests[path] = read_entries(path)
+    return manifests
+
+
+def read_entries(path):
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def prune(path, gone):
+    """Drop the entries whose (url, type, id) is in `gone` from a manifest, under the appenders' lock
+
+    The file is re-read under the lock, so lines appended since it was last
+    read are kept.
+    """
+    with manifest_lock(path):
+        if not os.path.exists(path):
+            return
+        rewrite(path, [e for e in read_entries(path) if (e.get('url'), e.get('type'), e.get('id')) not in gone])
+
+
+def rewrite(path, entries):
+    """Replace a manifest with the entries still left; remove it once empty (hold manifest_lock)"""
+    if not entries:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+    os.replace(tmp, path)
@@ -0,0 +1,215 @@
+"""
+Run Log
+1. Leveled logging for the runners: a call below the active level returns
+   at once, and messages are %-formatted later, by a background writer,
+   never on the request path
+2. Records go through a bounded queue; when it is full they are dropped
+   and counted instead of blocking a request
+3. Console lines as before, and/or JSON lines (FHIR_LOG=file, '-' for
+   stdout); request/response bodies are logged at DEBUG, and only for a
+   sample of requests (FHIR_LOG_SAMPLE)
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+NAMES = {v: k for k, v in LEVELS.items()}
+OFF = 100
+QUEUE_SIZE = 10000
+BODY_LIMIT = 4096
+RULE = 40
+
+
+def excerpt(body, limit=BODY_LIMIT):
+    """Printable start of a request/response body (None for streamed bodies)"""
+    if isinstance(body, (bytes, bytearray)):
+        body = bytes(body[:limit]).decode('utf-8', 'replace')
+    if not isinstance(body, str):
+        return None
+    return body[:limit] + ('...' if len(body) > limit else '')
+
+
+class RunLog:
+    """Process-wide log shared by every runner"""
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, level=INFO, path=None, sample=0.1, queue_size=QUEUE_SIZE, stream=None):
+        self.level = level
+        # Console lines go to sys.stdout (looked up at write time) unless FHIR_LOG is '-'
+        self.console = path != '-'
+        self.json_out = None
+        if path == '-':
+            self.json_out = stream or sys.stdout
+        elif path:
+            self.json_out = open(path, 'a', encoding='utf-8')
+        self.stream = stream
+        self.sample = sample
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.writer = None
+        self.quiet = 0
+
+    @classmethod
+    def shared(cls):
+        """The process's log, configured from FHIR_LOG_LEVEL, FHIR_LOG and FHIR_LOG_SAMPLE"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                level = os.environ.get('FHIR_LOG_LEVEL', 'info').lower()
+                if level not in LEVELS:
+                    raise ValueError(f"FHIR_LOG_LEVEL must be one of {', '.join(LEVELS)}, not {level!r}")
+                cls._shared = cls(LEVELS[level], os.environ.get('FHIR_LOG'),
+                                  float(os.environ.get('FHIR_LOG_SAMPLE', 0.1)))
+                atexit.register(cls._shared.flush)
+            return cls._shared
+
+    @property
+    def threshold(self):
+        """Lowest level anything is written at (OFF while only a silenced console is left)"""
+        return self.level if self.json_out is not None or (self.console and not self.quiet) else OFF
+
+    def enabled(self, level):
+        return level >= self.threshold
+
+    def log(self, level, msg, *args, **fields):
+        if level >= self.threshold:
+            self.put([time.time(), level, 'line', msg, args, fields])
+
+    def debug(self, msg, *args, **fields):
+        self.log(DEBUG, msg, *args, **fields)
+
+    def info(self, msg, *args, **fields):
+        self.log(INFO, msg, *args, **fields)
+
+    def warning(self, msg, *args, **fields):
+        self.log(WARNING, msg, *args, **fields)
+
+    def error(self, msg, *args, **fields):
+        self.log(ERROR, msg, *args, **fields)
+
+    def exception(self, msg, *args, **fields):
+        """ERROR with the current traceback"""
+        if ERROR >= self.threshold:
+            self.put([time.time(), ERROR, 'line', msg, args, dict(fields, traceback=traceback.format_exc())])
+
+    def section(self, title, *args, rule='-', width=RULE, level=INFO):
+        """Heading: a blank line, the title and a rule on the console; a plain record in JSON"""
+        if level >= self.threshold:
+            self.put([time.time(), level, 'section', title, args, {'rule': rule * width}])
+
+    def body(self, res):
+        """Headers and bodies of one request/response, at DEBUG, for a sample of requests"""
+        if DEBUG < self.threshold or random.random() >= self.sample:
+            return
+        request = res.request
+        # Only references are queued; the writer renders them
+        self.put([time.time(), DEBUG, 'body', None, (), {
+            'method': request.method, 'url': request.url, 'status': res.status_code,
+            'request_body': request.body, 'headers': res.headers, 'response_body': res.content}])
+
+    def put(self, record):
+        # Whether the console shows it is settled now, not when the writer gets to it
+        record.append(self.console and not self.quiet)
+        if self.writer is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def start(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_loop, name='runlog', daemon=True)
+                self.writer.start()
+
+    @contextlib.contextmanager
+    def silenced(self):
+        """Keep the console quiet (JSON output, if any, goes on)"""
+        with self.lock:
+            self.quiet += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.quiet -= 1
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far is written"""
+        if self.writer is None:
+            return True
+        done = threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def write_loop(self):
+        while True:
+            record = self.queue.get()
+            if isinstance(record, threading.Event):
+                for out in (sys.stdout, self.json_out):
+                    if out is not None:
+                        with contextlib.suppress(Exception):
+                            out.flush()
+                record.set()
+                continue
+            try:
+                self.write(record)
+            except Exception:  # a bad record must not stop the writer
+                pass
+
+    def write(self, record):
+        ts, level, kind, msg, args, fields, to_console = record
+        if kind == 'body':
+            text = self.render_body(fields)
+            fields = dict(fields, headers=dict(fields['headers']),
+                          request_body=excerpt(fields['request_body']),
+                          response_body=excerpt(fields['response_body']))
+            msg = f"{fields['method']} {fields['url']} -> {fields['status']}"
+        else:
+            try:
+                msg = msg % args if args else msg
+            except (TypeError, ValueError):
+                msg = ' '.join([str(msg)] + [str(a) for a in args])
+            if kind == 'section':
+                text, fields = f"\n{msg}\n{fields['rule']}", {}
+            elif 'traceback' in fields:
+                text = f"{msg}\n{fields['traceback'].rstrip()}"
+            else:
+                text = msg
+        if to_console and level >= self.level:
+            print(text, file=self.stream or sys.stdout)
+        if self.json_out is not None and level >= self.level:
+            line = dict(fields, ts=time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ts)) + f".{int(ts % 1 * 1000):03d}Z",
+                        level=NAMES[level], msg=msg)
+            self.json_out.write(json.dumps(line, default=str) + '\n')
+
+    @staticmethod
+    def render_body(fields):
+        lines = [f"DEBUG: {fields['method']} {fields['url']} -> {fields['status']}"]
+        request_body = excerpt(fields['request_body'])
+        if request_body:
+            lines.append(f"DEBUG: Request Body: {request_body}")
+        lines.append(f"DEBUG: Response Headers: {dict(fields['headers'])}")
+        body = fields['response_body']
+        if body:
+            try:
+                lines.append(f"DEBUG: Response Body: {json.dumps(json.loads(body), indent=2)[:BODY_LIMIT]}")
+            except ValueError:
+                lines.append(f"DEBUG: Response Body (non-JSON): {excerpt(body)}")
+        return '\n'.join(lines)
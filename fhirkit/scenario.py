@@ -0,0 +1,219 @@
+"""
+Scenario Files
+1. Declares a workload in JSON: weighted workflows built from the runner's
+   operations, think times between steps, data sources that seed
+   runner.ids, and assertions on the results
+2. Compiled once into Workflow/Step objects (think-time samplers, id pools,
+   checks) that the single run, the load generator and the distributed
+   workers walk without looking at the JSON again
+3. Data files are read at load time and travel inline in to_dict(), so
+   workers do not need a copy
+"""
+
+import copy
+import csv
+import json
+import math
+import os
+import re
+
+from fhirkit.fixtures import ORDERS, FixturePool
+
+THINK_TIMES = ('constant', 'uniform', 'exponential', 'lognormal')
+
+
+def think_time(spec):
+    """rng -> seconds for a think-time spec; None when there is no pause
+
+    2 (or {"constant": 2}), {"uniform": [1, 3]}, {"exponential": 2} (mean),
+    {"lognormal": [2, 0.5]} (median, sigma)
+    """
+    if not spec:
+        return None
+    if isinstance(spec, (int, float)):
+        spec = {'constant': spec}
+    if not isinstance(spec, dict) or len(spec) != 1 or next(iter(spec)) not in THINK_TIMES:
+        raise ValueError(f"Invalid think time {spec!r} (expected a number or one of {', '.join(THINK_TIMES)})")
+    (kind, value), = spec.items()
+    if kind == 'constant':
+        seconds = float(value)
+        return lambda rng: seconds
+    if kind == 'uniform':
+        low, high = (float(v) for v in value)
+        return lambda rng: rng.uniform(low, high)
+    if kind == 'exponential':
+        rate = 1 / float(value)
+        return lambda rng: rng.expovariate(rate)
+    median, sigma = (float(v) for v in value)
+    mu = math.log(median)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+def read_rows(path):
+    """Id sets from a CSV (header row), JSON list or NDJSON file, e.g. [{'patient': '12'}]"""
+    with open(path, 'r', newline='') as f:
+        if path.endswith('.csv'):
+            return [{k: v for k, v in row.items() if v} for row in csv.DictReader(f)]
+        if path.endswith(('.ndjson', '.jsonl')):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+class Step:
+    """One operation call: runner.<op>(**args), then an optional pause"""
+
+    __slots__ = ('op', 'args', 'think', 'label')
+
+    def __init__(self, op, args=None, think=None, label=None):
+        self.op = op
+        self.args = args or {}
+        self.think = think
+        self.label = label or op
+
+
+class Workflow:
+    """Named chain of steps, picked by weight; `data` seeds runner.ids for each iteration"""
+
+    def __init__(self, name, steps, weight=1.0, data=None):
+        self.name = name
+        self.steps = tuple(steps)
+        self.weight = weight
+        self.data = data
+
+    @classmethod
+    def of(cls, name, ops, weight=1.0):
+        """Workflow of bare operation names, without pauses"""
+        return cls(name, [Step(op) for op in ops], weight)
+
+
+class Check:
+    """Assertion on load results such as `create_vitals:p95<800` (ms), `total:error_rate<1` (%) or `total:rps>=20`"""
+
+    PATTERN = re.compile(r'^(\w+):(p\d+|mean|max|error_rate|rps)(<=|>=|<|>)([\d.]+)$')
+
+    def __init__(self, spec):
+        match = self.PATTERN.match(spec.replace(' ', ''))
+        if not match:
+            raise ValueError(f"Invalid assertion '{spec}' (expected e.g. search_patients:p95<500 or total:error_rate<1)")
+        self.spec = spec
+        self.name, self.metric, self.op, threshold = match.groups()
+        self.threshold = float(threshold)
+
+    def value(self, table, duration):
+        stats = table.overall() if self.name == 'total' else table.get(self.name)
+        if stats is None:
+            return None
+        if self.metric == 'rps':
+            return (stats.latency.count + stats.timeouts.count) / duration if duration else None
+        if self.metric == 'error_rate':
+            total = sum(stats.outcomes.values())
+            bad = stats.outcomes['failed'] + stats.outcomes['error'] + stats.outcomes['timeout']
+            return bad * 100 / total if total else None
+        if self.metric == 'mean':
+            seconds = stats.latency.mean()
+        elif self.metric == 'max':
+            seconds = stats.latency.max
+        else:
+            seconds = stats.latency.percentile(float(self.metric[1:]))
+        return seconds * 1000 if seconds is not None else None
+
+    def evaluate(self, table, duration):
+        """(met, value); an operation that never ran does not meet anything"""
+        value = self.value(table, duration)
+        if value is None:
+            return False, None
+        return {
+            '<': value < self.threshold,
+            '<=': value <= self.threshold,
+            '>': value > self.threshold,
+            '>=': value >= self.threshold,
+        }[self.op], value
+
+    def unit(self):
+        return {'error_rate': '%', 'rps': ' req/s'}.get(self.metric, 'ms')
+
+
+class Scenario:
+    """A compiled scenario file"""
+
+    def __init__(self, spec, base_dir=None):
+        spec = copy.deepcopy(spec)
+        if not spec.get('workflows'):
+            raise ValueError("Scenario has no workflows")
+        default_think = spec.get('think')
+        self.data = {}
+        for name, source in (spec.get('data') or {}).items():
+            if 'rows' not in source and 'file' not in source:
+                raise ValueError(f"Data source '{name}' needs a \"file\" or \"rows\"")
+            if 'rows' not in source:
+                path = source['file']
+                source['rows'] = read_rows(path if os.path.isabs(path) else os.path.join(base_dir or '.', path))
+                del source['file']
+            order = source.get('order', 'round-robin')
+            if order not in ORDERS:
+                raise ValueError(f"Data source '{name}': unknown order '{order}' (expected one of {', '.join(ORDERS)})")
+            self.data[name] = FixturePool(source['rows'], order=order)
+        self.workflows = {}
+        for name, workflow in spec['workflows'].items():
+            if isinstance(workflow, list):
+                workflow = {'steps': workflow}
+            if workflow.get('data') and workflow['data'] not in self.data:
+                raise ValueError(f"Workflow '{name}': unknown data source '{workflow['data']}'")
+            think = workflow.get('think', default_think)
+            steps = []
+            for step in workflow.get('steps') or []:
+                if isinstance(step, str):
+                    step = {'op': step}
+                if not step.get('op'):
+                    raise ValueError(f"Workflow '{name}': step {step!r} has no \"op\"")
+                steps.append(Step(step['op'], step.get('args'), think_time(step.get('think', think)), step.get('label')))
+            if not steps:
+                raise ValueError(f"Workflow '{name}' has no steps")
+            weight = float(workflow.get('weight', 1))
+            self.workflows[name] = Workflow(name, steps, weight, self.data.get(workflow.get('data')))
+        self.checks = [Check(text) for text in spec.get('assert') or []]
+        self.spec = spec
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls(json.load(f), base_dir=os.path.dirname(os.path.abspath(path)))
+
+    def to_dict(self):
+        """The spec with data files inlined; Scenario(to_dict()) compiles to the same thing anywhere"""
+        return copy.deepcopy(self.spec)
+
+    def mix(self):
+        return {name: workflow.weight for name, workflow in self.workflows.items() if workflow.weight > 0}
+
+    def operations(self):
+        return {step.op for workflow in self.workflows.values() for step in workflow.steps}
+
+    def sequence(self):
+        """Every step once, in file order, with the ids each workflow starts from on its first step (else None)
+
+        Those are the data source's next id set, or {} for a workflow without one.
+        """
+        for workflow in self.workflows.values():
+            for i, step in enumerate(workflow.steps):
+                if i:
+                    yield step, None
+                else:
+                    yield step, workflow.data.checkout() if workflow.data is not None else {}
+
+    def evaluate(self, table, duration):
+        """[(check, met, value)] for the assertions"""
+        return [(check,) + check.evaluate(table, duration) for check in self.checks]
+
+
+def unknown_operations(runner, ops):
+    """Names in `ops` that are not operations of `runner`"""
+    return sorted(op for op in ops if op.startswith('_') or not callable(getattr(runner, op, None)))
+
+
+def format_checks(results):
+    lines = ["Assertions:"]
+    for check, met, value in results:
+        shown = f"{value:.2f}{check.unit()}" if value is not None else "no samples"
+        lines.append(f"  {'✅' if met else '❌'} {check.spec} (actual {shown})")
+    return "\n".join(lines)
@@ -0,0 +1,144 @@
+"""
+Projection-aware Search
+1. _elements / _summary=true|count ask the server for less, and gzip is
+   negotiated explicitly
+2. Results come back as small __slots__ records holding only the projected
+   elements (one generated class per resource type + projection), not
+   full resource dicts
+3. Every search reports bytes on the wire vs decoded, and whether the
+   server honoured the projection and the compression
+"""
+
+import json
+import time
+
+import requests
+
+_record_types = {}
+
+
+def record_type(resource_type, fields):
+    """__slots__ class for one projection; created once and reused"""
+    key = (resource_type, fields)
+    if key not in _record_types:
+        def __init__(self, *values):
+            for name, value in zip(fields, values):
+                setattr(self, name, value)
+
+        def __repr__(self):
+            return f"{resource_type}(" + ", ".join(f"{f}={getattr(self, f)!r}" for f in fields) + ")"
+
+        def to_dict(self):
+            return {f: getattr(self, f) for f in fields if getattr(self, f) is not None}
+
+        _record_types[key] = type(f"{resource_type}Record", (), {
+            '__slots__': fields, '__init__': __init__, '__repr__': __repr__, 'to_dict': to_dict,
+            'resource_type': resource_type, 'fields': fields,
+        })
+    return _record_types[key]
+
+
+def display_name(names):
+    """'Given Family' from a list of HumanName elements"""
+    for name in names or ():
+        text = name.get('text') or ' '.join(name.get('given', []) + [name.get('family', '')]).strip()
+        if text:
+            return text
+    return ''
+
+
+class SearchResult:
+    def __init__(self, resource_type, records, total, wire_bytes, decoded_bytes, elapsed, pages,
+                 compressed, projected, next_url=None):
+        self.resource_type = resource_type
+        self.records = records
+        self.total = total
+        self.wire_bytes = wire_bytes
+        self.decoded_bytes = decoded_bytes
+        self.elapsed = elapsed
+        self.pages = pages
+        self.compressed = compressed
+        self.projected = projected
+        self.next_url = next_url
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def describe(self):
+        ratio = self.decoded_bytes / self.wire_bytes if self.wire_bytes else 0
+        notes = []
+        if not self.compressed:
+            notes.append("server did not compress")
+        if not self.projected:
+            notes.append("server ignored _elements; projected client-side")
+        total = self.total if self.total is not None else '?'
+        return (f"{self.resource_type}: {len(self.records)} record(s), total {total}, "
+                f"{self.pages} page(s), {self.wire_bytes:,} B on the wire / {self.decoded_bytes:,} B decoded "
+                f"({ratio:.1f}x), {self.elapsed * 1000:.0f} ms" + (f" [{'; '.join(notes)}]" if notes else ""))
+
+
+class Search:
+    """Searches through a runner's session (token refresh, timeouts and replay included)"""
+
+    def __init__(self, runner):
+        self.runner = runner
+        self.store = getattr(runner, 'store', None)
+
+    def get(self, url, params=None):
+        headers = dict(self.runner.get_headers(), **{'Accept': 'application/fhir+json', 'Accept-Encoding': 'gzip'})
+        res = self.runner.session.get(url, params=params, headers=headers, stream=True)
+        content = res.content
+        # Compressed bytes read off the socket (replayed responses have no raw stream)
+        wire = (res.raw.tell() if hasattr(res.raw, 'tell') else 0) or len(content)
+        if res.status_code != 200:
+            raise requests.exceptions.HTTPError(f"{res.status_code} searching {url}: {res.text[:200]}", response=res)
+        return res, json.loads(content), wire, len(content)
+
+    def count(self, resource_type, params=None):
+        """Matching resources without fetching any (_summary=count)"""
+        _, bundle, _, _ = self.get(f"{self.runner.fhir_url}/{resource_type}", dict(params or {}, _summary='count'))
+        return bundle.get('total')
+
+    def search(self, resource_type, elements=None, summary=None, params=None, pages=1, count=None):
+        """Projected search; `elements` like ['name', 'birthDate'] (id is always included)
+
+        summary='true' asks for the summary view; records then carry the
+        elements named in `elements`, or just id when none are given.
+        """
+        fields = ('id',) + tuple(e for e in (elements or ()) if e != 'id')
+        query = dict(params or {})
+        if elements:
+            query['_elements'] = ','.join(fields[1:])
+        if summary:
+            query['_summary'] = summary
+        if count:
+            query['_count'] = count
+        cls = record_type(resource_type, fields)
+
+        records, total, wire, decoded, compressed, projected = [], None, 0, 0, True, True
+        url, page = f"{self.runner.fhir_url}/{resource_type}", 0
+        start = time.perf_counter()
+        while url and page < pages:
+            res, bundle, page_wire, page_decoded = self.get(url, query if page == 0 else None)
+            page += 1
+            wire += page_wire
+            decoded += page_decoded
+            compressed = compressed and 'gzip' in res.headers.get('Content-Encoding', '')
+            if total is None:
+                total = bundle.get('total')
+            if self.store is not None and not elements and not summary:
+                self.store.put_bundle(bundle)  # full resources only, never projections
+            for entry in bundle.get('entry', []):
+                resource = entry.get('resource') or {}
+                if resource.get('resourceType', resource_type) != resource_type:
+                    continue  # _include'd or OperationOutcome entries
+                if elements and projected and any(k not in fields and k not in ('resourceType', 'meta')
+                                                  for k in resource):
+                    projected = False
+                records.append(cls(*[resource.get(f) for f in fields]))
+            url = next((link['url'] for link in bundle.get('link', []) if link.get('relation') == 'next'), None)
+        return SearchResult(resource_type, records, total, wire, decoded, time.perf_counter() - start, page,
+                            compressed, projected, next_url=url)
@@ -0,0 +1,119 @@
+"""
+Single-Flight GETs
+1. Concurrent identical GETs (same URL, query, token and Accept) from any
+   runner in the process share one HTTP call: the first sends it, the
+   others wait for its response and get their own copy of it; the body is
+   parsed once, and every caller's .json() returns that one (read-only) value
+2. Nothing is cached: an entry lives only while its request is in flight,
+   and a write sent through a shared session in the meantime starts a new
+   epoch, so a GET issued after a write never joins a call sent before it
+3. Counts sent vs joined requests for a coalescing ratio
+"""
+
+import copy
+import threading
+
+
+class Call:
+    __slots__ = ('epoch', 'done', 'response', 'error', 'parse', 'parsed', 'lock')
+
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.parse = None
+        self.parsed = None
+        self.lock = threading.Lock()
+
+    def settle(self, response):
+        """Keep the leader's response; its .json() now parses once for every caller"""
+        self.response = response
+        self.parse = response.json
+        response.json = self.json
+
+    def json(self, **kwargs):
+        """The body parsed on first use and shared from then on (callers must not modify it)"""
+        if kwargs:
+            return self.parse(**kwargs)
+        with self.lock:
+            if self.parsed is None:
+                self.parsed = self.parse()
+            return self.parsed
+
+
+def share(call):
+    """A copy of the call's (fully read) response for one more caller"""
+    clone = copy.copy(call.response)
+    clone.headers = copy.copy(call.response.headers)
+    clone.json = call.json
+    return clone
+
+
+class SingleFlight:
+    """Table of in-flight GETs, shared by every session of the process"""
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.epoch = 0
+        self.sent = 0
+        self.joined = 0
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def key(url, headers):
+        return (url, headers.get('Authorization'), headers.get('Accept'), headers.get('Prefer'))
+
+    def wrote(self):
+        """A write went out: calls already in flight may not reflect it"""
+        with self.lock:
+            self.epoch += 1
+
+    def do(self, key, send, wait_timeout=None):
+        """send() once for every concurrent caller with the same key; TimeoutError if the wait runs out"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None or call.epoch != self.epoch
+            if leader:
+                call = self.calls[key] = Call(self.epoch)
+                self.sent += 1
+            else:
+                self.joined += 1
+        if leader:
+            try:
+                call.settle(send())
+                call.response.content  # read it all before anyone else touches it
+                return call.response
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self.lock:
+                    if self.calls.get(key) is call:
+                        del self.calls[key]
+                call.done.set()
+        if not call.done.wait(wait_timeout):
+            raise TimeoutError("timed out waiting for a coalesced request")
+        if call.error is not None:
+            raise call.error
+        return share(call)
+
+    @property
+    def ratio(self):
+        """Share of GETs answered by another caller's request"""
+        total = self.sent + self.joined
+        return self.joined / total if total else 0.0
+
+    def describe(self):
+        return (f"Single-flight: {self.sent} GET(s) sent, {self.joined} joined an identical one in flight "
+                f"({self.ratio * 100:.1f}% coalesced)")
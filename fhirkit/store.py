@@ -0,0 +1,300 @@
+"""
+Local Resource Store
+1. Keeps every resource the client creates or fully reads as a compact
+   record keyed by type/id (the parsed resource plus the indexed fields),
+   sized by what the parsed resource occupies in memory
+2. Secondary indexes on subject, encounter, code and effective date, and a
+   reverse-reference graph, answer patient-scoped, code, date-range and
+   "what points here" queries locally
+3. LRU eviction keeps the store under a memory budget; ResourceStore.shared()
+   is the one store (and budget) every runner in the process uses
+"""
+
+import bisect
+import copy
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from fhirkit.graph import parse_reference, references
+
+DEFAULT_BUDGET = 32 * 1024 * 1024
+RECORD_OVERHEAD = 400  # record object, index entries and dict slots, roughly
+
+# Where each type keeps its clinically relevant date
+EFFECTIVE_FIELDS = ('effectiveDateTime', 'effectivePeriod.start', 'effectiveInstant', 'issued', 'period.start',
+                    'authoredOn', 'date', 'start', 'occurrenceDateTime', 'recordedDate')
+CODE_FIELDS = ('code', 'type', 'medicationCodeableConcept', 'vaccineCode')
+
+
+def first(resource, path):
+    value = resource
+    for part in path.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def subject_of(resource):
+    """'Patient/123' the resource is about, if any"""
+    for field in ('subject', 'patient'):
+        ref = parse_reference((resource.get(field) or {}).get('reference'))
+        if ref:
+            return '/'.join(ref)
+    for participant in resource.get('participant', []):  # Appointment
+        ref = parse_reference((participant.get('actor') or {}).get('reference'))
+        if ref and ref[0] == 'Patient':
+            return '/'.join(ref)
+    return None
+
+
+def encounter_of(resource):
+    ref = parse_reference((resource.get('encounter') or {}).get('reference'))
+    if not ref:
+        encounters = (resource.get('context') or {}).get('encounter') or [{}]  # DocumentReference
+        ref = parse_reference(encounters[0].get('reference'))
+    return '/'.join(ref) if ref else None
+
+
+def codes_of(resource):
+    """('system|code', ...) from the resource's code-like elements"""
+    codes = []
+    for field in CODE_FIELDS:
+        concepts = resource.get(field)
+        for concept in concepts if isinstance(concepts, list) else [concepts]:
+            for coding in (concept or {}).get('coding', []) if isinstance(concept, dict) else ():
+                if coding.get('code'):
+                    codes.append(f"{coding.get('system', '')}|{coding['code']}")
+    return tuple(codes)
+
+
+def deep_size(value):
+    """Bytes held by a parsed JSON value: containers, strings and numbers
+
+    Dict keys are left out; json.loads shares them across a document.
+    """
+    size, stack = 0, [value]
+    while stack:
+        item = stack.pop()
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return size
+
+
+def effective_of(resource):
+    for path in EFFECTIVE_FIELDS:
+        value = first(resource, path)
+        if isinstance(value, str):
+            return value
+    return None
+
+
+class Record:
+    """One stored resource: indexed fields plus the parsed resource, copied on demand"""
+
+    __slots__ = ('type', 'id', 'subject', 'encounter', 'codes', 'effective', 'refs', 'data', 'size')
+
+    def __init__(self, resource):
+        self.type = resource['resourceType']
+        self.id = str(resource['id'])
+        self.subject = subject_of(resource)
+        self.encounter = encounter_of(resource)
+        self.codes = codes_of(resource)
+        self.effective = effective_of(resource)
+        self.refs = tuple({'/'.join(ref) for ref in (parse_reference(r) for _, r in references(resource)) if ref})
+        self.data = resource
+        self.size = deep_size(resource) + RECORD_OVERHEAD
+
+    @property
+    def key(self):
+        return f"{self.type}/{self.id}"
+
+    @property
+    def resource(self):
+        """A copy, so callers cannot edit what the other runners see"""
+        return copy.deepcopy(self.data)
+
+    def __repr__(self):
+        return f"<Record {self.key}>"
+
+
+class ResourceStore:
+    """Thread-safe store of Records; queries return Records, most recent first where dated"""
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_bytes=DEFAULT_BUDGET):
+        self.max_bytes = max_bytes
+        self.records = OrderedDict()  # 'Type/id' -> Record, least recently used first
+        self.by_subject = {}
+        self.by_encounter = {}
+        self.by_code = {}
+        self.referrers = {}  # 'Type/id' -> {'Type/id' of resources referencing it}
+        self.dates = []  # sorted (effective, key)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    @classmethod
+    def shared(cls):
+        """The process's store, with a budget of FHIR_STORE_MB (0 turns it off)"""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(int(float(os.environ.get('FHIR_STORE_MB', DEFAULT_BUDGET / 1024 / 1024))
+                                      * 1024 * 1024))
+            return cls._shared
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    # Filling
+
+    def put(self, resource):
+        """Store (or replace) a full resource; ignored without resourceType and id"""
+        if self.max_bytes <= 0:
+            return None
+        if not isinstance(resource, dict) or not resource.get('resourceType') or not resource.get('id'):
+            return None
+        if resource['resourceType'] in ('Bundle', 'OperationOutcome'):
+            return None
+        record = Record(resource)
+        with self.lock:
+            self._remove(record.key)
+            self._index(record)
+            self._evict()
+        return record
+
+    def put_bundle(self, bundle):
+        """Every resource of a searchset / batch-response Bundle; returns how many were stored"""
+        stored = 0
+        for entry in (bundle or {}).get('entry', []):
+            resource = entry.get('resource') or {}
+            if resource.get('resourceType') == 'Bundle':
+                stored += self.put_bundle(resource)
+            elif self.put(resource) is not None:
+                stored += 1
+        return stored
+
+    def _index(self, record):
+        key = record.key
+        self.records[key] = record
+        self.bytes += record.size
+        if record.subject:
+            self.by_subject.setdefault(record.subject, set()).add(key)
+        if record.encounter:
+            self.by_encounter.setdefault(record.encounter, set()).add(key)
+        for code in record.codes:
+            self.by_code.setdefault(code, set()).add(key)
+            self.by_code.setdefault(code.split('|', 1)[1], set()).add(key)
+        for target in record.refs:
+            self.referrers.setdefault(target, set()).add(key)
+        if record.effective:
+            bisect.insort(self.dates, (record.effective, key))
+
+    def _remove(self, key):
+        record = self.records.pop(key, None)
+        if record is None:
+            return
+        self.bytes -= record.size
+        for index, value in ((self.by_subject, record.subject), (self.by_encounter, record.encounter)):
+            if value:
+                self._discard(index, value, key)
+        for code in record.codes:
+            self._discard(self.by_code, code, key)
+            self._discard(self.by_code, code.split('|', 1)[1], key)
+        for target in record.refs:
+            self._discard(self.referrers, target, key)
+        if record.effective:
+            i = bisect.bisect_left(self.dates, (record.effective, key))
+            if i < len(self.dates) and self.dates[i] == (record.effective, key):
+                del self.dates[i]
+
+    @staticmethod
+    def _discard(index, value, key):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and len(self.records) > 1:
+            self._remove(next(iter(self.records)))
+            self.evictions += 1
+
+    def remove(self, resource_type, resource_id):
+        with self.lock:
+            self._remove(f"{resource_type}/{resource_id}")
+
+    # Queries
+
+    def get(self, resource_type, resource_id):
+        """Record or None; a hit counts as a use for LRU"""
+        key = f"{resource_type}/{resource_id}"
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self.records.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def resolve(self, reference):
+        """Record a reference points at ('Patient/1', absolute or versioned), or None"""
+        ref = parse_reference(reference)
+        return self.get(*ref) if ref else None
+
+    def _records(self, keys, resource_type=None):
+        records = [self.records[k] for k in keys if k in self.records]
+        if resource_type:
+            records = [r for r in records if r.type == resource_type]
+        return sorted(records, key=lambda r: r.effective or '', reverse=True)
+
+    def referencing(self, resource_type, resource_id, by_type=None):
+        """Records that reference Type/id (reverse graph), e.g. an encounter's observations"""
+        with self.lock:
+            return self._records(self.referrers.get(f"{resource_type}/{resource_id}", ()), by_type)
+
+    def for_patient(self, patient_id, resource_type=None):
+        with self.lock:
+            return self._records(self.by_subject.get(f"Patient/{patient_id}", ()), resource_type)
+
+    def for_encounter(self, encounter_id, resource_type=None):
+        with self.lock:
+            return self._records(self.by_encounter.get(f"Encounter/{encounter_id}", ()), resource_type)
+
+    def with_code(self, code, system=None, resource_type=None):
+        """By bare code ('8867-4') or system and code"""
+        with self.lock:
+            return self._records(self.by_code.get(f"{system}|{code}" if system else code, ()), resource_type)
+
+    def between(self, start=None, end=None, resource_type=None, patient_id=None):
+        """Dated records with start <= effective < end
+
+        Dates compare as ISO strings, so '2024-01' covers the whole month as a
+        start and excludes it as an end.
+        """
+        with self.lock:
+            lo = bisect.bisect_left(self.dates, (start,)) if start else 0
+            hi = bisect.bisect_left(self.dates, (end,)) if end else len(self.dates)
+            keys = [key for _, key in self.dates[lo:hi]]
+            if patient_id:
+                keys = [k for k in keys if self.records[k].subject == f"Patient/{patient_id}"]
+            return self._records(keys, resource_type)
+
+    def describe(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            rate = f", {self.hits / lookups * 100:.0f}% hit rate" if lookups else ""
+            return (f"Store: {len(self.records)} resource(s), {self.bytes / 1024:.0f} KB of "
+                    f"{self.max_bytes / 1024 / 1024:.3g} MB{rate}, {self.evictions} evicted")
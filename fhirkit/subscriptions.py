@@ -0,0 +1,457 @@
+"""
+Subscription Change Feed
+1. Registers rest-hook Subscriptions for the resource types to watch: R4
+   criteria ("Encounter?") or, on R5 servers declaring SubscriptionTopic,
+   topic-based ones; they point at a local receiver
+2. The receiver is an asyncio HTTP server (keep-alive, no thread per
+   notification) that deduplicates notifications by resource version and
+   hands the resources to a bounded queue drained by consumer tasks
+3. On startup, changes missed while it was not listening are replayed with
+   `_lastUpdated` searches from the saved high-water mark; notifications
+   without a payload trigger the same catch-up (or a read of the focus)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import requests
+
+from fhirkit.integrity import stream
+
+SUBSCRIPTIONS_FILE = '.fhir_subscriptions.json'
+MODES = ('auto', 'criteria', 'topic')
+CHANNEL_TYPE = {"system": "http://terminology.hl7.org/CodeSystem/subscription-channel-type", "code": "rest-hook"}
+MAX_BODY = 50 * 1024 * 1024
+DEDUP_SIZE = 100000  # recent resource versions remembered
+STATUS_TYPES = ('SubscriptionStatus', 'Parameters')  # R4B/R5 status, R4 backport status
+
+
+def utc_now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def version_key(resource):
+    """'Type/id/version' identifying one change of a resource"""
+    meta = resource.get('meta') or {}
+    version = meta.get('versionId') or meta.get('lastUpdated') or \
+        hashlib.sha1(json.dumps(resource, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"{resource.get('resourceType')}/{resource.get('id')}/{version}"
+
+
+def parse_notification(data, path=''):
+    """(resources, [(type, id or None)] to fetch) from one notification
+
+    Handles R4 rest-hook (the resource itself, or an empty ping whose path
+    may end in /Type/id), and R4B/R5 notification Bundles whose status
+    entry lists focus references when the content is id-only.
+    """
+    if not data:
+        parts = [p for p in urlparse(path).path.split('/') if p]
+        if len(parts) >= 2 and parts[-2][:1].isupper():
+            return [], [(parts[-2], parts[-1])]
+        return [], [(parts[-1], None)] if parts and parts[-1][:1].isupper() else [(None, None)]
+    if data.get('resourceType') != 'Bundle':
+        return [data], []
+    resources, focus = [], []
+    for entry in data.get('entry', []):
+        resource = entry.get('resource')
+        if not resource:
+            if entry.get('fullUrl') and '/' in entry['fullUrl']:
+                focus.append(tuple(entry['fullUrl'].rstrip('/').split('/')[-2:]))
+            continue
+        if resource.get('resourceType') in STATUS_TYPES:
+            for event in resource.get('notificationEvent', []):
+                ref = (event.get('focus') or {}).get('reference', '')
+                if '/' in ref:
+                    focus.append(tuple(ref.rstrip('/').split('/')[-2:]))
+            continue
+        resources.append(resource)
+    return resources, ([] if resources else focus)
+
+
+class SubscriptionManager:
+    """Creates / deletes the Subscriptions and keeps the replay high-water mark"""
+
+    def __init__(self, runner, types, endpoint, mode='auto', secret=None, state_file=SUBSCRIPTIONS_FILE):
+        if mode not in MODES:
+            raise ValueError(f"Unknown subscription mode '{mode}' (expected one of {', '.join(MODES)})")
+        self.runner = runner
+        self.types = list(types)
+        self.endpoint = endpoint
+        self.secret = secret or secrets.token_urlsafe(24)
+        self.state_file = state_file
+        self.caps = runner.capabilities
+        self.mode = mode if mode != 'auto' else (
+            'topic' if str(self.caps.fhir_version or '').startswith('5') and
+            self.caps.supports('SubscriptionTopic', 'search-type') else 'criteria')
+        self.created = []
+        state = self.read_state()
+        self.since = state.get('since')
+        self.started_at = None
+
+    def read_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f).get(self.runner.fhir_url, {})
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def save_state(self, since):
+        if not self.state_file:
+            return
+        data = {}
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+        data[self.runner.fhir_url] = {'since': since, 'types': self.types, 'saved_at': round(time.time(), 3)}
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.state_file)
+
+    def topic_for(self, resource_type):
+        """Canonical URL of a SubscriptionTopic triggered by `resource_type`, or None"""
+        res = self.runner.session.get(f"{self.runner.fhir_url}/SubscriptionTopic",
+                                      params={'resource': resource_type}, headers=self.runner.get_headers())
+        if res.status_code != 200:
+            return None
+        for entry in res.json().get('entry', []):
+            topic = entry.get('resource') or {}
+            triggers = [t.get('resource', '') for t in topic.get('resourceTrigger', [])]
+            if topic.get('url') and any(t == resource_type or t.endswith(f"/{resource_type}") for t in triggers):
+                return topic['url']
+        return None
+
+    def subscription(self, resource_type):
+        """Subscription body for one type, or None when the server offers no way to watch it"""
+        header = [f"Authorization: Bearer {self.secret}"]
+        if self.mode == 'topic':
+            topic = self.topic_for(resource_type)
+            if not topic:
+                return None
+            return {"resourceType": "Subscription", "status": "requested", "reason": "fhirkit change feed",
+                    "topic": topic, "channelType": CHANNEL_TYPE, "endpoint": self.endpoint, "header": header,
+                    "heartbeatPeriod": 60, "content": "full-resource", "contentType": "application/fhir+json"}
+        return {"resourceType": "Subscription", "status": "requested", "reason": "fhirkit change feed",
+                "criteria": f"{resource_type}?",
+                "channel": {"type": "rest-hook", "endpoint": self.endpoint, "payload": "application/fhir+json",
+                            "header": header}}
+
+    def register(self):
+        """Create one Subscription per type; returns the types being watched"""
+        self.started_at = utc_now()
+        if self.runner.unsupported('Subscription', 'create', 'Subscriptions'):
+            return []
+        watched = []
+        for resource_type in self.types:
+            body = self.subscription(resource_type)
+            if body is None:
+                print(f"⚠️  No SubscriptionTopic for {resource_type}; relying on replay only")
+                continue
+            res = self.runner.session.post(f"{self.runner.fhir_url}/Subscription", json=body,
+                                           headers=self.runner.get_headers())
+            subscription_id = self.runner.manifest.record_response('Subscription', res)
+            if not subscription_id:
+                print(f"❌ Subscription for {resource_type} failed with status {res.status_code}: {res.text[:200]}")
+                continue
+            self.created.append(subscription_id)
+            watched.append(resource_type)
+            print(f"✅ Subscription/{subscription_id}: {resource_type} ({self.mode}) -> {self.endpoint}")
+        return watched
+
+    def unregister(self):
+        for subscription_id in self.created:
+            try:
+                self.runner.session.delete(f"{self.runner.fhir_url}/Subscription/{subscription_id}",
+                                           headers=self.runner.get_headers())
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  Could not delete Subscription/{subscription_id}: {e}")
+        self.created = []
+
+    def changed_since(self, resource_type, since, page_size=200):
+        """Every resource of a type updated at or after `since`, oldest first"""
+        params = {'_lastUpdated': f"ge{since}", '_sort': '_lastUpdated'}
+        return list(stream(self.runner, resource_type, page_size, elements=None, params=params))
+
+    def read(self, resource_type, resource_id):
+        res = self.runner.session.get(f"{self.runner.fhir_url}/{resource_type}/{resource_id}",
+                                      headers=self.runner.get_headers())
+        return [res.json()] if res.status_code == 200 else []
+
+
+class ChangeFeed:
+    """asyncio receiver: notifications in, deduplicated resources out to `handler(resource, source)`"""
+
+    def __init__(self, manager, handler, host='127.0.0.1', port=9700, queue_size=10000, consumers=4,
+                 progress=5.0):
+        self.manager = manager
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.consumers = consumers
+        self.progress = progress
+        self.seen = OrderedDict()
+        self.mark = manager.since  # newest meta.lastUpdated processed
+        self.pending = {}  # meta.lastUpdated -> resources queued but not processed yet
+        self.failed = {}  # version key -> meta.lastUpdated of resources the handler failed on
+        self.catching_up = {}  # type -> True while a catch-up runs (set again when more pings arrive)
+        self.stats = {'notifications': 0, 'received': 0, 'duplicates': 0, 'processed': 0, 'replayed': 0,
+                      'pings': 0, 'rejected': 0, 'errors': 0}
+        self.queue = None
+        self.start = None
+        self.background = set()  # fetch tasks, referenced until done
+        self.connections = set()
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        """One connection: requests are read until the client closes it"""
+        self.connections.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await self.read_body(reader, headers)
+                if body is None:
+                    status, payload = 413, b''
+                else:
+                    status, payload = await self.dispatch(method, path, headers, body)
+                reason = {200: 'OK', 401: 'Unauthorized', 400: 'Bad Request', 413: 'Payload Too Large'}.get(status, '')
+                writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode('latin-1') + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close' or body is None:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def read_body(reader, headers):
+        """Request body (Content-Length or chunked); None when it is over MAX_BODY"""
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            parts, size = [], 0
+            while True:
+                length = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                if length == 0:
+                    await reader.readline()
+                    return b''.join(parts)
+                size += length
+                if size > MAX_BODY:
+                    return None
+                parts.append(await reader.readexactly(length))
+                await reader.readexactly(2)
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_BODY:
+            return None
+        return await reader.readexactly(length) if length else b''
+
+    async def dispatch(self, method, path, headers, body):
+        if headers.get('authorization') != f"Bearer {self.manager.secret}":
+            self.stats['rejected'] += 1
+            return 401, b''
+        if method == 'GET':
+            return 200, json.dumps(dict(self.stats, queued=self.queue.qsize(), mark=self.mark,
+                                        saved_mark=self.safe_mark(), failed=len(self.failed))).encode('utf-8')
+        self.stats['notifications'] += 1
+        try:
+            data = json.loads(body) if body.strip() else None
+        except ValueError:
+            self.stats['errors'] += 1
+            return 400, b''
+        resources, fetch = parse_notification(data, path)
+        for resource in resources:
+            await self.offer(resource, 'notify')
+        for resource_type, resource_id in fetch:
+            self.stats['pings'] += 1
+            self.fetch_later(resource_type, resource_id)
+        return 200, b''
+
+    # Dedup and queue
+
+    async def offer(self, resource, source):
+        """Queue a resource unless this version was already seen (waits while the queue is full)"""
+        if not isinstance(resource, dict) or not resource.get('id'):
+            return False
+        self.stats['received'] += 1
+        key = version_key(resource)
+        if key in self.seen:
+            self.stats['duplicates'] += 1
+            return False
+        self.seen[key] = None
+        if len(self.seen) > DEDUP_SIZE:
+            self.seen.popitem(last=False)
+        updated = (resource.get('meta') or {}).get('lastUpdated')
+        if updated:
+            self.pending[updated] = self.pending.get(updated, 0) + 1
+        await self.queue.put((resource, source))
+        return True
+
+    async def consume(self):
+        while True:
+            resource, source = await self.queue.get()
+            updated = (resource.get('meta') or {}).get('lastUpdated')
+            key = version_key(resource)
+            try:
+                self.handler(resource, source)
+                if updated and (self.mark is None or updated > self.mark):
+                    self.mark = updated
+                self.failed.pop(key, None)
+                self.stats['processed'] += 1
+            except Exception as e:  # a bad resource must not stop the feed
+                self.stats['errors'] += 1
+                print(f"⚠️  Handler failed for {resource.get('resourceType')}/{resource.get('id')}: {e}")
+                # Pins the saved mark, and a later delivery of this version is tried again
+                if updated:
+                    self.failed[key] = updated
+                self.seen.pop(key, None)
+            finally:
+                if updated:
+                    self.pending[updated] -= 1
+                    if not self.pending[updated]:
+                        del self.pending[updated]
+                self.queue.task_done()
+
+    def safe_mark(self):
+        """High-water mark to persist: everything changed before it has been processed
+
+        The oldest lastUpdated still queued or failed in the handler while
+        there is any, else the newest processed; a restart replays from there
+        (`ge`, so at least once, and failed resources are retried).
+        """
+        held = list(self.pending) + list(self.failed.values())
+        return min(held) if held else self.mark
+
+    # Catch-up
+
+    def fetch_later(self, resource_type, resource_id):
+        if resource_id:
+            self.spawn(self.fetch(self.manager.read, resource_type, resource_id))
+            return
+        for watched in [resource_type] if resource_type in self.manager.types else self.manager.types:
+            if watched in self.catching_up:
+                self.catching_up[watched] = True  # the running catch-up goes round once more
+            else:
+                self.catching_up[watched] = False
+                self.spawn(self.catch_up(watched))
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    async def fetch(self, function, *args, source='ping'):
+        try:
+            resources = await asyncio.to_thread(function, *args)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.stats['errors'] += 1
+            print(f"⚠️  Fetch failed ({args[0]}): {e}")
+            return 0
+        for resource in resources:
+            await self.offer(resource, source)
+        return len(resources)
+
+    async def catch_up(self, resource_type, source='ping'):
+        """_lastUpdated search from the mark, repeated while pings keep arriving"""
+        try:
+            while True:
+                since = self.mark or self.manager.started_at or utc_now()
+                await self.fetch(self.manager.changed_since, resource_type, since, source=source)
+                if not self.catching_up.get(resource_type):
+                    break
+                self.catching_up[resource_type] = False
+        finally:
+            self.catching_up.pop(resource_type, None)
+
+    async def replay(self):
+        """Changes made while nothing was listening, from the saved mark"""
+        if not self.manager.since:
+            print("⏭️  Nothing to replay: no saved high-water mark yet")
+            return
+        for resource_type in self.manager.types:
+            count = await self.fetch(self.manager.changed_since, resource_type, self.manager.since, source='replay')
+            self.stats['replayed'] += count
+            print(f"♻️  Replayed {count} {resource_type} change(s) since {self.manager.since}")
+
+    # Running
+
+    def describe(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        s = self.stats
+        return (f"{elapsed:5.1f}s: {s['received']} received ({s['received'] / elapsed:.0f}/s), "
+                f"{s['duplicates']} duplicate(s), {s['processed']} processed, queue {self.queue.qsize()}")
+
+    async def tick(self):
+        while True:
+            await asyncio.sleep(self.progress)
+            print(f"📨 {self.describe()}")
+            await asyncio.to_thread(self.manager.save_state, self.safe_mark() or self.manager.started_at)
+
+    async def main(self, duration=None, replay=False):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.start = time.perf_counter()
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        tasks = [asyncio.ensure_future(self.consume()) for _ in range(self.consumers)]
+        print(f"👂 Listening on http://{self.host}:{self.port}/ for notifications")
+        try:
+            watched = await asyncio.to_thread(self.manager.register)
+            if replay:
+                await self.replay()
+            if not watched:
+                print("⚠️  No Subscription registered: only pings and replay will bring changes in")
+            if self.progress:
+                tasks.append(asyncio.ensure_future(self.tick()))
+            if duration:
+                await asyncio.sleep(duration)
+            else:
+                await asyncio.Event().wait()
+        finally:
+            server.close()
+            for writer in list(self.connections):  # idle keep-alive connections end their handlers
+                writer.close()
+            await server.wait_closed()
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=10)
+            except asyncio.TimeoutError:
+                print(f"⚠️  {self.queue.qsize()} queued resource(s) left unprocessed")
+            for task in tasks:
+                task.cancel()
+
+    def run(self, duration=None, replay=False, keep=False):
+        """Listen until `duration` elapses or Ctrl-C; the Subscriptions are deleted afterwards unless `keep`"""
+        try:
+            asyncio.run(self.main(duration, replay))
+        except KeyboardInterrupt:
+            print("\n👋 Stopping change feed")
+        finally:
+            if not keep:
+                self.manager.unregister()
+            if self.manager.started_at:  # not when it never got to listen
+                self.manager.save_state(self.safe_mark() or self.manager.started_at)
+        print(f"✅ {self.describe()}, {self.stats['replayed']} replayed, {self.stats['pings']} ping(s), "
+              f"{self.stats['rejected']} rejected")
+        return self.stats
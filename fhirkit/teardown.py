@@ -0,0 +1,130 @@
+"""
+Bulk Teardown
+1. Collects created ids from the run manifests for one server
+2. Deletes them in reverse dependency order (MedicationRequest ... Patient),
+   one resource type at a time so nothing is deleted while still referenced
+3. Within a type, batch Bundles of DELETEs (or plain DELETEs where the server
+   has no batch support) are sent concurrently
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fhirkit.deadline import resize_pool
+from fhirkit.manifest import RUNS_DIR, prune, read_manifests
+
+# Creation order of the resources the runners make; teardown walks it backwards
+DEPENDENCY_ORDER = ['Binary', 'Patient', 'Encounter', 'Appointment', 'Observation', 'DocumentReference', 'MedicationRequest']
+
+
+def delete_order(resource_types):
+    """Unknown types first (assumed to reference something), then DEPENDENCY_ORDER reversed"""
+    known = [t for t in reversed(DEPENDENCY_ORDER) if t in resource_types]
+    return sorted(set(resource_types) - set(known)) + known
+
+
+def gone(status):
+    """Deleted now, or already gone"""
+    return 200 <= status < 300 or status in (404, 410)
+
+
+class Teardown:
+    def __init__(self, runner, workers=8, batch_size=50, use_batch=True, timeout=30, out=print):
+        self.runner = runner
+        self.workers = workers
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.out = out
+        caps = runner.capabilities
+        self.use_batch = use_batch and caps.supports_system('batch')
+        # One pooled connection per worker (a cassette's adapter is left alone)
+        resize_pool(runner.session, runner.fhir_url, workers)
+
+    def delete_one(self, resource_type, resource_id):
+        try:
+            res = self.runner.session.delete(f"{self.runner.fhir_url}/{resource_type}/{resource_id}",
+                                             headers=self.runner.get_headers(), timeout=self.timeout)
+            return gone(res.status_code)
+        except requests.exceptions.RequestException:
+            return False
+
+    def delete_batch(self, resource_type, ids):
+        """Set of ids the server reports deleted; falls back to single DELETEs if the batch fails"""
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "batch",
+            "entry": [{"request": {"method": "DELETE", "url": f"{resource_type}/{i}"}} for i in ids],
+        }
+        try:
+            res = self.runner.session.post(self.runner.fhir_url, json=bundle, headers=self.runner.get_headers(),
+                                           timeout=self.timeout)
+            entries = res.json().get('entry', []) if res.status_code == 200 else []
+        except (requests.exceptions.RequestException, ValueError):
+            entries = []
+        if len(entries) != len(ids):
+            return {i for i in ids if self.delete_one(resource_type, i)}
+        deleted = set()
+        for resource_id, entry in zip(ids, entries):
+            status = str(entry.get('response', {}).get('status', '0')).split(' ')[0]
+            if status.isdigit() and gone(int(status)):
+                deleted.add(resource_id)
+        return deleted
+
+    def delete_type(self, resource_type, ids, pool):
+        if self.use_batch:
+            chunks = [ids[i:i + self.batch_size] for i in range(0, len(ids), self.batch_size)]
+            deleted = set()
+            for part in pool.map(lambda chunk: self.delete_batch(resource_type, chunk), chunks):
+                deleted |= part
+            return deleted
+        results = pool.map(lambda i: (i, self.delete_one(resource_type, i)), ids)
+        return {i for i, ok in results if ok}
+
+    def run(self, entries):
+        """Delete every entry; returns the set of (type, id) now gone"""
+        by_type = {}
+        for entry in entries:
+            by_type.setdefault(entry['type'], {})[entry['id']] = None  # ordered, duplicates dropped in O(1)
+        by_type = {resource_type: list(ids) for resource_type, ids in by_type.items()}
+
+        done = set()
+        total_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for resource_type in delete_order(by_type):
+                ids = by_type[resource_type]
+                if not self.runner.capabilities.supports(resource_type, 'delete'):
+                    self.out(f"⏭️  {resource_type}: server does not declare 'delete'; {len(ids)} kept")
+                    continue
+                start = time.perf_counter()
+                deleted = self.delete_type(resource_type, ids, pool)
+                done.update((resource_type, i) for i in deleted)
+                failed = len(ids) - len(deleted)
+                self.out(f"{'✅' if not failed else '⚠️ '} {resource_type}: {len(deleted)} deleted, {failed} failed "
+                         f"({'batch' if self.use_batch else 'parallel'}, {time.perf_counter() - start:.1f}s)")
+
+        elapsed = time.perf_counter() - total_start
+        self.out(f"🧹 {len(done)} resources removed in {elapsed:.1f}s ({len(done) / elapsed if elapsed else 0:.0f}/s)")
+        return done
+
+
+def teardown(runner, runs_dir=RUNS_DIR, run_ids=None, dry_run=False, **options):
+    """Delete what the manifests recorded for runner.fhir_url, then prune the manifests"""
+    manifests = read_manifests(runs_dir, run_ids)
+    mine = {path: [e for e in entries if e.get('url') == runner.fhir_url] for path, entries in manifests.items()}
+    entries = [e for path_entries in mine.values() for e in path_entries]
+    print(f"🧹 {len(entries)} resources recorded across {len(mine)} run manifest(s) for {runner.fhir_url}")
+    if dry_run or not entries:
+        counts = {}
+        for e in entries:
+            counts[e['type']] = counts.get(e['type'], 0) + 1
+        for resource_type in delete_order(counts):
+            print(f"  {resource_type}: {counts[resource_type]}")
+        return 0
+
+    done = Teardown(runner, **options).run(entries)
+    gone = {(runner.fhir_url, resource_type, resource_id) for resource_type, resource_id in done}
+    for path in mine:
+        prune(path, gone)
+    return 0 if len(done) == len({(e['type'], e['id']) for e in entries}) else 1
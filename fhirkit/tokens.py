@@ -0,0 +1,282 @@
+"""
+Shared Token Store
+Keeps the access token consistent across every process working from the
+same .env file:
+1. .env updates are merged and swapped in atomically under a lock file
+2. The current token lives in a small memory-mapped record (.env.token)
+   with a generation counter, so readers notice a new token without
+   re-reading any file
+3. Only one process refreshes at a time; the others wait on the lock and
+   reuse the token it obtained
+4. A failed refresh is recorded with a backoff: until it passes, everyone
+   keeps serving the still-valid token, and afterwards only the first lock
+   holder tries again
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Record layout: generation (odd while being written), expires_at, token length, token bytes
+HEADER = struct.Struct('<QdI')
+TOKEN_OFFSET = 24
+RECORD_SIZE = 16384
+# Last failed refresh at the end of the record: retry not before, consecutive failures
+FAILURE = struct.Struct('<dI')
+FAILURE_OFFSET = RECORD_SIZE - 16
+BACKOFF = 5
+MAX_BACKOFF = 300
+
+
+def read_env(path='.env'):
+    """Parse a KEY=VALUE file into a dict (missing file -> empty dict)"""
+    env = {}
+    if not os.path.exists(path):
+        return env
+    with open(path, 'r') as f:
+        for line in f:
+            if '=' in line:
+                key, val = line.strip().split('=', 1)
+                env[key] = val
+    return env
+
+
+def write_env_atomic(path, env):
+    """Write a complete .env through a temp file and os.replace"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.env.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write("".join(f"{k}={'' if v is None else v}\n" for k, v in env.items()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive inter-process lock held on `path` for the duration of the block"""
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def update_env(path, values):
+    """Merge `values` into the .env at `path` under the shared lock"""
+    with file_lock(path + '.lock'):
+        env = read_env(path)
+        env.update(values)
+        write_env_atomic(path, env)
+        return env
+
+
+def refresh_grant(token_url, client_id, client_secret=None, timeout=30):
+    """Build a refresher that redeems a refresh token at `token_url`"""
+    def refresher(refresh_token):
+        payload = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": client_id,
+        }
+        if client_secret:
+            payload["client_secret"] = client_secret
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        res = requests.post(token_url, data=payload, headers=headers, verify=False, timeout=timeout)
+        if res.status_code != 200:
+            print(f"❌ Token refresh failed with status {res.status_code}")
+            return None
+        return res.json()
+    return refresher
+
+
+class TokenStore:
+    """Access token shared by every process using the same .env
+
+    Use TokenStore.open() so all runners in a process share one instance.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, env_path='.env', refresher=None, margin=30):
+        self.env_path = env_path
+        self.lock_path = env_path + '.lock'
+        self.record_path = env_path + '.token'
+        self.refresher = refresher
+        self.margin = margin
+        self.thread_lock = threading.Lock()
+        self.env_token = read_env(env_path).get('ACCESS_TOKEN')
+
+        with file_lock(self.lock_path):
+            fd = os.open(self.record_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < RECORD_SIZE:
+                    os.ftruncate(fd, RECORD_SIZE)
+                self.map = mmap.mmap(fd, RECORD_SIZE)
+            finally:
+                os.close(fd)
+
+        self.seen = None
+        self.cached = (None, 0.0)
+        self.retry_at = 0.0
+        self.failures = 0
+
+    @classmethod
+    def open(cls, env_path='.env', refresher=None):
+        key = os.path.abspath(env_path)
+        with cls._instances_lock:
+            store = cls._instances.get(key)
+            if store is None:
+                store = cls._instances[key] = cls(env_path, refresher)
+            elif refresher is not None:
+                store.refresher = refresher
+            return store
+
+    def generation(self):
+        return struct.unpack_from('<Q', self.map, 0)[0]
+
+    def read_record(self):
+        """Consistent (generation, token, expires_at) snapshot of the record"""
+        while True:
+            gen = self.generation()
+            if gen & 1:
+                time.sleep(0)  # writer in progress
+                continue
+            _, expires_at, length = HEADER.unpack_from(self.map, 0)
+            token = bytes(self.map[TOKEN_OFFSET:TOKEN_OFFSET + length]).decode('utf-8')
+            retry_at, failures = FAILURE.unpack_from(self.map, FAILURE_OFFSET)
+            if self.generation() == gen:
+                return gen, token, expires_at, retry_at, failures
+
+    def current(self):
+        """Latest published token and its expiry; re-reads only when the generation moved"""
+        gen = self.generation()
+        if gen != self.seen:
+            gen, token, expires_at, self.retry_at, self.failures = self.read_record()
+            self.cached = (token, expires_at) if gen and token else (self.env_token, 0.0)
+            self.seen = gen
+        return self.cached
+
+    def backing_off(self):
+        """True while a failed refresh's backoff has not passed yet"""
+        self.current()
+        return time.time() < self.retry_at
+
+    def token(self):
+        """Access token to use now, refreshed first if it is about to expire
+
+        After a failed refresh the current token is served, without taking
+        the lock, until the backoff recorded in the shared record passes.
+        """
+        token, expires_at = self.current()
+        if expires_at and self.refresher and time.time() > expires_at - self.margin:
+            if self.backing_off():
+                return token
+            return self.refresh(stale_token=token) or token
+        return token
+
+    def publish(self, access_token, expires_in=None, refresh_token=None, extra=None):
+        """Store a new token in the record and .env (auth scripts call this after login)"""
+        with self.thread_lock, file_lock(self.lock_path):
+            self._publish_locked(access_token, expires_in, refresh_token, extra)
+
+    def _publish_locked(self, access_token, expires_in, refresh_token=None, extra=None):
+        data = access_token.encode('utf-8')
+        if TOKEN_OFFSET + len(data) > FAILURE_OFFSET:
+            raise ValueError("Access token too large for the shared token record")
+        expires_at = time.time() + float(expires_in) if expires_in else 0.0
+
+        gen = self.generation()
+        struct.pack_into('<Q', self.map, 0, gen + 1)  # odd: readers retry
+        self.map[TOKEN_OFFSET:TOKEN_OFFSET + len(data)] = data
+        struct.pack_into('<dI', self.map, 8, expires_at, len(data))
+        FAILURE.pack_into(self.map, FAILURE_OFFSET, 0.0, 0)
+        struct.pack_into('<Q', self.map, 0, gen + 2)
+        self.map.flush()
+
+        values = dict(extra or {})
+        values['ACCESS_TOKEN'] = access_token
+        if refresh_token is not None:
+            values['REFRESH_TOKEN'] = refresh_token
+        env = read_env(self.env_path)
+        env.update(values)
+        write_env_atomic(self.env_path, env)
+        self.env_token = access_token
+
+    def refresh(self, stale_token=None):
+        """Refresh the access token; returns the new token or None
+
+        Callers pass the token that stopped working. Whoever gets the lock
+        first refreshes; everyone queued behind it finds a different token
+        already published and returns that instead of refreshing again.
+        If that refresh failed, they find its backoff instead and return None.
+        """
+        if not self.refresher:
+            return None
+        with self.thread_lock, file_lock(self.lock_path):
+            token, _ = self.current()
+            if stale_token is not None and token and token != stale_token:
+                return token
+            if self.backing_off():
+                return None
+
+            refresh_token = read_env(self.env_path).get('REFRESH_TOKEN')
+            if not refresh_token:
+                return None
+            try:
+                data = self.refresher(refresh_token)
+            except requests.exceptions.RequestException as e:
+                print(f"❌ Token refresh failed: {e}")
+                data = None
+            if not data or not data.get('access_token'):
+                self._record_failure_locked()
+                return None
+            self._publish_locked(data['access_token'], data.get('expires_in'),
+                                 data.get('refresh_token') or refresh_token)
+            self.current()
+            return data['access_token']
+
+    def _record_failure_locked(self):
+        """Publish a failed refresh: retry after an exponential backoff"""
+        self.current()
+        failures = self.failures + 1
+        delay = min(MAX_BACKOFF, BACKOFF * 2 ** (failures - 1))
+        gen = self.generation()
+        struct.pack_into('<Q', self.map, 0, gen + 1)
+        FAILURE.pack_into(self.map, FAILURE_OFFSET, time.time() + delay, failures)
+        struct.pack_into('<Q', self.map, 0, gen + 2)
+        self.map.flush()
+        self.current()
+        print(f"⚠️  Token refresh failed {failures} time(s); retrying in {delay}s, keeping the current token meanwhile")
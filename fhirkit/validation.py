@@ -0,0 +1,396 @@
+"""
+Pre-send FHIR Validation
+1. Compact structure definitions and required value-set bindings for the
+   resource types the scripts create
+2. Compiled once into nested checker closures (no per-call spec lookups)
+3. Fixes known-safe problems in place (missing LOINC system, UCUM code
+   missing from a quantity) and rejects the rest locally with a 422, so
+   doomed payloads never cost a server round-trip
+4. Elements the compact definitions do not list (e.g. Observation.valueInteger)
+   are only warned about and left for the server to judge
+"""
+
+import json
+import re
+import threading
+
+import requests
+
+LOINC = 'http://loinc.org'
+UCUM = 'http://unitsofmeasure.org'
+
+# UCUM code -> human-readable unit, plus common spellings that map onto a code
+UCUM_UNITS = {
+    'mm[Hg]': 'mmHg', 'mmHg': 'mmHg', '/min': '/min', 'kg': 'kg', 'g': 'g', 'cm': 'cm', 'm': 'm',
+    'Cel': 'C', '[degF]': 'F', '%': '%', 'kg/m2': 'kg/m2', 'mg': 'mg', 'mL': 'mL', 'mg/dL': 'mg/dL',
+}
+UCUM_ALIASES = {'mmHg': 'mm[Hg]', 'bpm': '/min', 'beats/min': '/min', 'C': 'Cel', 'F': '[degF]'}
+LOINC_CODE = re.compile(r'^\d{1,7}-\d$')
+
+VALUE_SETS = {
+    'administrative-gender': {'male', 'female', 'other', 'unknown'},
+    'observation-status': {'registered', 'preliminary', 'final', 'amended', 'corrected', 'cancelled',
+                           'entered-in-error', 'unknown'},
+    'encounter-status': {'planned', 'arrived', 'triaged', 'in-progress', 'onleave', 'finished', 'cancelled',
+                         'entered-in-error', 'unknown'},
+    'appointment-status': {'proposed', 'pending', 'booked', 'arrived', 'fulfilled', 'cancelled', 'noshow',
+                           'entered-in-error', 'checked-in', 'waitlist'},
+    'participation-status': {'accepted', 'declined', 'tentative', 'needs-action'},
+    'medicationrequest-status': {'active', 'on-hold', 'cancelled', 'completed', 'entered-in-error', 'stopped',
+                                 'draft', 'unknown'},
+    'medicationrequest-intent': {'proposal', 'plan', 'order', 'original-order', 'reflex-order', 'filler-order',
+                                 'instance-order', 'option'},
+    'document-reference-status': {'current', 'superseded', 'entered-in-error'},
+    'composition-status': {'preliminary', 'final', 'amended', 'entered-in-error'},
+    'name-use': {'usual', 'official', 'temp', 'nickname', 'anonymous', 'old', 'maiden'},
+    'contact-point-system': {'phone', 'fax', 'email', 'pager', 'url', 'sms', 'other'},
+    'contact-point-use': {'home', 'work', 'temp', 'old', 'mobile'},
+    'quantity-comparator': {'<', '<=', '>=', '>'},
+}
+
+
+def el(type_name, min=0, max=1, binding=None, targets=None, elements=None):
+    """Element definition: type, cardinality and optional binding/reference targets"""
+    return {'type': type_name, 'min': min, 'max': max, 'binding': binding, 'targets': targets,
+            'elements': elements}
+
+
+# -- data types
+
+DATATYPES = {
+    'Coding': {
+        'system': el('uri'), 'version': el('string'), 'code': el('code'), 'display': el('string'),
+        'userSelected': el('boolean'),
+    },
+    'CodeableConcept': {'coding': el('Coding', max='*'), 'text': el('string')},
+    'Quantity': {
+        'value': el('decimal'), 'comparator': el('code', binding='quantity-comparator'), 'unit': el('string'),
+        'system': el('uri'), 'code': el('code'),
+    },
+    'Reference': {'reference': el('string'), 'type': el('uri'), 'identifier': el('Identifier'),
+                  'display': el('string')},
+    'Period': {'start': el('dateTime'), 'end': el('dateTime')},
+    'Identifier': {'use': el('code'), 'type': el('CodeableConcept'), 'system': el('uri'), 'value': el('string'),
+                   'period': el('Period'), 'assigner': el('Reference')},
+    'HumanName': {'use': el('code', binding='name-use'), 'text': el('string'), 'family': el('string'),
+                  'given': el('string', max='*'), 'prefix': el('string', max='*'),
+                  'suffix': el('string', max='*'), 'period': el('Period')},
+    'ContactPoint': {'system': el('code', binding='contact-point-system'), 'value': el('string'),
+                     'use': el('code', binding='contact-point-use'), 'rank': el('positiveInt'),
+                     'period': el('Period')},
+    'Address': {'use': el('code'), 'type': el('code'), 'text': el('string'), 'line': el('string', max='*'),
+                'city': el('string'), 'district': el('string'), 'state': el('string'),
+                'postalCode': el('string'), 'country': el('string'), 'period': el('Period')},
+    'Attachment': {'contentType': el('code'), 'language': el('code'), 'data': el('base64Binary'),
+                   'url': el('uri'), 'size': el('unsignedInt'), 'hash': el('base64Binary'),
+                   'title': el('string'), 'creation': el('dateTime')},
+    'Annotation': {'authorString': el('string'), 'authorReference': el('Reference'), 'time': el('dateTime'),
+                   'text': el('string', min=1)},
+}
+
+COMMON = {'identifier': el('Identifier', max='*')}
+
+PROFILES = {
+    'Patient': dict(COMMON, **{
+        'active': el('boolean'), 'name': el('HumanName', max='*'), 'telecom': el('ContactPoint', max='*'),
+        'gender': el('code', binding='administrative-gender'), 'birthDate': el('date'),
+        'deceasedBoolean': el('boolean'), 'address': el('Address', max='*'),
+        'managingOrganization': el('Reference', targets=['Organization']),
+    }),
+    'Encounter': dict(COMMON, **{
+        'status': el('code', min=1, binding='encounter-status'), 'class': el('Coding', min=1),
+        'type': el('CodeableConcept', max='*'), 'subject': el('Reference', targets=['Patient', 'Group']),
+        'period': el('Period'), 'reasonCode': el('CodeableConcept', max='*'),
+        'participant': el('any', max='*'), 'serviceProvider': el('Reference', targets=['Organization']),
+    }),
+    'Observation': dict(COMMON, **{
+        'status': el('code', min=1, binding='observation-status'), 'category': el('CodeableConcept', max='*'),
+        'code': el('CodeableConcept', min=1), 'subject': el('Reference', targets=['Patient', 'Group']),
+        'encounter': el('Reference', targets=['Encounter']), 'effectiveDateTime': el('dateTime'),
+        'issued': el('instant'), 'valueQuantity': el('Quantity'), 'valueString': el('string'),
+        'valueCodeableConcept': el('CodeableConcept'), 'interpretation': el('CodeableConcept', max='*'),
+        'note': el('Annotation', max='*'),
+        'component': el('BackboneElement', max='*', elements={
+            'code': el('CodeableConcept', min=1), 'valueQuantity': el('Quantity'), 'valueString': el('string'),
+            'valueCodeableConcept': el('CodeableConcept'), 'interpretation': el('CodeableConcept', max='*'),
+        }),
+    }),
+    'DocumentReference': dict(COMMON, **{
+        'status': el('code', min=1, binding='document-reference-status'),
+        'docStatus': el('code', binding='composition-status'), 'type': el('CodeableConcept'),
+        'category': el('CodeableConcept', max='*'), 'subject': el('Reference', targets=['Patient', 'Group']),
+        'date': el('instant'), 'author': el('Reference', max='*'), 'description': el('string'),
+        'content': el('BackboneElement', min=1, max='*', elements={
+            'attachment': el('Attachment', min=1), 'format': el('Coding'),
+        }),
+        'context': el('BackboneElement', elements={
+            'encounter': el('Reference', max='*', targets=['Encounter', 'EpisodeOfCare']), 'period': el('Period'),
+        }),
+    }),
+    'MedicationRequest': dict(COMMON, **{
+        'status': el('code', min=1, binding='medicationrequest-status'),
+        'intent': el('code', min=1, binding='medicationrequest-intent'),
+        'medicationCodeableConcept': el('CodeableConcept'),
+        'medicationReference': el('Reference', targets=['Medication']),
+        'subject': el('Reference', min=1, targets=['Patient', 'Group']),
+        'encounter': el('Reference', targets=['Encounter']), 'authoredOn': el('dateTime'),
+        'requester': el('Reference'), 'dosageInstruction': el('any', max='*'), 'note': el('Annotation', max='*'),
+    }),
+    'Appointment': dict(COMMON, **{
+        'status': el('code', min=1, binding='appointment-status'),
+        'serviceCategory': el('CodeableConcept', max='*'), 'serviceType': el('CodeableConcept', max='*'),
+        'description': el('string'), 'start': el('instant'), 'end': el('instant'),
+        'minutesDuration': el('positiveInt'),
+        'participant': el('BackboneElement', min=1, max='*', elements={
+            'actor': el('Reference'), 'status': el('code', min=1, binding='participation-status'),
+            'type': el('CodeableConcept', max='*'), 'required': el('code'),
+        }),
+    }),
+}
+
+# Elements every resource / element may carry without being listed
+ALWAYS_ALLOWED = frozenset(['resourceType', 'id', 'meta', 'text', 'extension', 'modifierExtension',
+                            'implicitRules', 'language', 'contained'])
+
+PRIMITIVES = {
+    'string': lambda v: isinstance(v, str) and v != '',
+    'code': re.compile(r'^[^\s]+(\s[^\s]+)*$').match,
+    'uri': re.compile(r'^\S+$').match,
+    'date': re.compile(r'^\d{4}(-\d{2}(-\d{2})?)?$').match,
+    'dateTime': re.compile(r'^\d{4}(-\d{2}(-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:\d{2}))?)?)?$').match,
+    'instant': re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})$').match,
+    'base64Binary': lambda v: len(v) % 4 == 0 and BASE64.match(v) is not None,
+    'boolean': lambda v: isinstance(v, bool),
+    'decimal': lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    'positiveInt': lambda v: isinstance(v, int) and not isinstance(v, bool) and v > 0,
+    'unsignedInt': lambda v: isinstance(v, int) and not isinstance(v, bool) and v >= 0,
+}
+STRING_PRIMITIVES = {'code', 'uri', 'date', 'dateTime', 'instant', 'base64Binary'}
+BASE64 = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+REFERENCE = re.compile(r'^(([A-Z][A-Za-z]+)/[A-Za-z0-9\-.]{1,64}(/_history/[A-Za-z0-9\-.]{1,64})?'
+                       r'|https?://\S+|urn:(uuid|oid):\S+|#\S*)$')
+
+
+class ValidationReport:
+    def __init__(self):
+        self.errors = []
+        self.fixes = []
+        self.warnings = []
+
+    def error(self, path, message):
+        self.errors.append((path, message))
+
+    def fixed(self, path, message):
+        self.fixes.append((path, message))
+
+    def warn(self, path, message):
+        self.warnings.append((path, message))
+
+    def to_operation_outcome(self):
+        return {
+            "resourceType": "OperationOutcome",
+            "issue": [{"severity": "error", "code": "invalid", "diagnostics": message, "expression": [path]}
+                      for path, message in self.errors],
+        }
+
+
+# -- extra rules for data types: rule(value, path, report, fix)
+
+def coding_rule(value, path, report, fix):
+    if 'code' in value and 'system' not in value:
+        if fix and LOINC_CODE.match(str(value['code'])):
+            value['system'] = LOINC
+            report.fixed(path, f"added system {LOINC} for LOINC-shaped code {value['code']}")
+        else:
+            report.error(path, f"coding '{value['code']}' has no system")
+
+
+def quantity_rule(value, path, report, fix):
+    unit, system, code = value.get('unit'), value.get('system'), value.get('code')
+    if system == UCUM and code is None:
+        mapped = unit if unit in UCUM_UNITS and unit not in UCUM_ALIASES else UCUM_ALIASES.get(unit)
+        if fix and mapped:
+            value['code'] = mapped
+            value['unit'] = UCUM_UNITS.get(mapped, unit)
+            report.fixed(path, f"UCUM quantity given code '{mapped}' (unit '{unit}')")
+        else:
+            report.error(path, f"UCUM quantity with unit '{unit}' has no code")
+    elif system is None and code is None and unit is not None:
+        mapped = UCUM_ALIASES.get(unit) or (unit if unit in UCUM_UNITS else None)
+        if fix and mapped:
+            value['system'] = UCUM
+            value['code'] = mapped
+            report.fixed(path, f"unit '{unit}' coded as UCUM '{mapped}'")
+    elif code is not None and system is None:
+        report.error(path, "quantity has a code but no system")
+
+
+def period_rule(value, path, report, fix):
+    start, end = value.get('start'), value.get('end')
+    if isinstance(start, str) and isinstance(end, str) and len(start) == len(end) and end < start:
+        report.error(path, "period ends before it starts")
+
+
+TYPE_RULES = {'Coding': [coding_rule], 'Quantity': [quantity_rule], 'Period': [period_rule]}
+
+
+# -- compiler
+
+def compile_primitive(type_name, binding):
+    test = PRIMITIVES[type_name]
+    is_string = type_name in STRING_PRIMITIVES
+    allowed = VALUE_SETS[binding] if binding else None
+
+    def check(value, path, report, fix):
+        if is_string and not isinstance(value, str):
+            report.error(path, f"expected {type_name} string, got {type(value).__name__}")
+        elif not test(value):
+            report.error(path, f"invalid {type_name} {value!r}")
+        elif allowed is not None and value not in allowed:
+            report.error(path, f"'{value}' is not in value set {binding}")
+    return check
+
+
+def compile_reference(targets, base):
+    allowed = set(targets or ())
+
+    def check(value, path, report, fix):
+        base(value, path, report, fix)
+        ref = value.get('reference') if isinstance(value, dict) else None
+        if not isinstance(ref, str):
+            return
+        match = REFERENCE.match(ref)
+        if not match:
+            report.error(path, f"malformed reference '{ref}'")
+        elif allowed and match.group(2) and match.group(2) not in allowed:
+            report.error(path, f"reference to {match.group(2)}, expected {'/'.join(sorted(allowed))}")
+    return check
+
+
+def compile_complex(type_name, elements, compiled):
+    fields = {}
+    required = []
+    for name, spec in elements.items():
+        fields[name] = compile_field(name, spec, compiled)
+        if spec['min']:
+            required.append(name)
+    rules = TYPE_RULES.get(type_name, ())
+
+    def check(value, path, report, fix):
+        if not isinstance(value, dict):
+            report.error(path, f"expected {type_name} object")
+            return
+        for key, item in value.items():
+            field = fields.get(key)
+            if field is not None:
+                field(item, f"{path}.{key}", report, fix)
+            elif key not in ALWAYS_ALLOWED:
+                # The tables are not the full spec: let the server decide
+                report.warn(f"{path}.{key}", f"element not in the local definition of {type_name}, not checked")
+        for name in required:
+            if name not in value:
+                report.error(f"{path}.{name}", "required element missing")
+        for rule in rules:
+            rule(value, path, report, fix)
+    return check
+
+
+def compile_type(type_name, compiled, binding=None, elements=None):
+    if type_name == 'any':
+        return lambda value, path, report, fix: None
+    if type_name in PRIMITIVES:
+        return compile_primitive(type_name, binding)
+    if elements is not None:  # inline BackboneElement
+        return compile_complex(type_name, elements, compiled)
+    if type_name not in compiled:
+        # Placeholder first, so recursive types (Identifier <-> Reference) resolve lazily
+        compiled[type_name] = lambda value, path, report, fix: compiled['_' + type_name](value, path, report, fix)
+        compiled['_' + type_name] = compile_complex(type_name, DATATYPES[type_name], compiled)
+    return compiled[type_name]
+
+
+def compile_field(name, spec, compiled):
+    check_one = compile_type(spec['type'], compiled, spec['binding'], spec['elements'])
+    if spec['type'] == 'Reference':
+        check_one = compile_reference(spec['targets'], check_one)
+    repeating = spec['max'] == '*'
+
+    if repeating:
+        def check(value, path, report, fix):
+            if not isinstance(value, list):
+                report.error(path, f"{name} must be an array")
+                return
+            if not value:
+                report.error(path, "empty arrays are not allowed")
+            for i, item in enumerate(value):
+                check_one(item, f"{path}[{i}]", report, fix)
+    else:
+        def check(value, path, report, fix):
+            if isinstance(value, list):
+                report.error(path, f"{name} must not be an array")
+                return
+            check_one(value, path, report, fix)
+    return check
+
+
+def compile_profiles(profiles=PROFILES):
+    compiled = {}
+    return {rtype: compile_complex(rtype, elements, compiled) for rtype, elements in profiles.items()}
+
+
+class Validator:
+    """Compiled checkers for every profiled resource type, with savings counters"""
+
+    def __init__(self, profiles=PROFILES):
+        self.checkers = compile_profiles(profiles)
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.fixed = 0
+        self.rejected = 0
+
+    def validate(self, resource, fix=False):
+        """Check one resource; with fix=True, known-safe problems are repaired in place"""
+        report = ValidationReport()
+        checker = self.checkers.get(resource.get('resourceType'))
+        if checker is not None:
+            checker(resource, resource['resourceType'], report, fix)
+        return report
+
+    def check(self, resource):
+        """validate(fix=True) plus bookkeeping; used right before a resource is sent"""
+        report = self.validate(resource, fix=True)
+        with self.lock:
+            self.checked += 1
+            self.fixed += 1 if report.fixes else 0
+            self.rejected += 1 if report.errors else 0
+        return report
+
+    def summary(self):
+        return (f"Validator: {self.checked} checked, {self.fixed} fixed locally, "
+                f"{self.rejected} rejected locally ({self.rejected} round-trips saved)")
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_validator():
+    """Process-wide Validator, compiled on first use"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Validator()
+        return _default
+
+
+def rejection_response(url, report):
+    """A 422 response carrying the local OperationOutcome, shaped like the server's would be"""
+    res = requests.models.Response()
+    res.status_code = 422
+    res.url = url
+    res.reason = 'Unprocessable Entity (rejected locally)'
+    res.headers['Content-Type'] = 'application/fhir+json'
+    res.headers['X-Local-Validation'] = 'rejected'
+    res._content = json.dumps(report.to_operation_outcome()).encode('utf-8')
+    res.encoding = 'utf-8'
+    return res